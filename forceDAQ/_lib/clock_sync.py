@@ -0,0 +1,154 @@
+"""Clock synchronization between remote PC and recorder (NTP-style)
+
+The remote PC sends CLOCK_SYNC requests with its send time t1. The UDP
+process of the recorder replies immediately with t1, its receive time t2 and
+its send time t3. The remote PC stamps the reply with t4 (all times in
+microseconds). Per exchange:
+
+    offset = ((t2 - t1) + (t3 - t4)) / 2   (recorder - remote)
+    rtt = (t4 - t1) - (t3 - t2)
+
+Per synchronization round (several exchanges) the exchange with the smallest
+rtt is used. The drift is estimated by regression of the offsets of
+successive rounds.
+
+The remote PC sends the estimated mapping via CLOCK_MAPPING to the recorder,
+which logs it into the data file:
+
+    #SYNC,time,ref,offset,drift,rtt
+
+    time: recorder time (ms) of logging
+    ref: reference time (recorder time, us)
+    offset: recorder - remote time at ref (us)
+    drift: drift of the remote clock relative to recorder clock (ppm)
+    rtt: round trip time of the best exchange (us)
+
+Recorder times (e.g. of UDP markers) can thus be converted to the clock of
+the remote PC (see `to_sender_time`).
+"""
+
+import struct
+from collections import namedtuple
+import numpy as np
+
+from .types import GUIRemoteControlCommands as RcCmd, TAG_SYNC
+
+_SYNC = struct.Struct("<qqq")
+
+
+def encode_sync_request(t1):
+    return RcCmd.CLOCK_SYNC + _SYNC.pack(t1, 0, 0)
+
+
+def sync_reply(request, t2, t3):
+    """reply to a CLOCK_SYNC request (recorder side)"""
+    t1 = _SYNC.unpack_from(request, len(RcCmd.CLOCK_SYNC))[0]
+    return RcCmd.CLOCK_SYNC + _SYNC.pack(t1, t2, t3)
+
+
+def decode_sync_reply(data):
+    """returns t1, t2, t3"""
+    return _SYNC.unpack_from(data, len(RcCmd.CLOCK_SYNC))
+
+
+class ClockMapping(namedtuple("ClockMapping",
+                              ["ref", "offset", "drift", "rtt"])):
+    """mapping between recorder and remote clock (see module doc)"""
+
+    def offset_at(self, recorder_time_us):
+        return self.offset + self.drift * 1e-6 * (recorder_time_us - self.ref)
+
+    def to_sender_time(self, recorder_time_us):
+        """converts recorder time (us) to remote time (us)"""
+        return recorder_time_us - self.offset_at(recorder_time_us)
+
+    def to_recorder_time(self, remote_time_us):
+        """converts remote time (us) to recorder time (us)"""
+        # solve r = s + offset + drift * (r - ref) for r
+        d = self.drift * 1e-6
+        return (remote_time_us + self.offset - d * self.ref) / (1 - d)
+
+    def log_line(self, time):
+        return "{0},{1},{2},{3:.3f},{4:.4f},{5}".format(TAG_SYNC, time,
+                    int(self.ref), self.offset, self.drift, int(self.rtt))
+
+    @staticmethod
+    def from_log_line(line):
+        x = line.strip().split(",")
+        return ClockMapping(ref=int(x[2]), offset=float(x[3]),
+                            drift=float(x[4]), rtt=int(x[5]))
+
+
+class ClockSync(object):
+    """offset and drift estimation (remote PC side)"""
+
+    def __init__(self, n_rounds=20):
+        """n_rounds: number of recent rounds used for drift estimation"""
+        self.n_rounds = n_rounds
+        self._rounds = []  # (recorder time, offset, rtt)
+
+    def add_round(self, exchanges):
+        """add a synchronization round
+
+        exchanges: list of tuples (t1, t2, t3, t4)
+
+        returns the best exchange as (recorder time, offset, rtt) or None
+        """
+        best = None
+        for t1, t2, t3, t4 in exchanges:
+            rtt = (t4 - t1) - (t3 - t2)
+            if best is None or rtt < best[2]:
+                best = ((t2 + t3) / 2.0, ((t2 - t1) + (t3 - t4)) / 2.0, rtt)
+        if best is not None:
+            self._rounds.append(best)
+            self._rounds = self._rounds[-self.n_rounds:]
+        return best
+
+    @property
+    def mapping(self):
+        """the current ClockMapping or None"""
+        if len(self._rounds) == 0:
+            return None
+        t, offset, rtt = np.array(self._rounds).T
+        ref = t[-1]
+        if len(t) > 1 and t[-1] > t[0]:
+            # weighted by precision of the rounds (rtt)
+            w = 1.0 / np.maximum(rtt, 1)
+            drift, intercept = np.polyfit(t - ref, offset, 1, w=w)
+            return ClockMapping(ref=float(ref), offset=float(intercept),
+                                drift=float(drift) * 1e6, rtt=float(rtt[-1]))
+        return ClockMapping(ref=float(ref), offset=float(offset[-1]),
+                            drift=0.0, rtt=float(rtt[-1]))
+
+
+def read_clock_mappings(comments):
+    """reads the clock mappings from the comments of a data file
+    (see read_force_data.read_raw_data)
+
+    returns list of tuples (time, ClockMapping)
+    """
+    rtn = []
+    for ln in comments.split("\n"):
+        if ln.startswith(TAG_SYNC + ","):
+            rtn.append((int(ln.split(",")[1]), ClockMapping.from_log_line(ln)))
+    return rtn
+
+
+def to_sender_time(times, mappings):
+    """convert recorder times (ms) to the clock of the remote PC (ms)
+
+    For each time, the last mapping logged before is used (or the first
+    mapping, for times before the first mapping).
+
+    mappings: list of tuples (time, ClockMapping), see read_clock_mappings
+    """
+    times = np.asarray(times, dtype=float)
+    if len(mappings) == 0:
+        raise RuntimeError("No clock mapping available.")
+    log_times = np.array([t for t, _ in mappings])
+    idx = np.maximum(np.searchsorted(log_times, times, side="right") - 1, 0)
+    rtn = np.empty(times.shape)
+    for i, (_, mp) in enumerate(mappings):
+        sel = idx == i
+        rtn[sel] = mp.to_sender_time(times[sel] * 1000) / 1000.0
+    return rtn
@@ -0,0 +1,277 @@
+"""Level change and response min/max detection
+
+Online detection in the sensor process (see SensorProcess.set_thresholds),
+which runs on every sample and is thus independent of the GUI loop. The
+semantics are those of `types.Thresholds`, but durations are counted in
+samples:
+
+    level: number of thresholds that are smaller or equal than the value
+           (0: below the smallest threshold)
+    level change detection: reports the first level that differs from the
+           level at start of the detection
+    response min/max detection: after the first level change, the
+           minimum and maximum level (including the start level) of
+           `n_samples` samples, beginning with the sample of the level
+           change, is reported
+
+ThresholdClassifier classifies and detects on blocks of multiple channels
+(vectorized), DetectionEngine uses it for the online detection of one
+sensor, for which levels are determined from the moving average of the
+detection parameter.
+"""
+
+from collections import deque
+import numpy as np
+
+LEVEL_CHANGE = "level_change"
+RESPONSE_MINMAX = "response_minmax"
+
+
+_IDLE, _LEVEL_CHANGE, _WAIT_RESPONSE, _RESPONSE = 0, 1, 2, 3
+
+
+class ThresholdClassifier(object):
+    """vectorized level classification and detection for multiple channels
+
+    Levels of whole sample blocks (all channels) are determined with one
+    np.searchsorted call. The level change and response min/max detection
+    of all channels advance over the block with array operations.
+
+    Example::
+
+        classifier = ThresholdClassifier([-10, 10, 20], n_channels=2)
+        classifier.start_level_change_detection(channel=0, start_level=1)
+        for values in blocks:  # (n_samples, n_channels)
+            levels = classifier.get_level(values)
+            for channel, idx, event, value in classifier.process(levels):
+                ...
+
+    """
+
+    def __init__(self, thresholds, n_channels=1):
+        self.thresholds = np.sort(np.asarray(thresholds, dtype=float))
+        self.n_channels = n_channels
+        self._state = np.zeros(n_channels, dtype=int)
+        self._start_level = np.zeros(n_channels, dtype=int)
+        self._n_samples = np.zeros(n_channels, dtype=int)
+        self._remaining = np.zeros(n_channels, dtype=int)
+        self._min = np.zeros(n_channels, dtype=int)
+        self._max = np.zeros(n_channels, dtype=int)
+
+    def get_level(self, values):
+        """levels of values (array of any shape), see
+        types.Thresholds.get_level"""
+        levels = np.searchsorted(self.thresholds, values, side="right")
+        if len(self.thresholds) == 0:
+            levels = levels + 1
+        return levels
+
+    def is_detecting(self, channel=None):
+        """is detecting in channel or, if channel is None, in any channel"""
+        if channel is None:
+            return bool(np.any(self._state != _IDLE))
+        return self._state[channel] != _IDLE
+
+    def start_level_change_detection(self, channel, start_level):
+        self._state[channel] = _LEVEL_CHANGE
+        self._start_level[channel] = start_level
+
+    def start_response_minmax_detection(self, channel, start_level,
+                                        n_samples):
+        """n_samples: length of the response period (samples), which begins
+        with the first level change"""
+        self._state[channel] = _WAIT_RESPONSE
+        self._start_level[channel] = start_level
+        self._n_samples[channel] = max(1, int(n_samples))
+
+    def stop(self, channel=None):
+        if channel is None:
+            self._state[:] = _IDLE
+        else:
+            self._state[channel] = _IDLE
+
+    def process(self, levels):
+        """advance the detection over a block of levels (n_samples,
+        n_channels)
+
+        returns list of detected events: tuples (channel, sample index in
+        block, event, value)
+            LEVEL_CHANGE: value is the new level
+            RESPONSE_MINMAX: value is a tuple (min level, max level)
+        """
+        levels = np.asarray(levels).reshape((len(levels), self.n_channels))
+        n = len(levels)
+        if n == 0 or not np.any(self._state):
+            return []
+        rtn = []
+        changed = levels != self._start_level
+        any_change = changed.any(axis=0)
+        first_change = np.argmax(changed, axis=0)
+
+        # level change
+        for ch in np.flatnonzero((self._state == _LEVEL_CHANGE) & any_change):
+            idx = first_change[ch]
+            rtn.append((int(ch), int(idx), LEVEL_CHANGE,
+                        int(levels[idx, ch])))
+            self._state[ch] = _IDLE
+
+        # response onset
+        onset = np.zeros(self.n_channels, dtype=int)
+        new = (self._state == _WAIT_RESPONSE) & any_change
+        onset[new] = first_change[new]
+        self._remaining[new] = self._n_samples[new]
+        self._min[new] = self._start_level[new]
+        self._max[new] = self._start_level[new]
+        self._state[new] = _RESPONSE
+
+        # response period
+        resp = np.flatnonzero(self._state == _RESPONSE)
+        if len(resp) > 0:
+            end = np.minimum(onset[resp] + self._remaining[resp], n)
+            idx = np.arange(n)[:, np.newaxis]
+            in_period = (idx >= onset[resp]) & (idx < end)
+            lv = levels[:, resp]
+            self._min[resp] = np.minimum(self._min[resp], np.min(
+                np.where(in_period, lv, np.iinfo(int).max), axis=0))
+            self._max[resp] = np.maximum(self._max[resp], np.max(
+                np.where(in_period, lv, np.iinfo(int).min), axis=0))
+            self._remaining[resp] -= end - onset[resp]
+            for i in np.flatnonzero(self._remaining[resp] == 0):
+                ch = resp[i]
+                # reported with the last sample of the response period
+                rtn.append((int(ch), int(end[i] - 1), RESPONSE_MINMAX,
+                            (int(self._min[ch]), int(self._max[ch]))))
+                self._state[ch] = _IDLE
+
+        return rtn
+
+
+class DetectionEngine(object):
+    """level change and response min/max detection on sample blocks
+
+    Example::
+
+        engine = DetectionEngine(thresholds=[-10, 10, 20], parameter=2)
+        engine.start_level_change_detection()
+        for times, forces in blocks:
+            for time, event, value in engine.process(times, forces):
+                ...
+
+    If no detection is running, blocks are not classified and only the
+    values of the moving average window are kept (see update).
+    """
+
+    def __init__(self, thresholds, parameter=2, moving_average_size=5):
+        """
+        Parameters
+        ----------
+        thresholds : list of float
+        parameter : int
+            index of the detection parameter in the force data (0-5)
+        moving_average_size : int
+            number of samples of the moving average
+
+        """
+        self.classifier = ThresholdClassifier(thresholds, n_channels=1)
+        self.parameter = parameter
+        self.moving_average_size = max(1, int(moving_average_size))
+        # last values of the detection parameter (moving average window)
+        self._window = deque(maxlen=self.moving_average_size)
+        self._pending = None  # start of detection before the first sample
+
+    @property
+    def thresholds(self):
+        return self.classifier.thresholds
+
+    @property
+    def is_detecting(self):
+        return self._pending is not None or self.classifier.is_detecting(0)
+
+    def get_level(self, values):
+        """level(s) of value(s), see types.Thresholds.get_level"""
+        return self.classifier.get_level(values)
+
+    @property
+    def current_level(self):
+        """level of the current moving average or None"""
+        if len(self._window) == 0:
+            return None
+        return int(self.get_level(sum(self._window) / len(self._window)))
+
+    def _start(self, mode, n_samples=None):
+        level = self.current_level
+        if level is None:
+            self._pending = (mode, n_samples)  # start with first sample
+        elif mode == LEVEL_CHANGE:
+            self._pending = None
+            self.classifier.start_level_change_detection(0, level)
+        else:
+            self._pending = None
+            self.classifier.start_response_minmax_detection(0, level,
+                                                            n_samples)
+
+    def start_level_change_detection(self):
+        """starts level change detection (level of current moving average
+        is the start level)"""
+        self._start(LEVEL_CHANGE)
+
+    def start_response_minmax_detection(self, n_samples):
+        """starts response min/max detection
+
+        n_samples: number of samples of the response period
+        """
+        self._start(RESPONSE_MINMAX, n_samples)
+
+    def stop(self):
+        self._pending = None
+        self.classifier.stop()
+
+    def moving_average(self, values):
+        """moving average of block of values (keeps the state)"""
+        w = self.moving_average_size
+        tail = list(self._window)[-(w - 1):] if w > 1 else []
+        x = np.append(tail, values)
+        cs = np.cumsum(np.append(0.0, x))
+        end = np.arange(len(tail) + 1, len(x) + 1)
+        start = np.maximum(end - w, 0)
+        self._window.extend(x[-w:])
+        return (cs[end] - cs[start]) / (end - start)
+
+    def update(self, values):
+        """adds values of the detection parameter to the moving average
+        window without classification (no detection running)"""
+        self._window.extend(values)
+
+    def process(self, times, forces):
+        """process a block of samples
+
+        Parameters
+        ----------
+        times : array of timestamps
+        forces : array (n_samples, 6) or (n_samples, ) with the values of
+                 the detection parameter
+
+        returns list of detected events: tuples (time, event, value)
+            LEVEL_CHANGE: value is the new level
+            RESPONSE_MINMAX: value is a tuple (min level, max level)
+        """
+        forces = np.asarray(forces, dtype=float)
+        if forces.ndim > 1:
+            forces = forces[:, self.parameter]
+        if not self.is_detecting:
+            self.update(forces)
+            return []
+        if len(forces) == 0:
+            return []
+        levels = self.get_level(self.moving_average(forces))
+        if self._pending is not None:
+            # no sample before start, first sample defines the start level
+            mode, n_samples = self._pending
+            if mode == LEVEL_CHANGE:
+                self.classifier.start_level_change_detection(0, levels[0])
+            else:
+                self.classifier.start_response_minmax_detection(
+                                                0, levels[0], n_samples)
+            self._pending = None
+        return [(times[idx], event, value) for _, idx, event, value in
+                self.classifier.process(levels)]
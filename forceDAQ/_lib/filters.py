@@ -0,0 +1,266 @@
+"""Online digital filtering and decimation of force data
+
+The filters run in the sensor process on blocks of samples (all six force
+channels) and keep their state between blocks:
+
+    low-pass: Butterworth low-pass as cascade of biquads
+    notch: biquad notch filter, e.g. for mains hum (50 or 60 Hz)
+    decimation: keeps every n-th sample. The low-pass is required as
+        anti-aliasing filter, i.e., its cutoff must be below the Nyquist
+        frequency of the decimated data.
+
+The filters are causal. The filtered data are therefore delayed relative to
+the raw data (group delay of the low-pass).
+
+The biquad coefficients are calculated with the bilinear transform
+(second-order sections, as scipy.signal). If scipy is installed, blocks are
+filtered with scipy.signal.sosfilt, otherwise with numpy.
+"""
+
+import numpy as np
+
+try:
+    from scipy.signal import sosfilt as _sosfilt
+except ImportError:
+    _sosfilt = None
+
+FILTERED_DATA_SUFFIX = ".filtered.csv"
+
+
+def filtered_data_filename(data_filename):
+    """returns the filename of the filtered data file"""
+    zipped = ".gz" if data_filename.endswith(".gz") else ""
+    for suffix in (".csv.gz", ".csv", ".gz"):
+        if data_filename.endswith(suffix):
+            data_filename = data_filename[:-len(suffix)]
+            break
+    return data_filename + FILTERED_DATA_SUFFIX + zipped
+
+
+def lowpass_sos(cutoff, rate, order=4):
+    """second-order sections (n_sections, 6) of a Butterworth low-pass
+
+    cutoff, rate: cutoff frequency and sampling rate in Hz
+    """
+    if not 0 < cutoff < rate / 2.0:
+        raise RuntimeError("Low-pass cutoff has to be between 0 and the "
+                           "Nyquist frequency ({} Hz)".format(rate / 2.0))
+    order = int(order)
+    if order < 1:
+        raise RuntimeError("Filter order has to be at least 1")
+    w0 = 2 * np.pi * cutoff / rate
+    cos_w0 = np.cos(w0)
+    rtn = []
+    for k in range(order // 2):
+        # quality factor of the k-th pole pair
+        q = 1.0 / (2 * np.sin((2 * k + 1) * np.pi / (2 * order)))
+        alpha = np.sin(w0) / (2 * q)
+        b = np.array([1 - cos_w0, 2 * (1 - cos_w0), 1 - cos_w0]) / 2.0
+        a = np.array([1 + alpha, -2 * cos_w0, 1 - alpha])
+        rtn.append(np.append(b / a[0], a / a[0]))
+    if order % 2 == 1:
+        # first-order section
+        k = np.tan(w0 / 2)
+        rtn.append(np.array([k, k, 0, 1 + k, k - 1, 0]) / (1 + k))
+    return np.array(rtn)
+
+
+def notch_sos(freq, rate, q=30):
+    """second-order section (1, 6) of a notch filter
+
+    freq, rate: notch frequency and sampling rate in Hz
+    q: quality factor (freq / bandwidth)
+    """
+    if not 0 < freq < rate / 2.0:
+        raise RuntimeError("Notch frequency has to be between 0 and the "
+                           "Nyquist frequency ({} Hz)".format(rate / 2.0))
+    w0 = 2 * np.pi * freq / rate
+    alpha = np.sin(w0) / (2.0 * q)
+    b = np.array([1, -2 * np.cos(w0), 1])
+    a = np.array([1 + alpha, -2 * np.cos(w0), 1 - alpha])
+    return np.array([np.append(b / a[0], a / a[0])])
+
+
+class SOSFilter(object):
+    """IIR filter of second-order sections for multiple channels
+
+    The filter state is initialized with the steady state of the first
+    sample to avoid transients at start (e.g. force offsets).
+    """
+
+    def __init__(self, sos, n_channels=6):
+        self.sos = np.atleast_2d(np.asarray(sos, dtype=float))
+        self.n_channels = n_channels
+        self._zi = None
+
+    def reset(self):
+        self._zi = None
+
+    def _init_state(self, x0):
+        # steady state of each section (transposed direct form II)
+        zi = np.empty((len(self.sos), 2, self.n_channels))
+        x = x0
+        for s, (b0, b1, b2, a0, a1, a2) in enumerate(self.sos):
+            y = x * (b0 + b1 + b2) / (1 + a1 + a2)
+            zi[s, 0] = y - b0 * x
+            zi[s, 1] = b2 * x - a2 * y
+            x = y
+        self._zi = zi
+
+    def process(self, values):
+        """filter block of values (n_samples, n_channels)
+
+        returns the filtered values
+        """
+        x = np.asarray(values, dtype=float).reshape((-1, self.n_channels))
+        if len(x) == 0:
+            return x
+        if self._zi is None:
+            self._init_state(x[0])
+        if _sosfilt is not None and len(x) > 1:
+            y, self._zi = _sosfilt(self.sos, x, axis=0, zi=self._zi)
+            return y
+        y = x.copy()
+        zi = self._zi
+        for s, (b0, b1, b2, _, a1, a2) in enumerate(self.sos):
+            z0, z1 = zi[s]
+            for i in range(len(y)):
+                xi = y[i]
+                yi = b0 * xi + z0
+                z0 = b1 * xi - a1 * yi + z1
+                z1 = b2 * xi - a2 * yi
+                y[i] = yi
+            zi[s, 0], zi[s, 1] = z0, z1
+        return y
+
+
+class Decimator(object):
+    """keeps every n-th sample (the phase is kept between blocks)"""
+
+    def __init__(self, factor):
+        self.factor = max(1, int(factor))
+        self._phase = 0
+
+    def reset(self):
+        self._phase = 0
+
+    def indices(self, n_samples):
+        """indices of the samples of the next block that are kept"""
+        rtn = np.arange((-self._phase) % self.factor, n_samples, self.factor)
+        self._phase = (self._phase + n_samples) % self.factor
+        return rtn
+
+
+class FilterSettings(object):
+    """settings of the online filtering (see FilterPipeline)"""
+
+    def __init__(self, lowpass=None, lowpass_order=4, notch=None, notch_q=30,
+                 decimation=1):
+        """
+        Parameters
+        ----------
+        lowpass : float, optional
+            cutoff frequency (Hz) of the Butterworth low-pass
+        lowpass_order : int
+        notch : float, optional
+            notch frequency (Hz), e.g. mains hum (50 or 60 Hz)
+        notch_q : float
+            quality factor of the notch filter
+        decimation : int
+            decimation factor (1: no decimation). Requires a low-pass with
+            a cutoff below the Nyquist frequency of the decimated data.
+
+        """
+        self.lowpass = lowpass
+        self.lowpass_order = lowpass_order
+        self.notch = notch
+        self.notch_q = notch_q
+        self.decimation = max(1, int(decimation))
+
+    def __str__(self):
+        txt = []
+        if self.lowpass is not None:
+            txt.append("lowpass={} Hz (order {})".format(self.lowpass,
+                                                         self.lowpass_order))
+        if self.notch is not None:
+            txt.append("notch={} Hz (q={})".format(self.notch, self.notch_q))
+        if self.decimation > 1:
+            txt.append("decimation={}".format(self.decimation))
+        return ", ".join(txt)
+
+
+class FilterPipeline(object):
+    """online filtering (low-pass, notch) and decimation of sample blocks
+
+    Example::
+
+        filters = FilterPipeline(FilterSettings(lowpass=50, notch=50,
+                                                decimation=5), rate=5000)
+        for times, forces in blocks:
+            times, forces = filters.process(times, forces)
+
+    """
+
+    def __init__(self, settings, rate, n_channels=6):
+        """
+        Parameters
+        ----------
+        settings : FilterSettings
+        rate : float
+            sampling rate (Hz) of the raw data
+        n_channels : int
+
+        """
+        self.settings = settings
+        self.rate = float(rate)
+        sos = []
+        if settings.lowpass is not None:
+            sos.extend(lowpass_sos(settings.lowpass, self.rate,
+                                   settings.lowpass_order))
+        if settings.notch is not None:
+            sos.extend(notch_sos(settings.notch, self.rate, settings.notch_q))
+        if settings.decimation > 1 and (settings.lowpass is None or
+                    settings.lowpass >= self.output_rate / 2.0):
+            raise RuntimeError("Decimation requires a low-pass with a cutoff "
+                               "below {} Hz (anti-aliasing)".format(
+                                                    self.output_rate / 2.0))
+        if len(sos) > 0:
+            self.filter = SOSFilter(sos, n_channels=n_channels)
+        else:
+            self.filter = None
+        self.decimator = Decimator(settings.decimation)
+
+    @property
+    def output_rate(self):
+        """sampling rate of the filtered data"""
+        return self.rate / self.settings.decimation
+
+    def reset(self):
+        if self.filter is not None:
+            self.filter.reset()
+        self.decimator.reset()
+
+    def process(self, times, values):
+        """filter and decimate a block of samples
+
+        Parameters
+        ----------
+        times : array of timestamps
+        values : array (n_samples, n_channels)
+
+        returns times and values of the filtered samples
+        """
+        idx, values = self.filter_and_decimate(values)
+        return np.asarray(times)[idx], values
+
+    def filter_and_decimate(self, values):
+        """filter and decimate a block of values (n_samples, n_channels)
+
+        returns the indices of the kept samples and their filtered values
+        """
+        if self.filter is not None:
+            values = self.filter.process(values)
+        else:
+            values = np.asarray(values, dtype=float)
+        idx = self.decimator.indices(len(values))
+        return idx, values[idx]
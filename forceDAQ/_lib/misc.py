@@ -1,5 +1,6 @@
 from .timer import get_time_ms
 from os import listdir, path
+import numpy as np
 
 def N2g(N):
     kg = N/9.81
@@ -54,71 +55,146 @@ def find_calibration_file(calibration_folder, sensor_name,
 
 """Sensor History with moving average filtering and distance, velocity"""
 class SensorHistory(object):
-    """The Sensory History keeps track of the last n recorded sample and
-    calculates online the moving average (running mean).
+    """The Sensory History keeps track of the last n recorded samples of
+    all sensors and calculates online the moving average (running mean),
+    the moving median and an exponential moving average.
+
+    The history of all sensors is a ring buffer (numpy array, shape:
+    n_sensors, history_size, number_of_parameter), which is prefilled with
+    zeros. The statistics are thus always calculated over history_size
+    samples. The running sums are updated incrementally with compensated
+    (Kahan) summation and are recalculated every `correction_interval`
+    samples.
 
     SensorHistory.moving_average
 
     """
 
-    def __init__(self, history_size, number_of_parameter):
-        self.history = [[0] * number_of_parameter] * history_size
-        self.moving_average = [0] * number_of_parameter
-        self._correction_cnt = 0
-        self._previous_moving_average = self.moving_average
+    def __init__(self, history_size, number_of_parameter, n_sensors=1,
+                 ema_alpha=None, correction_interval=10000):
+        """
+        ema_alpha: smoothing factor of the exponential moving average
+            (default: 2 / (history_size + 1))
+        """
+        self._buffer = np.zeros((n_sensors, history_size,
+                                 number_of_parameter))
+        self._sum = np.zeros((n_sensors, number_of_parameter))
+        self._previous_sum = np.zeros((n_sensors, number_of_parameter))
+        self._compensation = np.zeros((n_sensors, number_of_parameter))
+        self._ema = np.zeros((n_sensors, number_of_parameter))
+        self._pos = np.zeros(n_sensors, dtype=int)  # next write position
+        self._n = np.zeros(n_sensors, dtype=int)  # number of samples
+        if ema_alpha is None:
+            ema_alpha = 2.0 / (history_size + 1)
+        self.ema_alpha = ema_alpha
+        self.correction_interval = correction_interval
+        self._correction_cnt = np.zeros(n_sensors, dtype=int)
 
     def __str__(self):
         return str(self.history)
 
-    def update(self, values):
-        """Update history and calculate moving average
-
-        (correct for accumulated rounding errors ever 10000 samples)
+    def update(self, values, sensor=0):
+        """Update history with one sample
 
         Parameter
         ---------
         values : list of values for all sensor parameters
 
         """
+        self.update_block(np.asarray(values, dtype=float)[np.newaxis, :],
+                          sensor=sensor)
 
-        self._previous_moving_average = self.moving_average
-        pop = self.history.pop(0)
-        self.history.append(values)
-        # pop first element and calc moving average
-        if self._correction_cnt > 10000:
-            self._correction_cnt = 0
-            self.moving_average = self.calc_history_average()
+    def update_block(self, values, sensor=0):
+        """Update history with a block of samples (n_samples,
+        number_of_parameter) and calculate moving average
+        """
+        values = np.asarray(values, dtype=float)
+        n = len(values)
+        if n == 0:
+            return
+        size = self.history_size
+        buffer = self._buffer[sensor]
+        self._previous_sum[sensor] = self._sum[sensor]
+
+        # exponential moving average
+        a = self.ema_alpha
+        if self._n[sensor] == 0:
+            self._ema[sensor] = values[0]
+        w = a * (1 - a) ** np.arange(n - 1, -1, -1)
+        self._ema[sensor] = (1 - a) ** n * self._ema[sensor] + w.dot(values)
+
+        self._correction_cnt[sensor] += n
+        if n >= size:
+            buffer[:, :] = values[-size:]
+            self._pos[sensor] = 0
+            self._n[sensor] = size
+            self._correction_cnt[sensor] = self.correction_interval
         else:
-            self._correction_cnt += 1
-            self.moving_average = list(map(
-                lambda x: x[0] + (float(x[1] - x[2]) / len(self.history)),
-                zip(self.moving_average, values, pop)))
-
+            idx = (self._pos[sensor] + np.arange(n)) % size
+            n_old = max(0, self._n[sensor] + n - size)  # overwritten
+            delta = values.sum(axis=0) - buffer[idx[n - n_old:]].sum(axis=0)
+            # Kahan summation
+            y = delta - self._compensation[sensor]
+            t = self._sum[sensor] + y
+            self._compensation[sensor] = (t - self._sum[sensor]) - y
+            self._sum[sensor] = t
+            buffer[idx] = values
+            self._pos[sensor] = (idx[-1] + 1) % size
+            self._n[sensor] = min(size, self._n[sensor] + n)
+
+        if self._correction_cnt[sensor] >= self.correction_interval:
+            # correct accumulated rounding errors
+            self._correction_cnt[sensor] = 0
+            self._sum[sensor] = buffer.sum(axis=0)
+            self._compensation[sensor] = 0
 
     def calc_history_average(self):
-        """Calculate history averages for all sensor parameter.
+        """Calculate history averages for all sensors and parameters.
 
         The method is more time consuming than calling the property
         `moving_average`. It is does however not suffer from accumulated
         rounding-errors such as moving average.
 
         """
+        return self._buffer.mean(axis=1)
 
-        s = [float(0)] * self.number_of_parameter
-        for t in self.history:
-            s = list(map(lambda x: x[0] + x[1], zip(s, t)))
-        return list(map(lambda x: x / len(self.history), s))
+    @property
+    def moving_average(self):
+        """moving average (array: n_sensors, number_of_parameter)"""
+        return self._sum / self.history_size
 
+    @property
+    def previous_moving_average(self):
+        """moving average before the last update (array: n_sensors,
+        number_of_parameter)"""
+        return self._previous_sum / self.history_size
+
+    @property
+    def moving_median(self):
+        """moving median (array: n_sensors, number_of_parameter)"""
+        return np.median(self._buffer, axis=1)
+
+    @property
+    def exponential_moving_average(self):
+        """exponential moving average (array: n_sensors,
+        number_of_parameter)"""
+        return self._ema.copy()
+
+    @property
+    def history(self):
+        """samples of all sensors in chronological order (array: n_sensors,
+        history_size, number_of_parameter)"""
+        return np.array([np.roll(self._buffer[s], -self._pos[s], axis=0)
+                         for s in range(self.n_sensors)])
 
     @property
     def history_size(self):
-        return len(self.history)
+        return self._buffer.shape[1]
 
     @property
     def number_of_parameter(self):
-        return len(self.history[0])
+        return self._buffer.shape[2]
 
     @property
-    def previous_moving_average(self):
-        return self._previous_moving_average
-
+    def n_sensors(self):
+        return self._buffer.shape[0]
@@ -1,11 +1,14 @@
-from .timer import get_time
+from .timer import get_time_ns
 import numpy as np
 
 class PollingTimeProfile(object):
 
-    def __init__(self, timing_range=10):
+    def __init__(self, timing_range=10, resolution_us=1000):
+        """histogram of polling intervals, timing_range bins of resolution_us
+        (last bin: longer intervals)"""
         self._last = None
-        self._timing_range = 10
+        self._timing_range = timing_range
+        self._resolution_ns = int(resolution_us * 1000)
         self._zero_cnt = 0
 
         #self._zero_time_polling_frequency = {}
@@ -15,8 +18,11 @@ class PollingTimeProfile(object):
         self._last = None
 
     def update(self, time_ms):
+        self.update_ns(int(time_ms * 1000000))
+
+    def update_ns(self, time_ns):
         if self._last is not None:
-            d = time_ms - self._last
+            d = (time_ns - self._last) // self._resolution_ns
             if d > self._timing_range:
                 d = self._timing_range
             self.profile_frequency[d] += 1
@@ -30,10 +36,10 @@ class PollingTimeProfile(object):
             #        self._zero_time_polling_frequency[self._zero_cnt] = 1
             #    self._zero_cnt = 0
 
-        self._last = time_ms
+        self._last = time_ns
 
     def tick(self):
-        self.update(int(1000*get_time()))
+        self.update_ns(get_time_ns())
 
     @property
     def profile_percent(self):
@@ -0,0 +1,178 @@
+"""Processing stages of the sensor process
+
+The sensor process passes each block of polled samples through a pipeline of
+processing stages. A stage transforms the block and returns a (new) block for
+the next stage, e.g. a filtered or resampled block. Side outputs (data file,
+shared memory, UDP peers) are written via the stage context:
+
+    class PeakForce(ProcessingStage):
+
+        def __init__(self):
+            self.peak = sharedctypes.RawValue(ct.c_double)  # shared memory
+
+        def transform(self, block):
+            self.peak.value = max(self.peak.value, np.max(block.forces[:, 2]))
+            return block
+
+    SensorProcess(settings, stages=[PeakForce()])
+
+Stages are created in the main process and copied to the sensor process. The
+pipeline counts the number of calls and the processing time of each stage
+(see ProcessingPipeline.timing), the counters can be read from any process.
+"""
+
+import ctypes as ct
+from multiprocessing import sharedctypes
+import numpy as np
+
+from .timer import get_time
+
+
+class SampleBlock(object):
+    """block of samples (list of ForceData)
+
+    The arrays (times, forces, trigger) are created on first access. Stages
+    that change the values of the samples have therefore to return a new
+    block.
+    """
+
+    def __init__(self, samples):
+        self.samples = samples
+        self._times = None
+        self._forces = None
+        self._trigger = None
+
+    def __len__(self):
+        return len(self.samples)
+
+    @property
+    def times(self):
+        """array of timestamps (n_samples, )"""
+        if self._times is None:
+            self._times = np.array([d.time for d in self.samples])
+        return self._times
+
+    @property
+    def forces(self):
+        """array of forces (n_samples, 6)"""
+        if self._forces is None:
+            self._forces = np.array([d.forces for d in self.samples],
+                                    dtype=float).reshape((-1, 6))
+        return self._forces
+
+    @property
+    def trigger(self):
+        """array of trigger values (n_samples, 2)"""
+        if self._trigger is None:
+            self._trigger = np.array([d.trigger for d in self.samples],
+                                     dtype=float).reshape((-1, 2))
+        return self._trigger
+
+
+class StageContext(object):
+    """context of the processing stages in the sensor process"""
+
+    def __init__(self, device_id, rate, timer, buffer, udp_send_queue=None):
+        self.device_id = device_id
+        self.rate = rate
+        self.timer = timer
+        self.udp_send_queue = udp_send_queue
+        self._buffer = buffer
+
+    def record(self, data):
+        """add data (ForceData, DAQEvents, ...) to the recording buffer"""
+        self._buffer.append(data)
+
+    def record_all(self, data):
+        self._buffer.extend(data)
+
+    def send(self, data):
+        """send bytes to the remote control peers (via the UDP process)"""
+        if self.udp_send_queue is not None:
+            self.udp_send_queue.put(data)
+
+
+class ProcessingStage(object):
+    """base class of processing stages"""
+
+    @property
+    def name(self):
+        return self.__class__.__name__
+
+    def setup(self, context):
+        """called once in the sensor process (StageContext)"""
+        self.context = context
+
+    def start(self):
+        """called at the start of polling"""
+        pass
+
+    def transform(self, block):
+        """process a SampleBlock and return the block for the next stage"""
+        return block
+
+    def stop(self):
+        """called at pause of polling"""
+        pass
+
+
+class ProcessingPipeline(object):
+
+    def __init__(self, stages):
+        """Create the pipeline before the sensor process is started"""
+        self.stages = list(stages)
+        # number of calls, total and maximum time (sec) of each stage
+        self._timing = sharedctypes.RawArray(ct.c_double,
+                                             3 * len(self.stages))
+
+    def setup(self, context):
+        for stage in self.stages:
+            stage.setup(context)
+
+    def start(self):
+        for stage in self.stages:
+            stage.start()
+
+    def stop(self):
+        for stage in self.stages:
+            stage.stop()
+
+    def process(self, block):
+        """pass a block through all stages
+
+        returns the block of the last stage
+        """
+        timing = self._timing
+        for i, stage in enumerate(self.stages):
+            if len(block) == 0:
+                break
+            t = get_time()
+            block = stage.transform(block)
+            t = get_time() - t
+            timing[3 * i] += 1
+            timing[3 * i + 1] += t
+            if t > timing[3 * i + 2]:
+                timing[3 * i + 2] = t
+        return block
+
+    def reset_timing(self):
+        for i in range(len(self._timing)):
+            self._timing[i] = 0
+
+    def timing(self):
+        """timing of the stages
+
+        returns list of tuples (name, number of calls, mean time (us),
+        maximum time (us))
+        """
+        rtn = []
+        for i, stage in enumerate(self.stages):
+            n, total, maximum = self._timing[3 * i:3 * i + 3]
+            mean = total / n * 1e6 if n > 0 else 0.0
+            rtn.append((stage.name, int(n), mean, maximum * 1e6))
+        return rtn
+
+    def get_timing_str(self):
+        return "stage timing [{}]".format(", ".join(
+            "{}: n={}, mean={:.1f}us, max={:.1f}us".format(*x)
+            for x in self.timing()))
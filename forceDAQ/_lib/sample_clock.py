@@ -0,0 +1,208 @@
+"""Sample timestamps from the hardware sample clock
+
+Each sample has its hardware sample index (number of samples acquired by the
+DAQ before it). The timestamp of a sample is derived from the index and the
+sampling rate:
+
+    time = ref_time + (index - ref_index) * period * (1 + drift)
+
+ref_time and drift are estimated online from the host clock (running
+correlation). After each read, the sensor knows the index of the latest
+acquired sample and the host time. The host time is always later than the
+acquisition of the sample (transfer, buffering and OS delays), thus the lower
+envelope of host time minus index * period estimates the clock offset
+(minimum per window of `window` samples). The drift of the sample clock
+relative to the host clock is estimated by regression of the minima of the
+recent windows.
+
+A new estimate does not change the timestamps of the samples that have
+already been timestamped. The difference to the previous estimate is slewed
+in linearly (at least over one window), thus the timestamps are continuous
+and monotonic.
+
+Each new estimate is logged into the data file:
+
+    #CLOCK,time,device_id,rate,ref_index,ref_time,drift
+
+    time: host time (ms) of logging
+    rate: nominal sampling rate (Hz)
+    ref_index: sample index of the reference sample
+    ref_time: host time of the reference sample (us)
+    drift: drift of the sample clock relative to host clock (ppm)
+
+Timestamps can thus be recalculated offline with the final estimate (see
+`SampleClockMapping.time_us`).
+"""
+
+from collections import namedtuple, deque
+import numpy as np
+
+from .types import TAG_SAMPLE_CLOCK
+
+
+class SampleClockMapping(namedtuple("SampleClockMapping",
+                                    ["time", "device_id", "rate", "ref_index",
+                                     "ref_time", "drift"])):
+    """mapping between sample index and host time (see module doc)"""
+
+    def time_us(self, index):
+        """host time (us) of sample index"""
+        return self.ref_time + (index - self.ref_index) * \
+               (1e6 / self.rate) * (1 + self.drift * 1e-6)
+
+    def log_line(self):
+        return "{0},{1},{2},{3},{4},{5:.1f},{6:.3f}".format(TAG_SAMPLE_CLOCK,
+                    self.time, self.device_id, self.rate, int(self.ref_index),
+                    self.ref_time, self.drift)
+
+    @staticmethod
+    def from_log_line(line):
+        x = line.strip().split(",")
+        return SampleClockMapping(time=float(x[1]), device_id=int(x[2]),
+                                  rate=float(x[3]), ref_index=int(x[4]),
+                                  ref_time=float(x[5]), drift=float(x[6]))
+
+
+class SampleClock(object):
+    """running correlation of sample indices and host clock
+
+    Example::
+
+        clock = SampleClock(rate=1000)
+        clock.update(index=n_acquired - 1, host_time_us=timer.time_us,
+                     next_index=sample_index)
+        t = clock.time_ns(sample_index)
+
+    """
+
+    def __init__(self, rate, window=1000, n_windows=60, device_id=0):
+        """
+        Parameters
+        ----------
+        rate : float
+            nominal sampling rate (Hz)
+        window : int
+            number of samples per offset estimation (minimum)
+        n_windows : int
+            number of recent windows used for the drift estimation
+
+        """
+        self.rate = float(rate)
+        self.window = window
+        self.device_id = device_id
+        self._period_us = 1e6 / self.rate
+        self._windows = deque(maxlen=n_windows)  # (index, offset)
+        self.reset()
+
+    def reset(self):
+        """reset at start of acquisition (sample index restarts at 0)"""
+        self._windows.clear()
+        self._min = None  # (offset, index) of current window
+        self._window_start = None  # first index of current window
+        self._ref_index = 0
+        self._ref_time = None
+        self._drift = 0.0
+        self._slew = None  # (start index, step (us), n samples)
+        self._last_host_time = 0
+        self._new_mapping = False
+
+    @property
+    def drift(self):
+        """estimated drift of the sample clock (ppm)"""
+        return self._drift
+
+    def update(self, index, host_time_us, next_index=None):
+        """add a correlation point
+
+        index: index of the latest acquired sample
+        host_time_us: host time (us) at which the sample was available
+        next_index: index of the next sample that will be timestamped, a new
+            estimate is slewed in from this sample on (default: index)
+        """
+        if next_index is None:
+            next_index = index
+        self._last_host_time = host_time_us
+        offset = host_time_us - index * self._period_us
+        if self._window_start is None:
+            self._window_start = index
+        if self._min is None or offset < self._min[0]:
+            self._min = (offset, index)
+            if len(self._windows) == 0:
+                # no complete window yet: running minimum
+                self._set_estimate(index, host_time_us, 0.0, next_index)
+        if index - self._window_start + 1 >= self.window:
+            self._windows.append((self._min[1], self._min[0]))
+            self._min = None
+            self._window_start = None
+            self._estimate(next_index)
+
+    def _estimate(self, next_index):
+        idx, offset = np.array(self._windows).T
+        ref_index = idx[-1]
+        if len(idx) > 1:
+            slope, intercept = np.polyfit(idx - ref_index, offset, 1)
+        else:
+            slope, intercept = 0.0, offset[-1]
+        self._set_estimate(int(ref_index),
+                           intercept + ref_index * self._period_us,
+                           slope / self._period_us * 1e6, next_index)
+        self._new_mapping = True
+
+    def _set_estimate(self, ref_index, ref_time, drift, next_index):
+        """sets the new estimate, the step to the previous estimate at
+        next_index is slewed in"""
+        previous = self.time_us(next_index)
+        self._ref_index = ref_index
+        self._ref_time = ref_time
+        self._drift = drift
+        self._slew = None
+        if previous is not None:
+            step = previous - self.time_us(next_index)
+            # at least half of the sample period remains per sample
+            n = max(self.window,
+                    int(np.ceil(2 * abs(step) / self._period_us)))
+            self._slew = (next_index, step, n)
+
+    def time_us(self, index):
+        """host time (us) of sample index or None, if no correlation point
+        has been added yet"""
+        if self._ref_time is None:
+            return None
+        t = self._ref_time + (index - self._ref_index) * \
+               self._period_us * (1 + self._drift * 1e-6)
+        if self._slew is not None:
+            start, step, n = self._slew
+            t += step * min(1.0, max(0.0, 1.0 - (index - start) / float(n)))
+        return t
+
+    def time_ns(self, index):
+        """host time (ns, int) of sample index"""
+        t = self.time_us(index)
+        if t is None:
+            return None
+        return int(round(t * 1000))
+
+    def time_ms(self, index):
+        """host time (ms, float) of sample index"""
+        t = self.time_us(index)
+        if t is None:
+            return None
+        return round(t / 1000.0, 3)
+
+    @property
+    def mapping(self):
+        """the current SampleClockMapping or None"""
+        if self._ref_time is None:
+            return None
+        return SampleClockMapping(time=int(self._last_host_time // 1000),
+                                  device_id=self.device_id, rate=self.rate,
+                                  ref_index=self._ref_index,
+                                  ref_time=self._ref_time, drift=self._drift)
+
+    def pop_mapping(self):
+        """returns the new SampleClockMapping, if the estimate has been
+        updated since the last call, otherwise None"""
+        if not self._new_mapping:
+            return None
+        self._new_mapping = False
+        return self.mapping
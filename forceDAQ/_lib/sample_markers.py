@@ -0,0 +1,103 @@
+"""Sample-accurate marking of UDP markers
+
+The UDP process writes the arrival time of each marker into a shared event
+ring of each sensor process (see `write_marker`). The sensor process assigns
+the markers to the samples: a marker marks the first sample whose timestamp
+is equal or later than the arrival time of the marker. The marked sample
+gets the number of its markers as trigger value (trigger1), thus markers
+that arrive within one sample do not collapse.
+
+Markers are read after the samples have been polled and may arrive with a
+delay (e.g. wake-up of the UDP process). Samples of the recent past can
+therefore be marked retrospectively (see `SampleMarker.lookback`).
+"""
+
+from collections import deque
+import numpy as np
+
+from .shared_ring import SharedRingBuffer
+
+MARKER_BUFFER_SIZE = 1000  # markers
+LOOKBACK = 1000  # samples
+
+
+def marker_buffer():
+    """creates the shared event ring of a sensor process"""
+    return SharedRingBuffer(MARKER_BUFFER_SIZE, 1)
+
+
+def write_marker(marker_buffers, time):
+    """writes the arrival time (ms) of a marker to all marker buffers"""
+    for ring in marker_buffers:
+        ring.write((time,))
+
+
+class SampleMarker(object):
+    """assigns the markers of the event ring to samples
+
+    Example::
+
+        marker = SampleMarker(marker_buffer)
+        marker.reset()  # start of polling, ignores old markers
+        recent = deque(maxlen=marker.lookback)
+        for d in samples:
+            recent.append(d)
+            for idx, cnt in marker.process([d.time]):
+                recent[idx].trigger[0] = cnt
+
+    """
+
+    def __init__(self, marker_buffer, lookback=LOOKBACK):
+        """
+        Parameters
+        ----------
+        marker_buffer : SharedRingBuffer
+            event ring with the marker times
+        lookback : int
+            number of recent samples that can be marked retrospectively.
+            Markers that are older than all these samples mark the oldest
+            one.
+
+        """
+        self.marker_buffer = marker_buffer
+        self.lookback = lookback
+        self._times = deque(maxlen=lookback)
+        self._counts = deque(maxlen=lookback)
+        self._pending = np.empty(0)
+        self._counter = 0
+        self.n_lost = 0
+        self.reset()
+
+    def reset(self):
+        """forget samples and ignore all markers written so far"""
+        self._times.clear()
+        self._counts.clear()
+        self._pending = np.empty(0)
+        self._counter = self.marker_buffer.counter
+
+    def process(self, times):
+        """process the timestamps of a block of new samples
+
+        returns list of tuples (index, n_markers) of all marked samples.
+        The index refers to the recent samples (negative, -1 is the last
+        sample) and n_markers is the total number of markers of the sample.
+        """
+        self._times.extend(times)
+        self._counts.extend([0] * len(times))
+        if self.marker_buffer.counter == self._counter and \
+                len(self._pending) == 0:
+            return []  # fast path: no markers
+
+        rows, _, self._counter, lost = self.marker_buffer.read_since(
+                                                                self._counter)
+        self.n_lost += lost
+        markers = np.append(self._pending, rows[:, 0])
+        n = len(self._times)
+        idx = np.searchsorted(np.fromiter(self._times, dtype=float, count=n),
+                              markers, side="left")
+        self._pending = markers[idx == n]
+        rtn = []
+        for i in np.unique(idx[idx < n]):
+            self._counts[i] += int(np.sum(idx == i))
+            rtn.append((int(i) - n, self._counts[i]))
+        return rtn
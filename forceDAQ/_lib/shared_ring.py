@@ -0,0 +1,91 @@
+"""Ring buffer in shared memory
+
+A single writer process appends rows of values, multiple reader processes
+read all rows since their last read. Lost rows (overwritten before they were
+read) are detected and reported.
+"""
+
+import ctypes as ct
+from multiprocessing import sharedctypes
+import numpy as np
+
+
+class SharedRingBuffer(object):
+
+    def __init__(self, capacity, n_values):
+        """Ring buffer (shared memory) with `capacity` rows of `n_values`
+        doubles. Create the buffer before the processes are started."""
+        self.capacity = capacity
+        self.n_values = n_values
+        self._raw = sharedctypes.RawArray(ct.c_double, capacity * n_values)
+        self._counter = sharedctypes.RawValue(ct.c_uint64, 0)
+        self._array = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_array"] = None  # numpy view is created in each process
+        return state
+
+    @property
+    def array(self):
+        """numpy view (capacity, n_values) of the shared memory"""
+        if self._array is None:
+            self._array = np.frombuffer(self._raw, dtype=np.float64).reshape(
+                                            (self.capacity, self.n_values))
+        return self._array
+
+    @property
+    def counter(self):
+        """total number of written rows"""
+        return self._counter.value
+
+    def write(self, values):
+        """append one row"""
+        cnt = self._counter.value
+        self.array[cnt % self.capacity, :] = values
+        self._counter.value = cnt + 1
+
+    def write_block(self, values):
+        """append multiple rows (n_rows, n_values)"""
+        values = np.asarray(values)
+        cnt = self._counter.value
+        n = len(values)
+        if n > self.capacity:
+            values = values[-self.capacity:]
+            cnt += n - self.capacity
+            n = self.capacity
+        idx = (cnt + np.arange(n)) % self.capacity
+        self.array[idx, :] = values
+        self._counter.value = cnt + len(values)
+
+    def latest(self):
+        """returns counter and a copy of the last row (or None if empty)"""
+        cnt = self._counter.value
+        if cnt == 0:
+            return 0, None
+        return cnt, self.array[(cnt - 1) % self.capacity, :].copy()
+
+    def read_since(self, counter, max_rows=None):
+        """read all rows written since `counter`
+
+        Returns
+        -------
+        rows: numpy array (n_rows, n_values)
+        first: counter of the first row
+        next_counter: counter for the next call
+        n_lost: number of rows that have been overwritten before reading
+
+        """
+        end = self._counter.value
+        if max_rows is not None:
+            end = min(end, counter + max_rows)
+        first = max(counter, end - self.capacity)
+        idx = np.arange(first, end) % self.capacity
+        rows = self.array[idx, :]  # copy
+        # rows overwritten while reading?
+        overwritten = self._counter.value - self.capacity
+        if overwritten > first:
+            drop = min(overwritten - first, len(rows))
+            rows = rows[drop:]
+            first += drop
+        return rows, first, end, first - counter
@@ -0,0 +1,69 @@
+"""Latest sample in shared memory (sequence lock)
+
+A single writer process (the sensor process) publishes the latest sample:
+sample counter, time, forces and trigger. Readers in other processes get
+consistent snapshots without locks:
+
+    writer: seq += 1 (odd), copy the sample (one memmove), seq += 1 (even)
+    reader: read seq, copy the sample, read seq again. The copy is valid if
+            both sequence numbers are equal and even, otherwise retry.
+
+The sequence lock relies on the ordering of aligned 64-bit stores of the
+writer (given on x86/x86-64).
+"""
+
+import ctypes as ct
+import struct
+from multiprocessing import sharedctypes
+
+
+class _Sample(ct.Structure):
+    _fields_ = [("seq", ct.c_uint64),
+                ("counter", ct.c_uint64),
+                ("time", ct.c_double),
+                ("forces", ct.c_double * 6),
+                ("trigger", ct.c_double * 2)]
+
+
+_PAYLOAD = struct.Struct("=Qd6d2d")  # all fields, except seq
+_OFFSET = _Sample.counter.offset
+
+
+class SharedSample(object):
+
+    def __init__(self):
+        """Create the shared sample before the processes are started."""
+        self._raw = sharedctypes.RawValue(_Sample)
+
+    @property
+    def counter(self):
+        """number of samples written so far"""
+        return self._raw.counter
+
+    def write(self, counter, time, forces, trigger):
+        """publish a sample (single writer only)"""
+        raw = self._raw
+        data = _PAYLOAD.pack(counter, time, *(tuple(forces) + tuple(trigger)))
+        raw.seq += 1
+        ct.memmove(ct.addressof(raw) + _OFFSET, data, _PAYLOAD.size)
+        raw.seq += 1
+
+    def read(self):
+        """consistent snapshot of the latest sample
+
+        returns counter, time, forces (tuple) and trigger (tuple)
+        or None, if no sample has been written yet
+        """
+        raw = self._raw
+        address = ct.addressof(raw) + _OFFSET
+        while True:
+            seq = raw.seq
+            if seq & 1:
+                continue  # writing
+            data = ct.string_at(address, _PAYLOAD.size)
+            if raw.seq == seq:
+                break
+        if seq == 0:
+            return None
+        x = _PAYLOAD.unpack(data)
+        return x[0], x[1], x[2:8], x[8:10]
@@ -0,0 +1,184 @@
+"""Streaming of live force data to remote peers
+
+A peer subscribes via the remote control command SUBSCRIBE (see
+`encode_subscribe`). The UDP process then pushes batched, binary-packed
+samples of the selected sensors and parameters at a fixed packet rate.
+
+Stream packet (little endian):
+    GUIRemoteControlCommands.STREAM
+    header: sequence number (uint32), sensor (uint8), number of
+            parameters (uint8), number of samples (uint16), decimation
+            (uint16), sample index of the first sample (uint64)
+    parameter ids: n_parameters * uint8
+    times: n_samples * float64
+    values: n_samples * n_parameters * float32 (row-major)
+
+Parameter ids: 0-5 (Fx, Fy, Fz, Tx, Ty, Tz), 6 & 7 (trigger1 & trigger2)
+"""
+
+import struct
+import numpy as np
+
+from .types import GUIRemoteControlCommands as RcCmd
+
+STREAM_VALUES = 9  # time, 6 forces, 2 trigger (see SensorProcess)
+STREAM_BUFFER_SIZE = 10000  # samples
+MAX_PACKET_SIZE = 1400  # bytes, below typical MTU
+
+_SUBSCRIBE = struct.Struct("<HHB")  # packet rate, decimation, n selections
+_HEADER = struct.Struct("<IBBHHQ")
+
+
+def _encode_selections(selections):
+    return b"".join([struct.pack("<BB", sensor, para)
+                     for sensor, para in selections])
+
+
+def _decode_selections(payload, offset=0, n=None):
+    if n is None:
+        n = (len(payload) - offset) // 2
+    sel = struct.unpack_from("<" + "B" * 2 * n, payload, offset)
+    return list(zip(sel[0::2], sel[1::2]))
+
+
+def encode_subscribe(selections, packet_rate=100, decimation=1):
+    """payload of the SUBSCRIBE command
+
+    selections: list of tuples (sensor, parameter_id)
+                sensor: 0 or 1, parameter_id: 0-7
+    """
+    return RcCmd.SUBSCRIBE + _SUBSCRIBE.pack(int(packet_rate),
+                                             int(decimation),
+                                             len(selections)) + \
+           _encode_selections(selections)
+
+
+def encode_get_values(selections):
+    """GET_VALUES command
+
+    selections: list of tuples (sensor, parameter_id), see encode_subscribe
+    """
+    return RcCmd.GET_VALUES + _encode_selections(selections)
+
+
+def get_values(stream_buffers, payload):
+    """values requested by a GET_VALUES command
+
+    stream_buffers: stream buffers of the sensor processes (index = sensor)
+    payload: data of the GET_VALUES command (without command tag)
+
+    Returns list of tuples (sensor, sample counter, time, values) for each
+    requested sensor. The values (in the order of the request) of one
+    sensor are taken from the same sample. Tuple is (sensor, None, None,
+    None), if the sensor does not exist or has no sample yet.
+    """
+    rtn = []
+    paras = {}
+    for sensor, para in _decode_selections(payload):
+        if sensor not in paras:
+            paras[sensor] = []
+            rtn.append(sensor)
+        paras[sensor].append(para)
+
+    for i, sensor in enumerate(rtn):
+        try:
+            cnt, row = stream_buffers[sensor].latest()
+        except IndexError:
+            row = None
+        if row is None:
+            rtn[i] = (sensor, None, None, None)
+        else:
+            row = row.tolist()
+            rtn[i] = (sensor, cnt, row[0],
+                      tuple([row[p + 1] if p < STREAM_VALUES - 1 else None
+                             for p in paras[sensor]]))
+    return rtn
+
+
+class StreamSubscription(object):
+    """subscription state of a peer (used by the UDP process)"""
+
+    def __init__(self, payload):
+        """payload: data of the SUBSCRIBE command (without command tag)"""
+        packet_rate, decimation, n = _SUBSCRIBE.unpack_from(payload)
+        self.packet_interval = 1000.0 / max(1, packet_rate)  # ms
+        self.decimation = max(1, decimation)
+        self.parameters = {}  # sensor: list of parameter ids
+        for sensor, para in _decode_selections(payload, _SUBSCRIBE.size, n):
+            if para < STREAM_VALUES - 1:
+                self.parameters.setdefault(sensor, []).append(para)
+        self.counter = {}  # sensor: counter of ring buffer
+        self.seq = 0
+        self.next_packet_time = None
+        self.n_lost = 0
+
+    def packets(self, stream_buffers):
+        """read new samples from the ring buffers and returns the packets"""
+        rtn = []
+        for sensor, paras in self.parameters.items():
+            try:
+                ring = stream_buffers[sensor]
+            except IndexError:
+                continue
+            if sensor not in self.counter:
+                self.counter[sensor] = ring.counter  # start with new samples
+                continue
+            rows, first, self.counter[sensor], lost = ring.read_since(
+                                                        self.counter[sensor])
+            self.n_lost += lost
+            if self.decimation > 1:
+                idx = np.flatnonzero((first + np.arange(len(rows))) %
+                                     self.decimation == 0)
+                rows = rows[idx]
+                first_idx = first + idx
+            else:
+                first_idx = first + np.arange(len(rows))
+            if len(rows) == 0:
+                continue
+            cols = [p + 1 for p in paras]
+            times = rows[:, 0]
+            values = rows[:, cols]
+            per_sample = 8 + 4 * len(paras)
+            n_max = (MAX_PACKET_SIZE - len(RcCmd.STREAM) - _HEADER.size -
+                     len(paras)) // per_sample
+            for p in range(0, len(rows), n_max):
+                rtn.append(pack_stream_packet(self.seq, sensor, paras,
+                                              self.decimation,
+                                              int(first_idx[p]),
+                                              times[p:p + n_max],
+                                              values[p:p + n_max]))
+                self.seq += 1
+        return rtn
+
+
+def pack_stream_packet(seq, sensor, parameters, decimation, first_sample,
+                       times, values):
+    return RcCmd.STREAM + \
+           _HEADER.pack(seq & 0xFFFFFFFF, sensor, len(parameters),
+                        len(times), decimation, first_sample) + \
+           bytes(bytearray(parameters)) + \
+           np.asarray(times, dtype="<f8").tobytes() + \
+           np.asarray(values, dtype="<f4").tobytes()
+
+
+def decode_stream_packet(data):
+    """decode stream packet
+
+    returns dict with seq, sensor, parameters, sample indices, times and
+    values or None if data is not a stream packet
+    """
+    if data[:len(RcCmd.STREAM)] != RcCmd.STREAM:
+        return None
+    p = len(RcCmd.STREAM)
+    seq, sensor, n_para, n_smpl, decimation, first = _HEADER.unpack_from(
+                                                                    data, p)
+    p += _HEADER.size
+    paras = list(data[p:p + n_para])
+    p += n_para
+    times = np.frombuffer(data, dtype="<f8", count=n_smpl, offset=p)
+    p += 8 * n_smpl
+    values = np.frombuffer(data, dtype="<f4", count=n_smpl * n_para,
+                           offset=p).reshape((n_smpl, n_para))
+    return {"seq": seq, "sensor": sensor, "parameters": paras,
+            "samples": first + decimation * np.arange(n_smpl),
+            "times": times, "values": values}
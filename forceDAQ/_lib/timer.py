@@ -1,6 +1,20 @@
 """A high-resolution monotonic timer
 
 This module provides a high-resolution timer via the function get_time()
+(seconds, float) and get_time_ns() (nanoseconds, int).
+
+If available (Python 3.7+), the monotonic clocks of the time module are used
+(CLOCK_CANDIDATES). At import, the call overhead of each clock is measured
+and the cheapest clock with sufficient resolution is selected
+(`clock_source`). The selection is passed to child processes via the
+environment variable FORCEDAQ_CLOCK, which can be also used to set the clock.
+
+Timer.wait sleeps and busy-waits (spins) only for the last milliseconds
+(spin budget).
+
+Microbenchmark of the clocks and of the accuracy of Timer.wait:
+
+    python -m forceDAQ._lib.timer
 
 Thanks to Luca Filippin for the code examples.
 
@@ -19,7 +33,9 @@ __version__ = ''
 __revision__ = ''
 __date__ = ''
 
+import time
 from time import sleep
+from collections import namedtuple
 try:
     import ctypes
 except:
@@ -27,119 +43,262 @@ except:
 import os
 from sys import platform
 
-_use_time_module = False
-
-if platform == 'darwin':
-    # MAC
-    try:
-        class _TimeBase(ctypes.Structure):
-            _fields_ = [
-                ('numer', ctypes.c_uint),
-                ('denom', ctypes.c_uint)
-            ]
-
-        _libsys_c = ctypes.CDLL('/usr/lib/system/libsystem_c.dylib')
-        _libsys_kernel = ctypes.CDLL('/usr/lib/system/libsystem_kernel.dylib')
-        _mac_abs_time = _libsys_c.mach_absolute_time
-        _mac_timebase_info = _libsys_kernel.mach_timebase_info
-        _time_base = _TimeBase()
-        if (_mac_timebase_info(ctypes.pointer(_time_base)) != 0):
-            _use_time_module = True
+try:
+    from time import perf_counter_ns as _perf_counter_ns
+except ImportError:  # Python < 3.7
+    _perf_counter_ns = None
 
-        def get_time():
-            """Get high-resolution monotonic time stamp (float) """
-            _mac_abs_time.restype = ctypes.c_ulonglong
-            return float(_mac_abs_time()) * _time_base.numer / (_time_base.denom * 1e9)
-        get_time()
-    except:
-        _use_time_module = True
+CLOCK_CANDIDATES = ("perf_counter", "monotonic")
+MAX_CLOCK_RESOLUTION = 1e-6  # sec
+ENV_CLOCK = "FORCEDAQ_CLOCK"
 
-elif platform.startswith('linux'):
-    # real OS
-    _CLOCK_MONOTONIC = 4  # actually CLOCK_MONOTONIC_RAW see <linux/time.h>
-
-    try:
-        class _TimeSpec(ctypes.Structure):
-            _fields_ = [
-                ('tv_sec', ctypes.c_long),
-                ('tv_nsec', ctypes.c_long)
-            ]
-
-        _librt = ctypes.CDLL('librt.so.1', use_errno=True)
-        _clock_gettime = _librt.clock_gettime
-        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_TimeSpec)]
-
-        def get_time():
-            """Get high-resolution monotonic time stamp (float) """
-            t = _TimeSpec()
-            if _clock_gettime(_CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
-                errno_ = ctypes.get_errno()
-                raise OSError(errno_, os.strerror(errno_))
-            return t.tv_sec + t.tv_nsec * 1e-9
-        get_time()
-    except:
-        _use_time_module = True
+if platform == 'win32':
+    SPIN_BUDGET = 20  # ms, sleep granularity of Windows is up to 15.6 ms
+else:
+    SPIN_BUDGET = 2  # ms
+
+ClockSource = namedtuple("ClockSource", ["name", "overhead_ns",
+                                         "resolution"])
+
+
+def _call_overhead_ns(func, n_calls=2000, clock_ns=_perf_counter_ns):
+    """mean duration (ns) of a call of func (without loop overhead)"""
+    t0 = clock_ns()
+    for _ in range(n_calls):
+        pass
+    t1 = clock_ns()
+    for _ in range(n_calls):
+        func()
+    t2 = clock_ns()
+    return max(0.0, ((t2 - t1) - (t1 - t0)) / float(n_calls))
+
+
+def calibrate_clocks(candidates=CLOCK_CANDIDATES, n_calls=2000,
+                     n_repetitions=5):
+    """measures the call overhead of the monotonic clocks of the time module
+
+    returns list of ClockSource sorted by overhead, clocks with a resolution
+    above MAX_CLOCK_RESOLUTION last
+    """
+    rtn = []
+    for name in candidates:
+        try:
+            func = getattr(time, name + "_ns")
+            info = time.get_clock_info(name)
+        except (AttributeError, ValueError):
+            continue
+        if not info.monotonic:
+            continue
+        overhead = min(_call_overhead_ns(func, n_calls)
+                       for _ in range(n_repetitions))
+        rtn.append(ClockSource(name, overhead, info.resolution))
+    rtn.sort(key=lambda x: (x.resolution > MAX_CLOCK_RESOLUTION,
+                            x.overhead_ns))
+    return rtn
+
+
+if _perf_counter_ns is not None:
+    # integer nanoseconds, no ctypes structures per call
+    clock_sources = calibrate_clocks()
+    clock_source = clock_sources[0]
+    _name = os.environ.get(ENV_CLOCK)
+    for _c in clock_sources:
+        if _c.name == _name:
+            clock_source = _c
+    os.environ[ENV_CLOCK] = clock_source.name  # same clock in child processes
+    get_time = getattr(time, clock_source.name)
+    get_time_ns = getattr(time, clock_source.name + "_ns")
 
-elif platform == 'win32':
-    # win32. Code adapted from the psychopy.core.clock source code.
-    try:
-        _fcounter = ctypes.c_int64()
-        _qpfreq = ctypes.c_int64()
-        ctypes.windll.Kernel32.QueryPerformanceFrequency(ctypes.byref(_qpfreq))
-        _qpfreq = float(_qpfreq.value)
-        _winQPC = ctypes.windll.Kernel32.QueryPerformanceCounter
-
-        def get_time():
-            """Get high-resolution monotonic time stamp (float) """
-            _winQPC(ctypes.byref(_fcounter))
-            return  _fcounter.value/_qpfreq
-        get_time()
-    except:
-        _use_time_module = True
 else:
-    # Android or something else
-    _use_time_module = True
-
-if _use_time_module:
-    import time
-    warn_message = "Failed to initialize monotonic timer. Python's time module will be use."
-    print("Warning: " + warn_message)
-    if platform == 'win32':
-        def get_time():
-            """Get high-resolution time stamp (float) """
-            return time.clock()
+    clock_sources = []
+    clock_source = None
+    _use_time_module = False
+
+    if platform == 'darwin':
+        # MAC
+        try:
+            class _TimeBase(ctypes.Structure):
+                _fields_ = [
+                    ('numer', ctypes.c_uint),
+                    ('denom', ctypes.c_uint)
+                ]
+
+            _libsys_c = ctypes.CDLL('/usr/lib/system/libsystem_c.dylib')
+            _libsys_kernel = ctypes.CDLL('/usr/lib/system/libsystem_kernel.dylib')
+            _mac_abs_time = _libsys_c.mach_absolute_time
+            _mac_timebase_info = _libsys_kernel.mach_timebase_info
+            _time_base = _TimeBase()
+            if (_mac_timebase_info(ctypes.pointer(_time_base)) != 0):
+                _use_time_module = True
+
+            def get_time():
+                """Get high-resolution monotonic time stamp (float) """
+                _mac_abs_time.restype = ctypes.c_ulonglong
+                return float(_mac_abs_time()) * _time_base.numer / (_time_base.denom * 1e9)
+            get_time()
+        except:
+            _use_time_module = True
+
+    elif platform.startswith('linux'):
+        # real OS
+        _CLOCK_MONOTONIC = 4  # actually CLOCK_MONOTONIC_RAW see <linux/time.h>
+
+        try:
+            class _TimeSpec(ctypes.Structure):
+                _fields_ = [
+                    ('tv_sec', ctypes.c_long),
+                    ('tv_nsec', ctypes.c_long)
+                ]
+
+            _librt = ctypes.CDLL('librt.so.1', use_errno=True)
+            _clock_gettime = _librt.clock_gettime
+            _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_TimeSpec)]
+
+            def get_time():
+                """Get high-resolution monotonic time stamp (float) """
+                t = _TimeSpec()
+                if _clock_gettime(_CLOCK_MONOTONIC, ctypes.pointer(t)) != 0:
+                    errno_ = ctypes.get_errno()
+                    raise OSError(errno_, os.strerror(errno_))
+                return t.tv_sec + t.tv_nsec * 1e-9
+            get_time()
+        except:
+            _use_time_module = True
+
+    elif platform == 'win32':
+        # win32. Code adapted from the psychopy.core.clock source code.
+        try:
+            _fcounter = ctypes.c_int64()
+            _qpfreq = ctypes.c_int64()
+            ctypes.windll.Kernel32.QueryPerformanceFrequency(ctypes.byref(_qpfreq))
+            _qpfreq = float(_qpfreq.value)
+            _winQPC = ctypes.windll.Kernel32.QueryPerformanceCounter
+
+            def get_time():
+                """Get high-resolution monotonic time stamp (float) """
+                _winQPC(ctypes.byref(_fcounter))
+                return  _fcounter.value/_qpfreq
+            get_time()
+        except:
+            _use_time_module = True
     else:
-        def get_time():
-            """Get high-resolution time stamp (float) """
-            return time.time()
+        # Android or something else
+        _use_time_module = True
+
+    if _use_time_module:
+        warn_message = "Failed to initialize monotonic timer. Python's time module will be use."
+        print("Warning: " + warn_message)
+        if platform == 'win32':
+            def get_time():
+                """Get high-resolution time stamp (float) """
+                return time.clock()
+        else:
+            def get_time():
+                """Get high-resolution time stamp (float) """
+                return time.time()
 
+    def get_time_ns():
+        """Get monotonic time stamp (int, nanoseconds)"""
+        return int(get_time() * 1e9)
 
 
 class Timer(object):#
-    """A simple timer"""
+    """A simple timer
 
-    def __init__(self, sync_timer=None):
+    The time base are integer nanoseconds (time_ns). time (ms) and time_us
+    are compatibility views.
+    """
+
+    def __init__(self, sync_timer=None, spin_budget=SPIN_BUDGET):
+        """spin_budget: busy-waiting time (ms) at the end of wait"""
+        self.spin_budget = spin_budget
         if sync_timer is None:
-            self._init_time = get_time()
+            self._init_time_ns = get_time_ns()
         else:
-            self._init_time = sync_timer._init_time
+            self._init_time_ns = sync_timer._init_time_ns
+
+    @property
+    def time_ns(self):
+        """time in nanoseconds"""
+        return get_time_ns() - self._init_time_ns
+
+    def from_monotonic_ns(self, monotonic_ns):
+        """converts a timestamp of the clock (get_time_ns) into the time of
+        the timer (nanoseconds)"""
+        return monotonic_ns - self._init_time_ns
 
     @property
     def time(self):
-        return int((get_time() - self._init_time) * 1000)
+        """time in milliseconds (float)"""
+        return (get_time_ns() - self._init_time_ns) / 1e6
+
+    @property
+    def time_us(self):
+        """time in microseconds"""
+        return (get_time_ns() - self._init_time_ns) // 1000
 
-    def wait(self, waiting_time, function=None):
+    def wait(self, waiting_time, function=None, spin_budget=None):
         """Wait for a certain amount of milliseconds.
+
+        The process sleeps and busy-waits only for the last milliseconds
+        (spin budget, default: Timer.spin_budget). A larger spin budget
+        compensates late wake-ups of the OS at the cost of CPU load.
+
+        function: called repeatedly while busy-waiting (optional)
         """
 
-        start = self.time
-        looptime = 200
-        if waiting_time > looptime:
-            sleep((waiting_time - looptime) / 1000)
-        while self.time < start + waiting_time:
-            pass
+        if spin_budget is None:
+            spin_budget = self.spin_budget
+        end = get_time_ns() + int(waiting_time * 1000000)
+        spin_ns = int(spin_budget * 1000000)
+        while True:
+            remaining = end - get_time_ns()
+            if remaining <= spin_ns:
+                break
+            sleep((remaining - spin_ns) / 1e9)
+        while get_time_ns() < end:
+            if function is not None:
+                function()
 
 def get_time_ms():
-    return int(1000*get_time())
+    return get_time_ns() // 1000000
+
+app_timer = Timer()
+
+
+def _wait_lateness_us(timer, waiting_time, spin_budget, n=20):
+    """mean and maximum lateness (us) of Timer.wait"""
+    rtn = []
+    for _ in range(n):
+        t0 = get_time_ns()
+        timer.wait(waiting_time, spin_budget=spin_budget)
+        rtn.append((get_time_ns() - t0) / 1000.0 - waiting_time * 1000)
+    return sum(rtn) / len(rtn), max(rtn)
+
+
+if __name__ == "__main__":
+    timer = Timer()
+    print("clock sources (call overhead, resolution):")
+    for c in clock_sources:
+        print("  {0}: {1:.1f} ns, {2:.0f} ns".format(c.name, c.overhead_ns,
+                                                    c.resolution * 1e9))
+    if clock_source is not None:
+        print("selected clock: {0}".format(clock_source.name))
+
+    print("\noverhead per call:")
+    for name, func in (("get_time_ns()", get_time_ns),
+                       ("get_time()", get_time),
+                       ("Timer.time_ns", lambda: timer.time_ns),
+                       ("Timer.time", lambda: timer.time)):
+        overhead = min(_call_overhead_ns(func, 100000, clock_ns=get_time_ns)
+                       for _ in range(5))
+        print("  {0}: {1:.1f} ns".format(name, overhead))
 
-app_timer = Timer()
\ No newline at end of file
+    print("\nwake-up accuracy of Timer.wait (lateness, mean/max):")
+    for spin_budget in sorted(set((0, 0.5, SPIN_BUDGET))):
+        for waiting_time in (1, 5, 20):
+            mean, maximum = _wait_lateness_us(timer, waiting_time,
+                                              spin_budget)
+            print("  wait({0} ms), spin budget {1} ms: {2:.1f} us, "
+                  "{3:.1f} us".format(waiting_time, spin_budget, mean,
+                                      maximum))
@@ -0,0 +1,181 @@
+"""Detection of trigger pulses in analog trigger channels
+
+The detector processes blocks of samples and converts the trigger channels
+into a compact table of trigger events (onset, offset and sample index per
+channel). It can be used online (sensor process) and offline (recorded
+data). The state of the channels is kept between blocks.
+"""
+
+import os
+import numpy as np
+
+from .types import TriggerEvent
+
+TRIGGER_EVENTS_SUFFIX = ".trigger.csv"
+
+
+def trigger_events_filename(data_filename):
+    """returns the filename of the trigger event sidecar file"""
+    for suffix in (".csv.gz", ".csv", ".gz"):
+        if data_filename.endswith(suffix):
+            data_filename = data_filename[:-len(suffix)]
+            break
+    return data_filename + TRIGGER_EVENTS_SUFFIX
+
+
+def write_trigger_events(filename, trigger_events, append=False):
+    """writes list of TriggerEvents to sidecar file"""
+    write_header = not (append and os.path.isfile(filename))
+    with open(filename, "a" if append else "w") as fl:
+        if write_header:
+            fl.write(",".join(TriggerEvent.varnames) + "\n")
+        for evt in trigger_events:
+            fl.write(str(evt) + "\n")
+
+
+def _runs(x):
+    """run length encoding of a boolean array
+
+    returns: values, starts and lengths of the runs"""
+    change = np.flatnonzero(x[1:] != x[:-1]) + 1
+    starts = np.append(0, change)
+    lengths = np.diff(np.append(starts, len(x)))
+    return x[starts], starts, lengths
+
+
+class TriggerEdgeDetector(object):
+    """Online and offline trigger edge detection
+
+    A change of the trigger state is accepted only, if the new state is
+    stable for at least `debounce` samples (shorter pulses or gaps are
+    considered as noise). Onset (or offset) refers to the first sample of
+    the stable state.
+
+    Example::
+
+        detector = TriggerEdgeDetector(n_channels=2)
+        for times, trigger in blocks:
+            events = detector.process(times, trigger)
+        events = detector.flush()
+
+    """
+
+    def __init__(self, n_channels=2, threshold=0.9, debounce=1, device_id=0):
+        """
+        Parameters
+        ----------
+        n_channels : int
+            number of trigger channels
+        threshold : float
+            trigger is on if abs(value) >= threshold
+        debounce : int
+            minimum number of samples for a stable trigger state
+        device_id : int
+            the id of the sensor device (written to the events)
+
+        """
+
+        self.n_channels = n_channels
+        self.threshold = threshold
+        self.debounce = max(1, int(debounce))
+        self.device_id = device_id
+        self.reset()
+
+    def reset(self):
+        self._n_samples = 0
+        self._state = [False] * self.n_channels
+        self._open = [None] * self.n_channels  # (onset_sample, onset_time)
+        # not yet confirmed samples for each channel (state, times, index)
+        self._pending = [(np.empty(0, dtype=bool), np.empty(0),
+                          np.empty(0, dtype=int))] * self.n_channels
+
+    @property
+    def n_samples(self):
+        """number of processed samples"""
+        return self._n_samples
+
+    def process(self, times, trigger, sample_index=None):
+        """process a block of samples
+
+        Parameters
+        ----------
+        times : array (n_samples)
+            time stamps
+        trigger : array (n_samples, n_channels)
+            trigger values
+        sample_index : array (n_samples), optional
+            sample index of the samples (e.g. ForceData.sample_index). If
+            None, the samples are counted from the last reset.
+
+        Returns
+        -------
+        events : list of TriggerEvent
+            completed trigger events (i.e., onset and offset detected)
+
+        """
+
+        times = np.asarray(times)
+        trigger = np.abs(np.asarray(trigger, dtype=float)).reshape(
+                                                    (len(times), -1))
+        if sample_index is None:
+            sample_index = np.arange(self._n_samples,
+                                     self._n_samples + len(times))
+        self._n_samples += len(times)
+        if len(times) == 0:
+            return []
+
+        rtn = []
+        for c in range(self.n_channels):
+            p_state, p_times, p_index = self._pending[c]
+            on = np.append(p_state, trigger[:, c] >= self.threshold)
+            t = np.append(p_times, times)
+            index = np.append(p_index, sample_index).astype(int)
+
+            values, starts, lengths = _runs(on)
+            pending_from = None
+            for v, s, l in zip(values, starts, lengths):
+                if v == self._state[c]:
+                    pending_from = None
+                elif l >= self.debounce:
+                    self._state[c] = v
+                    rtn.extend(self._edge(c, v, int(index[s]), t[s]))
+                    pending_from = None
+                elif pending_from is None:
+                    pending_from = s
+
+            if pending_from is not None:
+                # candidate state change at end of block
+                self._pending[c] = (on[pending_from:], t[pending_from:],
+                                    index[pending_from:])
+            else:
+                self._pending[c] = (np.empty(0, dtype=bool), np.empty(0),
+                                    np.empty(0, dtype=int))
+
+        return rtn
+
+    def _edge(self, channel, onset, sample, time):
+        if onset:
+            self._open[channel] = (sample, time)
+            return []
+        elif self._open[channel] is not None:
+            evt = TriggerEvent(channel=channel,
+                               onset_sample=self._open[channel][0],
+                               onset_time=self._open[channel][1],
+                               offset_sample=sample, offset_time=time,
+                               device_id=self.device_id)
+            self._open[channel] = None
+            return [evt]
+        return []
+
+    def flush(self):
+        """returns the not yet completed trigger events (offset is None)
+        and resets the detector"""
+
+        rtn = []
+        for c, op in enumerate(self._open):
+            if op is not None:
+                rtn.append(TriggerEvent(channel=c, onset_sample=op[0],
+                                        onset_time=op[1],
+                                        device_id=self.device_id))
+        self.reset()
+        return rtn
@@ -1,12 +1,18 @@
 __author__ = 'Oliver Lindemann'
 
 import ctypes as ct
+from bisect import bisect_right
 from .misc import MinMaxDetector as _MinMaxDetector
 
 # tag in data output
 TAG_COMMENTS = "#"
 TAG_DAQEVENT = TAG_COMMENTS + "T"
 TAG_UDPDATA = TAG_COMMENTS + "UDP"
+TAG_SYNC = TAG_COMMENTS + "SYNC"
+TAG_SAMPLE_CLOCK = TAG_COMMENTS + "CLOCK"
+TAG_TIME_UNIT = TAG_COMMENTS + " Time unit:"
+
+TIME_UNITS = {"ns": 1, "us": 1000, "ms": 1000000}  # nanoseconds per unit
 
 CTYPE_FORCES = ct.c_float * 600
 CTYPE_TRIGGER = ct.c_float * 2
@@ -32,7 +38,7 @@ class PollingPriority(object):
 
 class CTypesForceData(ct.Structure):
     _fields_ = [("device_id", ct.c_int),
-            ("time", ct.c_int),
+            ("time_ns", ct.c_int64),
             ("forces", CTYPE_FORCES),
             ("trigger", CTYPE_TRIGGER)]
 
@@ -40,11 +46,14 @@ class CTypesForceData(ct.Structure):
 class ForceData(object):
     """The Force data structure with the following properties
         * device_id
-        * time (time stamp)
+        * time_ns (time stamp in nanoseconds) and time (milliseconds)
         * aquisition delay (time it took to receive the new data)
         * Fx,  Fy, & Fz
         * Tx, Ty, & Tz
         * trigger1 & trigger2
+        * sample index (hardware sample clock)
+        * n_markers (number of UDP markers of the sample, see
+          sample_markers)
 
     """
 
@@ -52,14 +61,17 @@ class ForceData(object):
 
     def __init__(self, time=0, acquisition_delay = -1,
                  forces= [0] * 6, trigger=(0, 0),
-                 device_id=0, trigger_threshold=0.9, reverse=()):
+                 device_id=0, trigger_threshold=0.9, reverse=(),
+                 sample_index=None, time_ns=None):
         """Create a ForceData object
         Parameters
         ----------
         device_id: int, optional
             the id of the sensor device
-        time: int, optional
-            the timestamp
+        time: numerical, optional
+            the timestamp (ms)
+        time_ns: int, optional
+            the timestamp in nanoseconds, if defined, time is ignored
         acquisition_delay: int, optional
             time
         forces: array of six floats
@@ -70,12 +82,19 @@ class ForceData(object):
         trigger_threshold: float (default = 0.4)
             if abs(trigger1/2) < trigger_threshold the threshold it will considered as noise
             and set to zero
+        sample_index: int, optional
+            index of the sample in the acquisition (hardware sample clock,
+            see sample_clock)
 
         """
 
-        self.time = time
+        if time_ns is None:
+            time_ns = int(round(time * 1000000))
+        self.time_ns = time_ns
         self.acquisition_delay = acquisition_delay
         self.device_id = device_id
+        self.sample_index = sample_index
+        self.n_markers = 0
         self.forces = forces
         self.trigger = list(trigger)
         if abs(self.trigger[0]) < trigger_threshold:
@@ -87,7 +106,7 @@ class ForceData(object):
 
     def __str__(self):
         """converts data to string. """
-        txt = "%d,%d,%.4f,%.4f,%.4f,%.4f,%.4f,%.4f" % (self.device_id,
+        txt = "%d,%.3f,%.4f,%.4f,%.4f,%.4f,%.4f,%.4f" % (self.device_id,
                                                            self.time,
                                                            self.forces[0],
                                                            self.forces[1],
@@ -98,6 +117,15 @@ class ForceData(object):
         txt += ",%.4f,%.4f" % (self.trigger[0], self.trigger[1])
         return txt
 
+    @property
+    def time(self):
+        """timestamp in milliseconds (float)"""
+        return self.time_ns / 1000000.0
+
+    @time.setter
+    def time(self, value):
+        self.time_ns = int(round(value * 1000000))
+
     @property
     def Fx(self):
         return self.forces[0]
@@ -148,38 +176,120 @@ class ForceData(object):
 
     @property
     def ctypes_struct(self):
-        return CTypesForceData(self.device_id, self.time,
+        return CTypesForceData(self.device_id, self.time_ns,
               CTYPE_FORCES(*self.forces), CTYPE_TRIGGER(*self.trigger))
 
     @ctypes_struct.setter
     def ctypes_struct(self, struct):
         self.device_id = struct.device_id
-        self.time = struct.time
+        self.time_ns = struct.time_ns
         self.force = struct.forces
         self.trigger = struct.trigger
 
 
+class FilteredForceData(ForceData):
+    """ForceData of the filtered (and decimated) data stream
+
+    The trigger values are combined from the raw samples that this sample
+    represents (`raw_samples`: the samples dropped by the decimation before
+    this sample and the sample itself). trigger1 is the total number of
+    UDP markers (n_markers, see sample_markers), if any of the samples is
+    marked; otherwise the value with the largest absolute value is taken, as
+    for trigger2. The values are combined on access, thus markers that are
+    assigned later are included. Pickled are the combined values only.
+
+    See Also
+    --------
+    filters.FilterPipeline
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.raw_samples = []
+        ForceData.__init__(self, *args, **kwargs)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_trigger"] = self.trigger
+        state["_n_markers"] = self.n_markers
+        state["raw_samples"] = []
+        return state
+
+    @property
+    def n_markers(self):
+        if len(self.raw_samples) == 0:
+            return self._n_markers
+        return sum(d.n_markers for d in self.raw_samples)
+
+    @n_markers.setter
+    def n_markers(self, value):
+        self._n_markers = value
+
+    @property
+    def trigger(self):
+        if len(self.raw_samples) == 0:
+            return self._trigger
+        rtn = [max([d.trigger[c] for d in self.raw_samples], key=abs)
+               for c in range(2)]
+        n_markers = self.n_markers
+        if n_markers > 0:
+            rtn[0] = n_markers
+        return rtn
+
+    @trigger.setter
+    def trigger(self, value):
+        self._trigger = value
+
 
 class UDPData(object):
     """The UDP data class, used to store UDP DATA with timestamps
 
     """
 
-    def __init__(self, string, time):
+    def __init__(self, string, time=None, time_us=None, sender=None,
+                 time_ns=None, request_id=None):
         """Create a UDA_DATA object
 
         Parameters
         ----------
-        time : int
+        time : numerical
+            receive time in milliseconds
         code : numerical or string
+        time_us : int, optional
+            receive time in microseconds (kernel timestamp, if available)
+        sender : string, optional
+            ip of the sender
+        time_ns : int, optional
+            receive time in nanoseconds, if defined, time and time_us are
+            ignored
+        request_id : int, optional
+            id of a request, the reply has to be wrapped with this id (see
+            wire_protocol.encode_reply)
 
         """
-        self.time = time
+        if time_ns is None:
+            if time_us is not None:
+                time_ns = int(time_us) * 1000
+            else:
+                time_ns = int(round(time * 1000000))
+        self.time_ns = time_ns
+        self.sender = sender
+        self.request_id = request_id
         if isinstance(string, str):
             self.byte_string = string.encode()
         else:
             self.byte_string = string
 
+    @property
+    def time(self):
+        """receive time in milliseconds (float)"""
+        return self.time_ns / 1000000.0
+
+    @property
+    def time_us(self):
+        """receive time in microseconds"""
+        return self.time_ns // 1000
+
     @property
     def unicode(self):
         return self.byte_string.decode('utf-8', 'replace')
@@ -205,28 +315,93 @@ class DAQEvents(object):
 
     """
 
-    def __init__(self, time, code):
+    def __init__(self, time=None, code=None, time_ns=None):
         """Create a DAQEvents object
 
         Parameters
         ----------
-        time : int
+        time : numerical
+            time in milliseconds
         code : numerical or string
+        time_ns : int, optional
+            time in nanoseconds, if defined, time is ignored
 
         """
-        self.time = time
+        if time_ns is None:
+            time_ns = int(round(time * 1000000))
+        self.time_ns = time_ns
         self.code = code
 
+    @property
+    def time(self):
+        """time in milliseconds (float)"""
+        return self.time_ns / 1000000.0
+
+
+class TriggerEvent(object):
+    """The TriggerEvent data class, used to store detected trigger pulses
+    (onset and offset of the analog trigger channels)
+
+    See Also
+    --------
+    trigger_edges.TriggerEdgeDetector
+
+    """
+
+    varnames = ["device_id", "channel", "onset_sample", "onset_time",
+                "offset_sample", "offset_time"]
+
+    def __init__(self, channel, onset_sample, onset_time,
+                 offset_sample=None, offset_time=None, device_id=0):
+        """Create a TriggerEvent object
+
+        Parameters
+        ----------
+        channel : int
+            trigger channel (0: trigger1, 1: trigger2)
+        onset_sample, offset_sample : int
+            sample index of onset and offset
+        onset_time, offset_time : numerical
+            time stamps of onset and offset
+
+        Offset is None, if the trigger is still on.
+        """
+        self.device_id = device_id
+        self.channel = channel
+        self.onset_sample = onset_sample
+        self.onset_time = onset_time
+        self.offset_sample = offset_sample
+        self.offset_time = offset_time
+
+    def __str__(self):
+        """converts event to a csv line"""
+        return ",".join(map(lambda x: "NA" if x is None else str(x),
+                            (self.device_id, self.channel,
+                             self.onset_sample, self.onset_time,
+                             self.offset_sample, self.offset_time)))
+
 
 class GUIRemoteControlCommands(object):
     """
-    SET_THRESHOLDS needs to be followed by a threshold object
+    Payloads are encoded with wire_protocol.encode (binary or, for old
+    clients, pickle; see wire_protocol)
+
+    PROTOCOL needs to be followed by the highest supported protocol version (1 byte)
+    SET_THRESHOLDS needs to be followed by a threshold object (or list of thresholds)
     SET_RESPONSE_MINMAX_DETECTION needs to be followed an integer representing duration of sampling
+    SUBSCRIBE needs to be followed by the subscription (see streaming.encode_subscribe)
+    CLOCK_SYNC and CLOCK_MAPPING, see clock_sync
+    REQUEST needs to be followed by a request id and a command (see
+        wire_protocol.encode_request), the reply is REPLY+id+reply
+    GET_VALUES needs to be followed by the selected values (see streaming.encode_get_values)
 
     feedback:
         CHANGED_LEVEL+int from SET_LEVEL_CHANGE_DETECTION
         RESPONSE_MINMAX+(int, int) from SET_RESPONSE_MINMAX_DETECTION
         VALUE+float from GET_FX, GET_FY, GET_FZ, GET_TX, GET_TY, GET_TZ,
+        VALUE+list from GET_VALUES (see streaming.get_values)
+        VALUE+int from PROTOCOL (the protocol version used by the server)
+        STREAM+binary packet from SUBSCRIBE (see streaming.decode_stream_packet)
 
     see also UDPConnection constants!
     """
@@ -255,6 +430,12 @@ class GUIRemoteControlCommands(object):
     GET_THRESHOLD_LEVEL =COMMAND_STR + b"gTL"
     GET_THRESHOLD_LEVEL2 = COMMAND_STR + b"gTL2"
     GET_VERSION = COMMAND_STR + b"gVR"
+    GET_VALUES = COMMAND_STR + b"gVLS"
+    PROTOCOL = COMMAND_STR + b"sPRT"
+    REQUEST = COMMAND_STR + b"rID"
+    # clock synchronization
+    CLOCK_SYNC = COMMAND_STR + b"cSYN"
+    CLOCK_MAPPING = COMMAND_STR + b"cMAP"
     # setter
     FILENAME = COMMAND_STR + b"sFN"
     SET_THRESHOLDS = COMMAND_STR + b"sTH"
@@ -262,6 +443,8 @@ class GUIRemoteControlCommands(object):
     SET_LEVEL_CHANGE_DETECTION2 = COMMAND_STR + b"sCD2"
     SET_RESPONSE_MINMAX_DETECTION = COMMAND_STR + b"sMD1"
     SET_RESPONSE_MINMAX_DETECTION2 = COMMAND_STR + b"sMD2"
+    SUBSCRIBE = COMMAND_STR + b"sSUB"
+    UNSUBSCRIBE = COMMAND_STR + b"sUNS"
     #feedback
     FEEDBACK = COMMAND_STR + b"xFB"
     VALUE = COMMAND_STR + b"xVL"
@@ -269,6 +452,8 @@ class GUIRemoteControlCommands(object):
     RESPONSE_MINMAX2 = COMMAND_STR + b"xRM2"
     CHANGED_LEVEL = COMMAND_STR + b"xCL1"
     CHANGED_LEVEL2 = COMMAND_STR + b"xCL2"
+    STREAM = COMMAND_STR + b"xST"
+    REPLY = COMMAND_STR + b"xRP"
 
     FEEDBACK_PAUSED = FEEDBACK + b"paused"
     FEEDBACK_STARTED = FEEDBACK + b"started"
@@ -312,18 +497,12 @@ class Thresholds(object):
                 1 large first but small second threshold
                 ..
                 x larger highest threshold (x=n thresholds)
+                1 if there are no thresholds
         """
 
-        level = None
-        cnt = 0
-        for cnt, x in enumerate(self._thresholds):
-            if value < x:
-                level = cnt
-                break
-
-        if level is None:
-            level = cnt + 1
-        return level
+        if len(self._thresholds) == 0:
+            return 1
+        return bisect_right(self._thresholds, value)
 
     def set_level_change_detection(self, value, channel=0):
         """sets level change detection
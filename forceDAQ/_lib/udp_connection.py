@@ -7,13 +7,31 @@ __version__ = "0.5"
 import atexit
 import os
 import socket
-from multiprocessing import Process, Event, Queue
+import struct
+import time
+from sys import platform
+from collections import OrderedDict
+from multiprocessing import Process, Event, Queue, Pipe, Lock
+from multiprocessing.connection import wait as _wait_for_objects
+from queue import Empty
 import logging
 
-from .types import UDPData
+from .types import UDPData, bytes_startswith
+from .types import GUIRemoteControlCommands as RcCmd
+from .streaming import StreamSubscription, get_values
+from .clock_sync import sync_reply
+from .sample_markers import write_marker
+from . import wire_protocol
 from .polling_time_profile import PollingTimeProfile
 from .process_priority_manager import get_priority
-from .timer import Timer, app_timer, get_time_ms
+from .timer import Timer, app_timer, get_time_ms, get_time_ns
+
+if platform.startswith("linux"):
+    # kernel receive timestamps (not defined in all python versions)
+    SO_TIMESTAMPNS = getattr(socket, "SO_TIMESTAMPNS", 35)
+else:
+    SO_TIMESTAMPNS = None
+_TIMESPEC = struct.Struct("@ll")
 
 def get_lan_ip():
     if os.name != "nt":
@@ -29,33 +47,150 @@ def get_lan_ip():
         return socket.gethostbyname(socket.gethostname())
 
 
+class Peer(object):
+    """A connected peer of the UDPConnection (per-peer state)
+
+    Permissions (flags) define which data of the peer are accepted:
+        MARKER: markers (written to the data file)
+        READ: getter, ping, subscriptions and clock synchronization
+        CONTROL: start, pause, quit, filename and setter
+    """
+
+    MARKER = 1
+    READ = 2
+    CONTROL = 4
+    ALL = MARKER | READ | CONTROL
+
+    _READ_COMMANDS = (RcCmd.PING, RcCmd.SUBSCRIBE, RcCmd.UNSUBSCRIBE,
+                      RcCmd.CLOCK_SYNC, RcCmd.PROTOCOL,
+                      RcCmd.COMMAND_STR + b"g",  # getter
+                      RcCmd.COMMAND_STR + b"x")  # feedback (client side)
+
+    def __init__(self, ip, permissions=ALL):
+        self.ip = ip
+        self.permissions = permissions
+        self.subscription = None # see streaming.StreamSubscription
+        self.n_received = 0
+        self.last_seen = None
+
+    def __str__(self):
+        return "{0} (permissions: {1}, received: {2})".format(self.ip,
+                                        self.permissions, self.n_received)
+
+    @staticmethod
+    def required_permission(data):
+        data = wire_protocol.decode_request(data)[1]
+        if not bytes_startswith(data, RcCmd.COMMAND_STR):
+            return Peer.MARKER
+        elif bytes_startswith(data, RcCmd.CLOCK_MAPPING):
+            return Peer.MARKER
+        for cmd in Peer._READ_COMMANDS:
+            if bytes_startswith(data, cmd):
+                return Peer.READ
+        return Peer.CONTROL
+
+    def allows(self, data):
+        return self.permissions & Peer.required_permission(data) != 0
+
+
 class UDPConnection(object):
-    # DOC document the usage "connecting" "unconnecting"
+    """UDP connection between the recording PC (server) and remote PCs
+
+    A remote PC connects by sending CONNECT and becomes a peer, if the
+    server replies COMMAND_REPLY (see connect_peer). Data of unconnected
+    senders are ignored by the server. UNCONNECT removes the peer.
+
+    Example::
+
+        udp = UDPConnection()
+        if udp.connect_peer("192.168.1.2"):
+            udp.send(b"marker")
+            udp.unconnect_peer()
+    """
+
     COMMAND_CHAR = b"$"
     CONNECT = COMMAND_CHAR + b"connect"
     UNCONNECT = COMMAND_CHAR + b"unconnect"
     COMMAND_REPLY = COMMAND_CHAR + b"ok"
     PING = COMMAND_CHAR + b"ping"
+    RECEIVE_BUFFER_SIZE = 4096
 
     MY_IP = get_lan_ip()
 
-    def __init__(self, udp_port=5005):
+    def __init__(self, udp_port=5005, ip=None, peer_permissions=None,
+                 default_permissions=Peer.ALL, multicast_group=None,
+                 multicast_ttl=1):
+        """ip: the ip to bind to, default: UDPConnection.MY_IP
+
+        Multiple peers can be connected at the same time (see `peers`).
+
+        peer_permissions: dict {ip: permissions}, see Peer
+        default_permissions: permissions of peers that are not in
+            peer_permissions. If None, connection requests of these peers are
+            rejected.
+        multicast_group: if defined, published data (see `publish`) are also
+            sent to this multicast group (e.g. "239.0.0.1"), see
+            MulticastListener
+        """
         self.udp_port = udp_port
+        if ip is None:
+            ip = UDPConnection.MY_IP
+        self._ip = ip
 
         self._socket = socket.socket(socket.AF_INET,  # Internet
                                      socket.SOCK_DGRAM)  # UDP
-        self._socket.bind((UDPConnection.MY_IP, self.udp_port))
+        self._socket.bind((self._ip, self.udp_port))
         self._socket.setblocking(False)
-        self.peer_ip = None
+        self.peers = OrderedDict() # ip: Peer
+        self._primary_peer = None
+        self.peer_permissions = dict(peer_permissions or {})
+        self.default_permissions = default_permissions
+        self.multicast_group = multicast_group
+        if multicast_group is not None:
+            self._socket.setsockopt(socket.IPPROTO_IP,
+                                    socket.IP_MULTICAST_TTL, multicast_ttl)
+            self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF,
+                                    socket.inet_aton(self._ip))
+        self.last_sender = None
         self.timer = Timer(sync_timer=app_timer) # own timer, because often
         # used in own process
+        self.last_receive_time_ns = None
+        self.kernel_timestamps = False
+        if SO_TIMESTAMPNS is not None:
+            try:
+                self._socket.setsockopt(socket.SOL_SOCKET, SO_TIMESTAMPNS, 1)
+                self.kernel_timestamps = True
+            except (OSError, AttributeError):
+                pass
 
     @property
     def my_ip(self):
-        return UDPConnection.MY_IP
+        return self._ip
+
+    @property
+    def socket(self):
+        """the socket, e.g. to wait for readability"""
+        return self._socket
+
+    @property
+    def peer_ip(self):
+        """ip of the peer that has been connected last (or None)"""
+        if self._primary_peer in self.peers:
+            return self._primary_peer
+        elif len(self.peers) > 0:
+            return next(reversed(self.peers))
+        return None
+
+    @peer_ip.setter
+    def peer_ip(self, ip):
+        if ip is None:
+            self.peers.pop(self.peer_ip, None)
+        else:
+            self.peers[ip] = Peer(ip, Peer.ALL)
+        self._primary_peer = ip
 
     def __str__(self):
-        return "ip: {0} (port: {1}); peer: {2}".format(UDPConnection.MY_IP,
+        return "ip: {0} (port: {1}); peer: {2}".format(self._ip,
                                                        self.udp_port, self.peer_ip)
 
     def receive(self, timeout):
@@ -85,45 +220,139 @@ class UDPConnection(object):
         if send is unkown input is ignored
         """
 
+        rcv = self._receive()
+        if rcv is None:
+            return None
+        return self._process(*rcv)
+
+    def poll_all(self, max_datagrams=1000):
+        """reads all pending datagrams (at most max_datagrams) and process
+        commands
+
+        returns list of tuples (data, receive time in ns, sender ip); data of
+        unknown senders are ignored
+        """
+
+        rtn = []
+        for _ in range(max_datagrams):
+            rcv = self._receive()
+            if rcv is None:
+                break
+            data = self._process(*rcv)
+            if data is not None:
+                rtn.append((data, self.last_receive_time_ns,
+                            self.last_sender))
+        return rtn
+
+    def _receive(self):
+        """returns tuple (data, sender) or None if no data"""
         try:
-            data, sender = self._socket.recvfrom(1024)
-        except:
+            if self.kernel_timestamps:
+                data, ancdata, _, sender = self._socket.recvmsg(
+                                        UDPConnection.RECEIVE_BUFFER_SIZE,
+                                        socket.CMSG_SPACE(_TIMESPEC.size))
+                self.last_receive_time_ns = self._kernel_time_ns(ancdata)
+            else:
+                data, sender = self._socket.recvfrom(
+                                        UDPConnection.RECEIVE_BUFFER_SIZE)
+                self.last_receive_time_ns = self.timer.time_ns
+        except socket.error:
             return None
+        return data, sender
 
+    def _process(self, data, sender):
         # process data
+        ip = sender[0]
         if data == UDPConnection.CONNECT:
             #connection request
-            self.peer_ip = sender[0]
-            if not self.send(UDPConnection.COMMAND_REPLY):
-                self.peer_ip = None
-        elif sender[0] != self.peer_ip:
+            permissions = self.peer_permissions.get(ip,
+                                                    self.default_permissions)
+            if permissions is None:
+                logging.warning("UDP: connection of {} rejected".format(ip))
+                return None
+            self.peers[ip] = Peer(ip, permissions)
+            self._primary_peer = ip
+            if not self.send(UDPConnection.COMMAND_REPLY, peer=ip):
+                self.peers.pop(ip, None)
+            self.last_sender = ip
+            return data
+
+        peer = self.peers.get(ip)
+        if peer is None:
             return None  # ignore data
-        elif data == UDPConnection.PING:
-            self.send(UDPConnection.COMMAND_REPLY)
+        peer.n_received += 1
+        peer.last_seen = self.last_receive_time_us
+        self.last_sender = ip
+        if data == UDPConnection.PING:
+            self.send(UDPConnection.COMMAND_REPLY, peer=ip)
         elif data == self.UNCONNECT:
-            self.unconnect_peer()
+            self.unconnect_peer(peer_ip=ip)
+        elif not peer.allows(data):
+            logging.warning("UDP: data of {} not permitted".format(ip))
+            return None
 
         return data
 
-    def send(self, data, timeout=1.0):
+    @property
+    def last_receive_time_us(self):
+        """receive time of the last datagram in microseconds"""
+        if self.last_receive_time_ns is None:
+            return None
+        return self.last_receive_time_ns // 1000
+
+    def _kernel_time_ns(self, ancdata):
+        """converts the kernel receive timestamp (CLOCK_REALTIME) into the
+        time base of the timer (ns). Falls back to the current time."""
+        for level, type_, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and type_ == SO_TIMESTAMPNS:
+                sec, nsec = _TIMESPEC.unpack_from(cmsg_data)
+                # age of the datagram, measured in realtime clock
+                now = get_time_ns()
+                age = time.time_ns() - (sec * 1000000000 + nsec)
+                return self.timer.from_monotonic_ns(now - age)
+        return self.timer.time_ns
+
+    def send(self, data, timeout=1.0, peer=None):
         """returns if problems or not
         timeout in seconds (default = 1.0)
+        peer: ip of the peer, default: peer_ip (peer connected last)
         return False if failed to send
 
         """
-        timeout_ms = int(timeout*1000)
-        if self.peer_ip is None:
+        if peer is None:
+            peer = self.peer_ip
+            if peer is None:
+                return False
+        return self._sendto(data, (peer, self.udp_port), timeout)
+
+    def publish(self, data, timeout=1.0):
+        """send data to all connected peers and the multicast group
+        return False if failed to send to at least one"""
+        rtn = True
+        for ip in list(self.peers.keys()):
+            rtn = self.send(data, timeout=timeout, peer=ip) and rtn
+        if self.multicast_group is not None:
+            rtn = self.send_multicast(data, timeout=timeout) and rtn
+        return rtn
+
+    def send_multicast(self, data, timeout=1.0):
+        if self.multicast_group is None:
             return False
+        return self._sendto(data, (self.multicast_group, self.udp_port),
+                            timeout)
+
+    def _sendto(self, data, address, timeout):
+        timeout_ms = int(timeout*1000)
         start = get_time_ms()
         if isinstance(data, str):
             data = data.encode() # force to byte
 
         while get_time_ms() - start < timeout_ms:
             try:
-                self._socket.sendto(data, (self.peer_ip, self.udp_port))
+                self._socket.sendto(data, address)
                 #print("UDP send: {0}".format(data))
                 return True
-            except:
+            except socket.error:
                 pass
         return False
 
@@ -147,13 +376,19 @@ class UDPConnection(object):
                 return True
         return False
 
-    def unconnect_peer(self, timeout=1.0):
-        self.send(UDPConnection.UNCONNECT, timeout=timeout)
-        self.peer_ip = None
+    def unconnect_peer(self, timeout=1.0, peer_ip=None):
+        """unconnect peer (peer_ip) or all peers (peer_ip=None)"""
+        if peer_ip is None:
+            peers = list(self.peers.keys())
+        else:
+            peers = [peer_ip]
+        for ip in peers:
+            self.send(UDPConnection.UNCONNECT, timeout=timeout, peer=ip)
+            self.peers.pop(ip, None)
 
     @property
     def is_connected(self):
-        return self.peer_ip is not None
+        return len(self.peers) > 0
 
     def ping(self, timeout=0.5):
         """returns boolean if succeeded and ping time in ms"""
@@ -182,40 +417,114 @@ class UDPConnection(object):
         return rtn
 
 
+class MulticastListener(object):
+    """Receives data published by a recorder to a multicast group
+    (see UDPConnection multicast_group), e.g. live data streams and feedback
+    events for monitoring PCs, which do not need to connect."""
+
+    def __init__(self, multicast_group, udp_port=5005, ip=None):
+        """ip: ip of the interface, default: UDPConnection.MY_IP"""
+        if ip is None:
+            ip = UDPConnection.MY_IP
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((multicast_group, udp_port))
+        self._socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP,
+                                socket.inet_aton(multicast_group) +
+                                socket.inet_aton(ip))
+        self._socket.setblocking(False)
+        self.last_sender = None
+
+    @property
+    def socket(self):
+        return self._socket
+
+    def poll(self):
+        """returns data (bytes) or None if no data found"""
+        try:
+            data, sender = self._socket.recvfrom(
+                                        UDPConnection.RECEIVE_BUFFER_SIZE)
+        except socket.error:
+            return None
+        self.last_sender = sender[0]
+        return data
+
+    def close(self):
+        self._socket.close()
+
+
+class SendQueue(object):
+    """Queue for data that has to be sent by the UDPConnectionProcess
+
+    In contrast to multiprocessing.Queue, the receiving end is a connection
+    that can be waited for together with the socket (see
+    multiprocessing.connection.wait). The UDP process is thus woken up by
+    send requests and does not need to poll the queue.
+
+    put blocks if the pipe is full, the UDP process therefore reads the
+    queue also while it is paused.
+    """
+
+    def __init__(self):
+        self._reader, self._writer = Pipe(duplex=False)
+        self._lock = Lock()
+
+    @property
+    def connection(self):
+        return self._reader
+
+    def put(self, data):
+        with self._lock:
+            self._writer.send(data)
+
+    def get_nowait(self):
+        if self._reader.poll():
+            return self._reader.recv()
+        raise Empty
+
+
 class UDPConnectionProcess(Process):
     """UDPConnectionProcess polls and writes to a data queue.
 
+    Multiple peers can be connected. Data put to the send_queue are sent to
+    all peers (and the multicast group, see `publish`); tuples (data,
+    peer_ip) are sent to a particular peer, e.g. replies to the sender of a
+    command (see UDPData.sender).
+
     Example::
 
         # Server that prints each input and echos it to the client
-        # that is currently connected
+        # that has sent it
 
         from udp_connection import UDPConnectionProcess, Queue
 
-        receive_queue = Queue()
-        udp_p = UDPConnectionProcess(receive_queue=receive_queue)
+        udp_p = UDPConnectionProcess()
         udp_p.start()
-        udp_p.event_polling.set() # start polling
 
         while True:
-            data = receive_queue.get()
-            print(data)
-            if data is not None:
-                udp_p.send_queue.put(data.string)
-
-    Example::
-
-        # connecting to a server
-    """        # DOC
-
-    def __init__(self, event_trigger = (),
-                 event_ignore_tag = None):
+            batch = udp_p.receive_queue.get() # list of UDPData
+            for data in batch:
+                print(data.unicode)
+                udp_p.send_queue.put((data.byte_string, data.sender))
+
+    The process connects no peers itself, remote PCs connect to it (see
+    UDPConnection).
+    """
+
+    def __init__(self, marker_buffers = (),
+                 event_ignore_tag = None,
+                 ip=None, udp_port=5005,
+                 stream_buffers=(),
+                 peer_permissions=None,
+                 default_permissions=Peer.ALL,
+                 multicast_group=None,
+                 multicast_stream=None):
         """Initialize UDPConnectionProcess
 
         Parameters
         ----------
-        receive_queue: multiprocessing.Queue
-            the queue to which the received data should be put
+        The received data are put to the receive_queue as batches (lists
+        of UDPData, all datagrams received at one wake-up).
 
         peer_ip : string
             the IP of the peer to which the connection should be established
@@ -223,54 +532,98 @@ class UDPConnectionProcess(Process):
         sync_clock : Clock
             the internal clock for timestamps will synchronized with this clock
 
-        event_trigger: multiprocessing.Event() (or list of..)
-            event trigger(s) to be set. If Udp event is received and it is not a
-            command to set this event (typical of sensor recording processes).
+        marker_buffers: list of SharedRingBuffer
+            the marker buffers of the sensor processes. The arrival time of
+            each received udp data, which is not a command, is written to
+            these buffers and the sensor processes mark the corresponding
+            samples (see sample_markers)
 
         event_ignore_tag:
-            udp data that start with this tag will be ignored for event triggering
+            udp data that start with this tag will be ignored for marking
+
+        ip, udp_port:
+            ip and port the connection is bound to (default: UDPConnection.MY_IP
+            and 5005)
+
+        stream_buffers: list of SharedRingBuffer
+            the stream buffers of the sensor processes (index = sensor).
+            Required for live streaming to a subscribed peer (see
+            streaming.encode_subscribe)
+
+        peer_permissions, default_permissions, multicast_group:
+            see UDPConnection
+
+        multicast_stream: bytes
+            subscription (see streaming.encode_subscribe) of a live data
+            stream that is continuously published to the multicast group
 
-        """ # DOC
+        """
 
         super(UDPConnectionProcess, self).__init__()
 
+        self._ip = ip
+        self._udp_port = udp_port
         self.receive_queue = Queue()
-        self.send_queue = Queue()
+        self.send_queue = SendQueue()
         self.event_is_connected = Event()
         self._event_quit_request = Event()
         self._event_is_polling = Event()
         self._event_ignore_tag = event_ignore_tag
+        self._stream_buffers = list(stream_buffers)
+        self._peer_permissions = peer_permissions
+        self._default_permissions = default_permissions
+        self._multicast_group = multicast_group
+        self._multicast_stream = multicast_stream
 
-        if isinstance(event_trigger, type(Event)  ):
-            event_trigger = (event_trigger)
-        try:
-            self._event_trigger = tuple(event_trigger)
-        except:
-            self._event_trigger = ()
+        self._marker_buffers = list(marker_buffers)
 
         atexit.register(self.quit)
 
     @property
     def my_ip(self):
-        return UDPConnection.MY_IP
+        if self._ip is None:
+            return UDPConnection.MY_IP
+        return self._ip
 
     def quit(self):
         self._event_quit_request.set()
         if self.is_alive():
+            self.send_queue.put(None)  # wake up
             self.join()
 
     def pause(self):
         self._event_is_polling.clear()
+        self.send_queue.put(None)  # wake up
 
     def start_polling(self):
         self._event_is_polling.set()
+        self.send_queue.put(None)  # wake up
+
+    def _send_pending(self, udp_connection):
+        """sends all data of the send queue"""
+        while self.send_queue.connection.poll():
+            data = self.send_queue.connection.recv()
+            if isinstance(data, tuple):
+                udp_connection.send(data[0], peer=data[1])
+            elif data is not None:
+                udp_connection.publish(data)
 
     def run(self):
-        udp_connection = UDPConnection(udp_port=5005)
+        udp_connection = UDPConnection(udp_port=self._udp_port, ip=self._ip,
+                            peer_permissions=self._peer_permissions,
+                            default_permissions=self._default_permissions,
+                            multicast_group=self._multicast_group)
         self.start_polling()
+        wait_objects = [udp_connection.socket, self.send_queue.connection]
 
         ptp = PollingTimeProfile()
         prev_event_polling = None
+        multicast_subscription = None
+        if self._multicast_stream is not None and \
+                self._multicast_group is not None:
+            multicast_subscription = StreamSubscription(
+                    self._multicast_stream[len(RcCmd.SUBSCRIBE):])
+            multicast_subscription.next_packet_time = 0
 
         while not self._event_quit_request.is_set():
 
@@ -285,33 +638,96 @@ class UDPConnectionProcess(Process):
                     ptp.stop()
 
             if not self._event_is_polling.is_set():
-                self._event_is_polling.wait(timeout=0.1)
-            else:
-                data = udp_connection.poll()
-                t = udp_connection.timer.time
-                ptp.update(t)
-                if data is not None:
-                    d = UDPData(string=data, time=t)
-                    self.receive_queue.put(d)
+                # send pending data, writers block if the pipe is full
+                if self.send_queue.connection in _wait_for_objects(
+                                [self.send_queue.connection], timeout=0.1):
+                    self._send_pending(udp_connection)
+                continue
+
+            # sleep until data received, send request or next stream packet
+            # (no busy waiting)
+            subscriptions = [(p.ip, p.subscription)
+                             for p in udp_connection.peers.values()
+                             if p.subscription is not None]
+            if multicast_subscription is not None:
+                subscriptions.append((None, multicast_subscription))
+            timeout = 0.1
+            for _, sub in subscriptions:
+                timeout = min(timeout, max(0, sub.next_packet_time -
+                                           udp_connection.timer.time) / 1000.0)
+            ready = _wait_for_objects(wait_objects, timeout=timeout)
+
+            if udp_connection.socket in ready:
+                # drain all pending datagrams and pass them as one batch
+                batch = []
+                for data, t_ns, sender in udp_connection.poll_all():
+                    t_us = t_ns // 1000
+                    t = t_ns // 1000000
+                    request_id, data = wire_protocol.decode_request(data)
+                    if bytes_startswith(data, RcCmd.CLOCK_SYNC):
+                        # answered immediately, not passed to the queue
+                        try:
+                            udp_connection.send(sync_reply(data, t_us,
+                                                udp_connection.timer.time_us),
+                                                peer=sender)
+                        except Exception:
+                            pass
+                        continue
+                    ptp.update_ns(t_ns)
+                    peer = udp_connection.peers.get(sender)
+                    if bytes_startswith(data, RcCmd.SUBSCRIBE) and \
+                            peer is not None:
+                        try:
+                            peer.subscription = StreamSubscription(
+                                            data[len(RcCmd.SUBSCRIBE):])
+                            peer.subscription.next_packet_time = t
+                        except Exception:
+                            logging.warning("UDP: invalid subscription")
+                            peer.subscription = None
+                    elif data == RcCmd.UNSUBSCRIBE and peer is not None:
+                        peer.subscription = None
+                    elif bytes_startswith(data, RcCmd.GET_VALUES):
+                        # answered here to avoid the latency of the main
+                        # process, always binary (new command)
+                        try:
+                            reply = wire_protocol.encode(get_values(
+                                self._stream_buffers,
+                                data[len(RcCmd.GET_VALUES):]))
+                        except Exception:
+                            reply = wire_protocol.encode(None)
+                        udp_connection.send(wire_protocol.encode_reply(
+                                request_id, RcCmd.VALUE + reply), peer=sender)
+                        continue  # answered, not passed to the queue
+                    d = UDPData(string=data, time_ns=t_ns, sender=sender,
+                                request_id=request_id)
+                    batch.append(d)
                     if self._event_ignore_tag is not None and \
                             not d.startswith(self._event_ignore_tag):
-                        for ev in self._event_trigger:
-                            # set all connected trigger
-                            ev.set()
-                try:
-                    udp_connection.send(self.send_queue.get_nowait())
-                except:
-                    pass
-
-                # has connection changed?
-                if self.event_is_connected.is_set() != udp_connection.is_connected:
-                    if udp_connection.is_connected:
-                        self.event_is_connected.set()
-                    else:
-                        self.event_is_connected.clear()
-
-                if not udp_connection.is_connected:
-                    udp_connection.timer.wait(200)
+                        write_marker(self._marker_buffers, t_ns / 1000000.0)
+                if len(batch) > 0:
+                    self.receive_queue.put(batch)
+
+            if self.send_queue.connection in ready:
+                self._send_pending(udp_connection)
+
+            for peer_ip, sub in subscriptions:
+                now = udp_connection.timer.time
+                if now >= sub.next_packet_time:
+                    # next packet time, but don't catch up
+                    sub.next_packet_time = max(sub.next_packet_time +
+                                               sub.packet_interval, now)
+                    for packet in sub.packets(self._stream_buffers):
+                        if peer_ip is None:
+                            udp_connection.send_multicast(packet)
+                        else:
+                            udp_connection.send(packet, peer=peer_ip)
+
+            # has connection changed?
+            if self.event_is_connected.is_set() != udp_connection.is_connected:
+                if udp_connection.is_connected:
+                    self.event_is_connected.set()
+                else:
+                    self.event_is_connected.clear()
 
         udp_connection.unconnect_peer()
 
@@ -0,0 +1,248 @@
+"""Binary encoding of the remote control payloads
+
+Payloads (e.g. of VALUE, CHANGED_LEVEL or SET_THRESHOLDS) are struct-packed.
+The first byte is the protocol version, followed by the encoded value:
+
+    tag (1 byte) + data (little endian)
+
+    N: None
+    T, F: True, False
+    i, q: int (int32, int64)
+    d: float (float64)
+    s: string (uint16 length + utf-8)
+    b: bytes (uint16 length + bytes)
+    l, u: list, tuple (uint16 length + encoded elements)
+
+Negotiation: a client sends GUIRemoteControlCommands.PROTOCOL followed by
+the highest version it supports (1 byte). The server replies VALUE with the
+version that will be used for this connection. Without negotiation (old
+clients), the server uses pickle (version 0). `decode` recognizes pickle
+payloads and unpickles them with a restricted unpickler, which only allows
+basic types and the thresholds.
+
+Request ids: replies to requests are matched by order, unless the request is
+wrapped with a request id (uint16), which the server echoes in the reply:
+
+    REQUEST + id + command  ->  REPLY + id + reply
+
+Late replies of timed out requests and requests without reply can thus not
+be confused with the replies of later requests.
+"""
+
+import io
+import pickle
+import struct
+
+from .types import GUIRemoteControlCommands as RcCmd
+
+PICKLE = 0
+PROTOCOL_VERSION = 1
+
+_PICKLE_PROTO = b"\x80"
+_INT = struct.Struct("<i")
+_LONG = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_LEN = struct.Struct("<H")
+_VERSION = bytes(bytearray([PROTOCOL_VERSION]))
+_FLOAT_HEAD = _VERSION + b"d"
+_INT_HEAD = _VERSION + b"i"
+_NONE = _VERSION + b"N"
+
+_SAFE_CLASSES = {("forceDAQ._lib.types", "Thresholds"),
+                 ("forceDAQ._lib.misc", "MinMaxDetector"),
+                 ("builtins", "list"), ("builtins", "tuple"),
+                 ("builtins", "dict"), ("builtins", "set"),
+                 ("builtins", "frozenset"),
+                 ("_codecs", "encode")}  # bytes in pickle protocol 2
+
+
+class _RestrictedUnpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        if (module, name) in _SAFE_CLASSES:
+            return super(_RestrictedUnpickler, self).find_class(module, name)
+        raise pickle.UnpicklingError("forbidden global {}.{}".format(module,
+                                                                      name))
+
+
+def restricted_loads(data):
+    """unpickle data of (old) remote control peers
+
+    Only basic types and the thresholds objects are allowed.
+    """
+    return _RestrictedUnpickler(io.BytesIO(data)).load()
+
+
+def _encode_value(value, buffer):
+    if value is None:
+        buffer.append(b"N")
+    elif value is True:
+        buffer.append(b"T")
+    elif value is False:
+        buffer.append(b"F")
+    elif isinstance(value, int):
+        if -0x80000000 <= value <= 0x7FFFFFFF:
+            buffer.append(b"i" + _INT.pack(value))
+        else:
+            buffer.append(b"q" + _LONG.pack(value))
+    elif isinstance(value, float):
+        buffer.append(b"d" + _FLOAT.pack(value))
+    elif isinstance(value, str):
+        value = value.encode("utf-8")
+        buffer.append(b"s" + _LEN.pack(len(value)) + value)
+    elif isinstance(value, bytes):
+        buffer.append(b"b" + _LEN.pack(len(value)) + value)
+    elif isinstance(value, (list, tuple)):
+        if isinstance(value, list):
+            buffer.append(b"l" + _LEN.pack(len(value)))
+        else:
+            buffer.append(b"u" + _LEN.pack(len(value)))
+        for x in value:
+            _encode_value(x, buffer)
+    elif hasattr(value, "thresholds"):  # Thresholds
+        _encode_value(list(value.thresholds), buffer)
+    else:
+        try:  # numpy scalar
+            if float(value) == int(value) and \
+                    "int" in type(value).__name__:
+                _encode_value(int(value), buffer)
+            else:
+                _encode_value(float(value), buffer)
+        except (TypeError, ValueError):
+            raise RuntimeError("Can't encode {}".format(type(value)))
+
+
+def _decode_value(data, p):
+    tag = data[p:p + 1]
+    p += 1
+    if tag == b"d":
+        return _FLOAT.unpack_from(data, p)[0], p + 8
+    elif tag == b"i":
+        return _INT.unpack_from(data, p)[0], p + 4
+    elif tag == b"q":
+        return _LONG.unpack_from(data, p)[0], p + 8
+    elif tag == b"N":
+        return None, p
+    elif tag == b"T":
+        return True, p
+    elif tag == b"F":
+        return False, p
+    elif tag in (b"s", b"b"):
+        n = _LEN.unpack_from(data, p)[0]
+        p += 2
+        value = bytes(data[p:p + n])
+        if tag == b"s":
+            value = value.decode("utf-8", "replace")
+        return value, p + n
+    elif tag in (b"l", b"u"):
+        n = _LEN.unpack_from(data, p)[0]
+        p += 2
+        rtn = []
+        for _ in range(n):
+            x, p = _decode_value(data, p)
+            rtn.append(x)
+        if tag == b"u":
+            rtn = tuple(rtn)
+        return rtn, p
+    raise RuntimeError("Unknown type tag {}".format(tag))
+
+
+def encode(value, version=PROTOCOL_VERSION):
+    """encode a payload
+
+    version: protocol version, PICKLE for old peers
+    """
+    if version == PICKLE:
+        return pickle.dumps(value, protocol=2)
+    # fast paths of the most frequent payloads
+    tp = type(value)
+    if tp is float:
+        return _FLOAT_HEAD + _FLOAT.pack(value)
+    elif tp is int and -0x80000000 <= value <= 0x7FFFFFFF:
+        return _INT_HEAD + _INT.pack(value)
+    elif value is None:
+        return _NONE
+    buffer = [_VERSION]
+    _encode_value(value, buffer)
+    return b"".join(buffer)
+
+
+def decode(payload):
+    """decode a payload (binary or pickle)
+
+    raises RuntimeError, if the payload can't be decoded
+    """
+    if len(payload) == 0:
+        raise RuntimeError("Empty payload")
+    if payload[:1] == _PICKLE_PROTO:
+        try:
+            return restricted_loads(payload)
+        except Exception as e:
+            raise RuntimeError("Can't unpickle payload: {}".format(e))
+    if payload[0] > PROTOCOL_VERSION:
+        raise RuntimeError("Unknown protocol version {}".format(payload[0]))
+    try:
+        return _decode_value(payload, 1)[0]
+    except (struct.error, IndexError) as e:
+        raise RuntimeError("Invalid payload: {}".format(e))
+
+
+def negotiate_version(payload):
+    """version used for a connection, payload: data of PROTOCOL command"""
+    if len(payload) == 0:
+        return PICKLE
+    return min(payload[0], PROTOCOL_VERSION)
+
+
+def encode_request(request_id, command):
+    """wraps a command with a request id (0 - 65535)"""
+    return RcCmd.REQUEST + _LEN.pack(request_id & 0xFFFF) + command
+
+
+def decode_request(data):
+    """returns request id and command or (None, data), if the data are not
+    wrapped"""
+    if data[:len(RcCmd.REQUEST)] != RcCmd.REQUEST or \
+            len(data) < len(RcCmd.REQUEST) + _LEN.size:
+        return None, data
+    p = len(RcCmd.REQUEST)
+    return _LEN.unpack_from(data, p)[0], data[p + _LEN.size:]
+
+
+def encode_reply(request_id, reply):
+    """wraps a reply with the request id (if request_id is not None)"""
+    if request_id is None:
+        return reply
+    return RcCmd.REPLY + _LEN.pack(request_id) + reply
+
+
+def decode_reply(data):
+    """returns request id and reply or (None, data), if the data are not
+    wrapped"""
+    if data[:len(RcCmd.REPLY)] != RcCmd.REPLY or \
+            len(data) < len(RcCmd.REPLY) + _LEN.size:
+        return None, data
+    p = len(RcCmd.REPLY)
+    return _LEN.unpack_from(data, p)[0], data[p + _LEN.size:]
+
+
+if __name__ == "__main__":
+    # microbenchmark: encode/decode cost per message
+    from timeit import timeit
+
+    from .types import Thresholds
+
+    n = 100000
+    messages = [("float", 12.3456), ("int", 3), ("None", None),
+                ("tuple", (1, 3)), ("string", "0.9.2"),
+                ("thresholds", Thresholds([-10.0, 5.0, 20.0]))]
+    print("{:<11} {:>14} {:>14} {:>9}".format("message", "encode (us)",
+                                              "decode (us)", "bytes"))
+    for name, value in messages:
+        for version in (PICKLE, PROTOCOL_VERSION):
+            data = encode(value, version)
+            t_enc = timeit(lambda: encode(value, version), number=n) / n
+            t_dec = timeit(lambda: decode(data), number=n) / n
+            print("{:<11} {:>14.3f} {:>14.3f} {:>9}".format(
+                name + (" (p)" if version == PICKLE else ""),
+                t_enc * 1e6, t_dec * 1e6, len(data)))
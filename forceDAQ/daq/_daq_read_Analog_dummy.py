@@ -17,6 +17,10 @@ class DAQReadAnalog(object):
         self._task_is_started = False
         self._last_time = 0
         self._sample_cnt = 0
+        if configuration is None:
+            self._simulation_rate = 1000.0
+        else:
+            self._simulation_rate = configuration.rate.value
         self._simulation_timer = Timer()
         txt = "Using dummy sensor: Maybe PyDAQmx or nidaqmx is not  installed"
         logging.warning(txt)
@@ -45,6 +49,16 @@ class DAQReadAnalog(object):
         if self._task_is_started:
             self._task_is_started = False
 
+    @property
+    def samples_acquired(self):
+        """total number of simulated samples since the start of the
+        acquisition (configured sampling rate)"""
+        return self._n_simulated_samples()
+
+    def _n_simulated_samples(self):
+        return int(self._simulation_timer.time_ns * self._simulation_rate
+                   // 1000000000)
+
     def read_analog(self):
         """Reading data
 
@@ -68,9 +82,9 @@ class DAQReadAnalog(object):
         if not self._task_is_started:
             return None, None
 
-        n_new_samples = self._simulation_timer.time - self._sample_cnt
+        n_new_samples = self._n_simulated_samples() - self._sample_cnt
         while n_new_samples <= 0:
-            n_new_samples = self._simulation_timer.time - self._sample_cnt
+            n_new_samples = self._n_simulated_samples() - self._sample_cnt
 
         self._sample_cnt += 1
         x = self._sample_cnt / 2000
@@ -76,6 +76,14 @@ class DAQReadAnalog(PyDAQmx.Task):
             self.StopTask()
             self._task_is_started = False
 
+    @property
+    def samples_acquired(self):
+        """total number of samples acquired (per channel) since the start
+        of the acquisition (hardware sample clock)"""
+        n = ct.c_uint64()
+        self.GetReadTotalSampPerChanAcquired(ct.byref(n))
+        return n.value
+
     def read_analog(self):
         """Polling data
 
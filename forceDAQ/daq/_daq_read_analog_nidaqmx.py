@@ -62,6 +62,12 @@ class DAQReadAnalog(nidaqmx.Task):
             self.stop()
             self._task_is_started = False
 
+    @property
+    def samples_acquired(self):
+        """total number of samples acquired (per channel) since the start
+        of the acquisition (hardware sample clock)"""
+        return self.in_stream.total_samp_per_chan_acquired
+
     def read_analog(self):
         """Polling data
 
@@ -1,2 +1,2 @@
 from .read_force_data import DataFrameDict, read_raw_data, \
-            data_frame_to_text
+            read_raw_data_as_arrays, data_frame_to_text
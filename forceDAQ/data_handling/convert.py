@@ -12,7 +12,8 @@ import os
 import sys
 import gzip
 import numpy as np
-from .read_force_data import read_raw_data, data_frame_to_text
+from .read_force_data import read_raw_data, data_frame_to_text, \
+    file_time_unit, TAG_SAMPLE_CLOCK, TIME_UNITS
 
 PAUSE_CRITERION = 500
 MSEC_PER_SAMPLES = 1
@@ -21,13 +22,13 @@ MIN_DELAY_ENDSTREAM = 2
 CONVERTED_SUFFIX = ".conv.csv.gz"
 CONVERTED_SUBFOLDER = "converted"
 
-def _periods_from_daq_events(daq_events):
+def _periods_from_daq_events(daq_events, ms_per_time_unit=1):
 
     periods = {}
     started = None
     sensor_id = None
     evt = np.array(daq_events["value"])
-    times = np.array(daq_events["time"]).astype(int)
+    times = np.array(daq_events["time"]).astype(float) * ms_per_time_unit
     idx = np.argsort(times)
 
     for t, v in zip(times[idx], evt[idx]):
@@ -99,7 +100,7 @@ def _linear_timeline_matched_by_single_reference_sample(irregular_timeline,
 
 def _timeline_matched_by_delay_chunked_samples(times, msec_per_sample):
 
-    rtn = np.empty(len(times))*np.NaN
+    rtn = np.empty(len(times))*np.nan
     p = 0
     while p<len(times):
         next_ref_sample = _end_stream_sample(times[p:])
@@ -140,14 +141,17 @@ class Method(object):
         return None
 
 
-def _adjusted_timestamps(timestamps, pauses_idx, evt_periods, method):
+def _adjusted_timestamps(timestamps, pauses_idx, evt_periods, method,
+                         msec_per_sample=MSEC_PER_SAMPLES):
     """
         method=Method(1): _linear_timeline_matched_by_single_reference_sample
         method=Method(2): _timeline_matched_by_delay_chunked_samples
+
+        timestamps in ms, returns the adjusted timestamps (ms, float)
     """
 
     # adapting timestamps
-    rtn = np.empty(len(timestamps))*np.NaN
+    rtn = np.empty(len(timestamps))*np.nan
     period_counter = 0
     for idx, evt_per in zip(pauses_idx, evt_periods):
         # loop over periods
@@ -156,7 +160,7 @@ def _adjusted_timestamps(timestamps, pauses_idx, evt_periods, method):
         period_counter += 1
         n_samples = idx[1] - idx[0] + 1
         if evt_per[1]: # end time
-            sample_diff  = n_samples - (1+(evt_per[1]-evt_per[0])//MSEC_PER_SAMPLES)
+            sample_diff  = n_samples - int(1+(evt_per[1]-evt_per[0])//msec_per_sample)
             if sample_diff!=0:
                 print("Period {}: Sample difference of {}".format(
                     period_counter, sample_diff))
@@ -172,17 +176,17 @@ def _adjusted_timestamps(timestamps, pauses_idx, evt_periods, method):
                 next_ref = 0
             newtimes = _linear_timeline_matched_by_single_reference_sample(
                         times, id_ref_sample=REF_SAMPLE_PROBE + next_ref,
-                        msec_per_sample=MSEC_PER_SAMPLES)
+                        msec_per_sample=msec_per_sample)
         elif method.id==2:
             # using delays
             newtimes = _timeline_matched_by_delay_chunked_samples(times,
-                                                                  msec_per_sample=MSEC_PER_SAMPLES)
+                                                                  msec_per_sample=msec_per_sample)
         else:
             newtimes = times
 
         rtn[idx[0]:idx[1] + 1] = newtimes
 
-    return rtn.astype(int)
+    return rtn
 
 
 def converted_filename(flname):
@@ -197,9 +201,12 @@ def converted_filename(flname):
     return converted_path, new_filename + CONVERTED_SUFFIX
 
 def convert_raw_data(filepath, method, save_time_adjustments=False,
-                     keep_delay_variable=False):
+                     keep_delay_variable=False,
+                     msec_per_sample=MSEC_PER_SAMPLES):
     """preprocessing raw pyForceData:
 
+    The timestamps are adjusted in ms and saved in the time unit of the
+    file (see read_force_data.file_time_unit).
     """
     # todo only one sensor
     assert(isinstance(method, Method))
@@ -215,20 +222,32 @@ def convert_raw_data(filepath, method, save_time_adjustments=False,
     if not keep_delay_variable:
         data.pop("delay", None)
 
-    timestamps = np.array(data["time"]).astype(int)
+    if (TAG_SAMPLE_CLOCK + ",") in comments:
+        # timestamps from the hardware sample clock (see
+        # _lib.sample_clock), no adjustment required
+        print("Sample clock timestamps: not adjusted")
+        save_time_adjustments = False
+    else:
+        ms_per_time_unit = TIME_UNITS[file_time_unit(comments)] / \
+                           float(TIME_UNITS["ms"])
+        times_ms = np.array(data["time"]).astype(float) * ms_per_time_unit
+        timestamps = np.round(times_ms / ms_per_time_unit).astype(np.int64)
 
-    #pauses
-    pauses_idx = _pauses_idx_from_timeline(timestamps, pause_criterion=PAUSE_CRITERION)
-    evt_periods = _periods_from_daq_events(daq_events)
+        #pauses
+        pauses_idx = _pauses_idx_from_timeline(times_ms, pause_criterion=PAUSE_CRITERION)
+        evt_periods = _periods_from_daq_events(daq_events, ms_per_time_unit)
 
-    if len(pauses_idx) != len(evt_periods[sensor_id]):
-        raise RuntimeError("Pauses in DAQ events do not match recording pauses")
-    else:
-        data["time"] = _adjusted_timestamps(timestamps=timestamps,
+        if len(pauses_idx) != len(evt_periods[sensor_id]):
+            raise RuntimeError("Pauses in DAQ events do not match recording pauses")
+        else:
+            adjusted = _adjusted_timestamps(timestamps=times_ms,
                                             pauses_idx=pauses_idx,
                                             evt_periods=evt_periods[
                                             sensor_id],
-                                            method=method)
+                                            method=method,
+                                            msec_per_sample=msec_per_sample)
+            data["time"] = np.round(adjusted / ms_per_time_unit).astype(
+                                                                    np.int64)
 
     if save_time_adjustments:
         data["time_adjustment"] = timestamps-data["time"]
@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+
+"""
+Offline conversion of voltage recordings to forces and torques
+
+Sensors recorded with `SensorSettings(convert_to_FT=False)` store the raw
+gauge voltages (in the columns Fx, Fy, Fz, Tx, Ty & Tz). This module converts
+whole recordings with a chosen calibration file, bias and tool transform.
+
+The conversion is a vectorized numpy implementation of the ATIDAQ C library
+(see atidaq_cdll/atidaq/ftconfig.c & ftrt.c), that is, the same math as
+ATI_CDLL.convertToFT, bias, setToolTransform, setForceUnits and
+setTorqueUnits.
+
+This module can be also executed:
+
+    python -m forceDAQ.data_handling.ft_conversion calibration.cal data.csv ...
+"""
+
+import os
+import sys
+import gzip
+import xml.etree.ElementTree as ET
+import numpy as np
+
+from .read_force_data import read_raw_data_as_arrays, file_time_unit, \
+    TIME_UNITS
+from .convert import CONVERTED_SUBFOLDER, PAUSE_CRITERION
+
+FT_SUFFIX = ".ft.csv.gz"
+VOLTAGE_VARIABLES = ("Fx", "Fy", "Fz", "Tx", "Ty", "Tz")
+
+_FORCE_CONV = {"lb": 1.0, "lbf": 1.0, "klb": 0.001, "klbf": 0.001,
+               "N": 4.44822161526, "kN": 0.00444822161526,
+               "kg": 0.45359237, "g": 453.59237}
+_TORQUE_CONV = {"in-lb": 1.0, "in-lbf": 1.0, "lb-in": 1.0, "lbf-in": 1.0,
+                "ft-lb": 0.08333333333, "lb-ft": 0.08333333333,
+                "ft-lbf": 0.08333333333, "lbf-ft": 0.08333333333,
+                "N-m": 0.112984829028, "Nm": 0.112984829028,
+                "N-mm": 112.984829028, "Nmm": 112.984829028,
+                "kg-cm": 1.1521246198, "kgcm": 1.1521246198,
+                "kN-m": 0.000112984829028, "kNm": 0.000112984829028}
+_DIST_CONV = {"in": 1.0, "m": 0.0254, "cm": 2.54, "mm": 25.4,
+              "ft": 0.08333333333}
+_ANGLE_CONV = {"deg": 1.0, "degrees": 1.0, "degree": 1.0,
+               "rad": np.pi / 180, "radians": np.pi / 180,
+               "radian": np.pi / 180}
+
+
+def _values(txt):
+    return np.array(txt.split(), dtype=float)
+
+
+def _tool_transform_matrix(vector, dist_units, angle_units, force_units,
+                           torque_units):
+    """6x6 tool transform matrix (see TTM in ftconfig.c)"""
+
+    try:
+        dc = _TORQUE_CONV[torque_units] / (_FORCE_CONV[force_units] *
+                                           _DIST_CONV[dist_units])
+        ac = 1.0 / _ANGLE_CONV[angle_units]
+    except KeyError:
+        raise RuntimeError("Invalid tool transform units.")
+
+    rx, ry, rz = np.pi / 180 * np.asarray(vector[3:6], dtype=float) * ac
+    sx, cx = np.sin(rx), np.cos(rx)
+    sy, cy = np.sin(ry), np.cos(ry)
+    sz, cz = np.sin(rz), np.cos(rz)
+    dx, dy, dz = np.asarray(vector[0:3], dtype=float) * dc
+
+    R = np.array([[cy * cz, sx * sy * cz + cx * sz, sx * sz - cx * sy * cz],
+                  [-cy * sz, -sx * sy * sz + cx * cz, sx * cz + cx * sy * sz],
+                  [sy, -sx * cy, cx * cy]])
+    rtn = np.zeros((6, 6))
+    rtn[0:3, 0:3] = R
+    rtn[3:6, 3:6] = R
+    for i in range(3):
+        rtn[3 + i, 0] = R[i, 2] * dy - R[i, 1] * dz
+        rtn[3 + i, 1] = R[i, 0] * dz - R[i, 2] * dx
+        rtn[3 + i, 2] = R[i, 1] * dx - R[i, 0] * dy
+    return rtn
+
+
+class ATICalibration(object):
+    """Numpy implementation of the ATIDAQ calibration
+
+    The interface corresponds to ATI_CDLL, but all methods process arrays of
+    samples.
+
+    Example::
+
+        cal = ATICalibration("FT34108.cal")
+        cal.setForceUnits("N")
+        cal.setTorqueUnits("N-m")
+        cal.bias(voltages[:100, :].mean(axis=0))
+        forces = cal.convertToFT(voltages)
+
+    """
+
+    def __init__(self, calibration_file, index=1):
+        """Loads calibration info for a transducer
+
+        Parameters
+        ----------
+        calibration_file: str
+            the name and path of the calibration file
+        index: int
+            the number of the calibration within the file (usually 1)
+
+        """
+
+        root = ET.parse(calibration_file).getroot()
+        if root.tag != "FTSensor":
+            raise RuntimeError("Specified calibration could not be loaded.")
+        calibrations = root.findall("Calibration")
+        if len(calibrations) < index:
+            raise RuntimeError("Specified calibration could not be loaded.")
+        cal = calibrations[index - 1]
+
+        self.serial = root.get("Serial")
+        self.n_gauges = int(root.get("NumGages"))
+        self.calibration_force_units = cal.get("ForceUnits")
+        self.calibration_torque_units = cal.get("TorqueUnits")
+        self._basic_dist_units = cal.get("DistUnits")
+        self._basic_angle_units = cal.get("AngleUnits", "degrees")
+
+        axes = cal.findall("Axis")
+        self.axis_names = [a.get("Name") for a in axes]
+        self.basic_matrix = np.array(
+            [_values(a.get("values"))[:self.n_gauges] /
+             float(a.get("scale", "1")) for a in axes])
+        self.max_loads = np.array([float(a.get("max", "0")) for a in axes])
+
+        self._basic_transform = np.zeros(6)
+        self.bias_slopes = np.zeros(self.n_gauges)
+        self.gain_slopes = np.zeros(self.n_gauges)
+        self.thermistor = 0.0
+        self.temp_comp_available = False
+        for node in cal:
+            if node.tag == "BasicTransform":
+                self._basic_transform = np.array(
+                    [float(node.get(x, "0")) for x in
+                     ("Dx", "Dy", "Dz", "Rx", "Ry", "Rz")])
+            elif node.tag == "BiasSlope":
+                self.bias_slopes = _values(node.get("values"))[:self.n_gauges]
+                self.temp_comp_available = True
+            elif node.tag == "GainSlope":
+                self.gain_slopes = _values(node.get("values"))[:self.n_gauges]
+                self.temp_comp_available = True
+            elif node.tag == "Thermistor":
+                self.thermistor = float(node.get("value"))
+
+        # defaults (see ResetDefaults in ftconfig.c)
+        self.force_units = self.calibration_force_units
+        self.torque_units = self.calibration_torque_units
+        self._user_transform = np.zeros(6)
+        self._user_dist_units = self._basic_dist_units
+        self._user_angle_units = self._basic_angle_units
+        self.temp_comp_enabled = self.temp_comp_available
+        self.bias_vector = np.zeros(self.n_gauges + 1)
+        self.tc_bias_vector = np.zeros(self.n_gauges)
+        self._calc_matrix()
+
+    def _calc_matrix(self):
+        """working matrix based on the basic matrix, basic tool transform,
+        user tool transform and user units (see GetMatrix in ftconfig.c)"""
+
+        if len(self.axis_names) == 6:
+            basic = _tool_transform_matrix(self._basic_transform,
+                                           self._basic_dist_units,
+                                           self._basic_angle_units,
+                                           self.calibration_force_units,
+                                           self.calibration_torque_units)
+            user = _tool_transform_matrix(self._user_transform,
+                                          self._user_dist_units,
+                                          self._user_angle_units,
+                                          self.calibration_force_units,
+                                          self.calibration_torque_units)
+            matrix = np.dot(user, np.dot(basic, self.basic_matrix))
+        else:
+            matrix = self.basic_matrix.copy()
+
+        try:
+            f_conv = _FORCE_CONV[self.force_units] / \
+                     _FORCE_CONV[self.calibration_force_units]
+            t_conv = _TORQUE_CONV[self.torque_units] / \
+                     _TORQUE_CONV[self.calibration_torque_units]
+        except KeyError:
+            raise RuntimeError("Invalid units.")
+        for i, name in enumerate(self.axis_names):
+            if name.startswith("F"):
+                matrix[i, :] *= f_conv
+            else:
+                matrix[i, :] *= t_conv
+        self.working_matrix = matrix
+
+    def setToolTransform(self, Vector, DistUnits, AngleUnits):
+        """Performs a 6-axis translation/rotation on the transducer's
+        coordinate system.
+
+        Vector: displacements and rotations in the order Dx, Dy, Dz, Rx, Ry, Rz
+        """
+
+        if DistUnits not in _DIST_CONV:
+            raise RuntimeError("Invalid distance units.")
+        if AngleUnits not in _ANGLE_CONV:
+            raise RuntimeError("Invalid angle units.")
+        self._user_transform = np.asarray(Vector, dtype=float)
+        self._user_dist_units = DistUnits
+        self._user_angle_units = AngleUnits
+        self._calc_matrix()
+
+    def setForceUnits(self, NewUnits):
+        if NewUnits not in _FORCE_CONV:
+            raise RuntimeError("Invalid force units.")
+        self.force_units = NewUnits
+        self._calc_matrix()
+
+    def setTorqueUnits(self, NewUnits):
+        if NewUnits not in _TORQUE_CONV:
+            raise RuntimeError("Invalid torque units.")
+        self.torque_units = NewUnits
+        self._calc_matrix()
+
+    def setTempComp(self, TCEnabled):
+        if TCEnabled and not self.temp_comp_available:
+            raise RuntimeError("Not available on this transducer system")
+        self.temp_comp_enabled = bool(TCEnabled)
+
+    def _voltages(self, voltages):
+        """voltage array (n_samples, n_gauges + 1) incl. thermistor channel
+        (zero, if not defined)"""
+        v = np.asarray(voltages, dtype=float)
+        v = v.reshape((-1, v.shape[-1]))
+        if v.shape[1] < self.n_gauges + 1:
+            v = np.hstack((v, np.zeros((len(v),
+                                        self.n_gauges + 1 - v.shape[1]))))
+        return v[:, :self.n_gauges + 1]
+
+    def _temp_comp(self, v):
+        dt = v[:, self.n_gauges:self.n_gauges + 1] - self.thermistor
+        return (v[:, :self.n_gauges] + self.bias_slopes * dt) / \
+               (1 - self.gain_slopes * dt)
+
+    def bias(self, voltages):
+        """Stores a voltage reading to be subtracted from subsequent readings
+
+        voltages: one sample or array of samples (the mean is used)
+        """
+
+        v = np.mean(self._voltages(voltages), axis=0, keepdims=True)
+        self.bias_vector = v[0].copy()
+        self.tc_bias_vector = self._temp_comp(v)[0]
+
+    def convertToFT(self, voltages, reverse_parameters=()):
+        """Converts an array of voltages (n_samples, n_gauges) into forces and
+        torques (n_samples, n_axes)
+
+        reverse_parameters: list of ids of parameter that should be reversed
+        """
+
+        v = self._voltages(voltages)
+        if self.temp_comp_enabled:
+            cv = self._temp_comp(v) - self.tc_bias_vector
+        else:
+            cv = v[:, :self.n_gauges] - self.bias_vector[:self.n_gauges]
+        rtn = np.dot(cv, self.working_matrix.T)
+        for x in reverse_parameters:
+            rtn[:, x] = -1 * rtn[:, x]
+        return rtn
+
+
+def quiet_period(voltages, window, pause_idx=None):
+    """finds the index of the quietest window of samples, that is, the window
+    with the smallest summed variance over all channels
+
+    returns: slice
+    """
+
+    v = np.asarray(voltages, dtype=float)
+    if len(v) <= window:
+        return slice(0, len(v))
+    c1 = np.vstack((np.zeros((1, v.shape[1])), np.cumsum(v, axis=0)))
+    c2 = np.vstack((np.zeros((1, v.shape[1])), np.cumsum(v ** 2, axis=0)))
+    s1 = c1[window:] - c1[:-window]
+    s2 = c2[window:] - c2[:-window]
+    var = np.sum(s2 / window - (s1 / window) ** 2, axis=1)
+    if pause_idx is not None:
+        # windows must not include pauses
+        for p in pause_idx:
+            var[max(0, p - window + 1):p + 1] = np.inf
+    start = int(np.argmin(var))
+    return slice(start, start + window)
+
+
+def convert_voltage_data(data, calibration, bias_window=500,
+                         bias_period=None, reverse_parameter_names=()):
+    """converts voltage data frame of a single sensor to forces
+
+    Parameters
+    ----------
+    data: data frame (dict of numpy arrays)
+    calibration: ATICalibration
+    bias_window: int
+        number of samples used for the automatic detection of a quiet
+        period for the bias
+    bias_period: tuple (start_time, end_time), optional
+        time period used for the bias (instead of automatic detection)
+    reverse_parameter_names: list of str
+        reversed parameters of the recording (SensorSettings). The reversal
+        of the recorded voltages is undone and applied to the forces.
+
+    Returns: forces (numpy array) and used bias period (start_time, end_time)
+    """
+
+    missing = [v for v in VOLTAGE_VARIABLES if v not in data]
+    if len(missing) > 0:
+        raise RuntimeError("Voltages of all six gauges are required. " +
+                           "Missing: {}".format(", ".join(missing)))
+
+    reverse = [VOLTAGE_VARIABLES.index(x) for x in reverse_parameter_names]
+    voltages = np.column_stack([data[v] for v in VOLTAGE_VARIABLES])
+    voltages[:, reverse] = -1 * voltages[:, reverse]
+    time = data["time"]
+
+    if bias_period is None:
+        pause_idx = np.flatnonzero(np.diff(time) > PAUSE_CRITERION) + 1
+        bias_idx = quiet_period(voltages, window=bias_window,
+                                pause_idx=pause_idx)
+    else:
+        bias_idx = (time >= bias_period[0]) & (time <= bias_period[1])
+        if not np.any(bias_idx):
+            raise RuntimeError("No samples in bias period.")
+    calibration.bias(voltages[bias_idx])
+    t = time[bias_idx]
+    return (calibration.convertToFT(voltages, reverse_parameters=reverse),
+            (float(t[0]), float(t[-1])))
+
+
+def _column_format(varname, values, time_decimals=0):
+    """savetxt format of a column: six significant digits for forces,
+    exact values for time, indices and trigger"""
+    if varname in VOLTAGE_VARIABLES:
+        return "%.6g"
+    if np.all(values == np.round(values)):
+        return "%d"
+    if varname == "time":
+        return "%.{}f".format(time_decimals)
+    return "%.4f"
+
+
+def ft_filename(flname):
+    """returns path and filename of the force data file"""
+    for suffix in (".csv.gz", ".csv", ".gz"):
+        if flname.endswith(suffix):
+            flname = flname[:-len(suffix)]
+            break
+    path, new_filename = os.path.split(flname)
+    return os.path.join(path, CONVERTED_SUBFOLDER), new_filename + FT_SUFFIX
+
+
+def convert_voltage_file(filepath, calibration_file, bias_window=500,
+                         bias_period=None, tool_transform=None,
+                         force_units="N", torque_units="N-m",
+                         reverse_parameter_names=()):
+    """converts a voltage recording to forces and saves the data in the
+    subfolder `converted`
+
+    tool_transform: tuple (vector, dist_units, angle_units), optional
+        see ATI_CDLL.setToolTransform
+
+    Returns: filename of the converted data
+    """
+
+    filepath = os.path.join(os.path.split(sys.argv[0])[0], filepath)
+    data, _udp, _daq, comments = read_raw_data_as_arrays(filepath)
+
+    if "device_tag" in data:
+        devices = np.unique(data["device_tag"])
+    else:
+        devices = [None]
+
+    forces = np.empty((len(data["time"]), len(VOLTAGE_VARIABLES)))
+    info = []
+    for dev in devices:
+        calibration = ATICalibration(calibration_file)
+        calibration.setForceUnits(force_units)
+        calibration.setTorqueUnits(torque_units)
+        if tool_transform is not None:
+            calibration.setToolTransform(*tool_transform)
+        if dev is None:
+            idx = slice(None)
+        else:
+            idx = data["device_tag"] == dev
+        sensor_data = dict((k, v[idx]) for k, v in data.items())
+        forces[idx, :], bias = convert_voltage_data(sensor_data, calibration,
+                        bias_window=bias_window, bias_period=bias_period,
+                        reverse_parameter_names=reverse_parameter_names)
+        info.append("# Converted: device={}, cal-file={}, bias={}-{}, "
+                    "tool-transform={}\n".format(dev, calibration_file,
+                                                 bias[0], bias[1],
+                                                 tool_transform))
+
+    for c, v in enumerate(VOLTAGE_VARIABLES):
+        data[v] = forces[:, c]
+    # timestamps in the time unit of the file (as the copied events)
+    ns_per_unit = TIME_UNITS[file_time_unit(comments)]
+    time_decimals = len(str(ns_per_unit)) - 1
+    data["time"] = np.round(data["time"] * TIME_UNITS["ms"] / ns_per_unit,
+                            time_decimals)
+
+    folder, new_filename = ft_filename(filepath)
+    try:
+        os.makedirs(folder)
+    except:
+        pass
+    new_filename = os.path.join(folder, new_filename)
+    with gzip.open(new_filename, "wt") as fl:
+        fl.write(comments)
+        fl.write("".join(info))
+        fl.write(",".join(data.keys()) + "\n")
+        np.savetxt(fl, np.column_stack(list(data.values())), delimiter=",",
+                   fmt=[_column_format(k, v, time_decimals)
+                        for k, v in data.items()])
+    return new_filename
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: ft_conversion.py calibration_file data_file ...")
+        sys.exit()
+    for flname in sys.argv[2:]:
+        print("Converting {}".format(flname))
+        print(" -> {}".format(convert_voltage_file(flname, sys.argv[1])))
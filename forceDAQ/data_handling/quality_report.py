@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+
+"""
+Data quality report for force recordings
+
+Scans recordings (in parallel) and computes per file and per sensor
+    * sample gaps and inter-sample interval histograms
+    * acquisition delay percentiles
+    * consistency of recording pauses and DAQ events
+    * saturation with respect to the DAQ input range (minVal/maxVal)
+
+and aggregates the results in one machine-readable (json) summary.
+
+This module can be also executed:
+
+    python -m forceDAQ.data_handling.quality_report data_folder [summary.json]
+"""
+
+import os
+import re
+import sys
+import json
+from multiprocessing import Pool
+import numpy as np
+
+from .read_force_data import read_raw_data_as_arrays
+from .convert import PAUSE_CRITERION, _pauses_idx_from_timeline, \
+    _periods_from_daq_events, get_all_data_files
+
+FORCE_VARIABLES = ("Fx", "Fy", "Fz", "Tx", "Ty", "Tz")
+DELAY_PERCENTILES = (50, 90, 99, 99.9)
+INTERVAL_RANGE = 10  # ms, larger intervals are counted in the last bin
+
+
+class QualitySettings(object):
+    """Settings of the quality check"""
+
+    def __init__(self, rate=1000, minVal=-10, maxVal=10,
+                 gap_factor=1.5, pause_criterion=PAUSE_CRITERION,
+                 interval_range=INTERVAL_RANGE):
+        """
+        Parameters
+        ----------
+        rate: float
+            expected sampling rate (Hz)
+        minVal, maxVal: float
+            input range of the DAQ device (see SensorSettings). Samples at
+            or beyond this range are counted as saturated. Note, the check is
+            meaningful only for voltage recordings (convert_to_FT=False) or
+            with the input range converted to forces.
+        gap_factor: float
+            intervals larger than gap_factor * sampling interval are gaps
+        pause_criterion: int
+            intervals larger than pause_criterion (ms) are recording pauses
+        interval_range: int
+            range of inter-sample interval histogram (ms)
+
+        """
+
+        self.rate = rate
+        self.minVal = minVal
+        self.maxVal = maxVal
+        self.gap_factor = gap_factor
+        self.pause_criterion = pause_criterion
+        self.interval_range = interval_range
+
+
+def _sensor_ids_from_comments(comments):
+    return [int(x) for x in re.findall(r"Sensor: id=(\d+)", comments)]
+
+
+def _percentiles(values, percentiles):
+    if len(values) == 0:
+        return dict((str(p), None) for p in percentiles)
+    return dict((str(p), float(v)) for p, v in
+                zip(percentiles, np.percentile(values, percentiles)))
+
+
+def sensor_quality(data, daq_periods, settings):
+    """quality measures for the data of a single sensor
+
+    data: data frame (dict of arrays) of a single sensor
+    daq_periods: list of (start, stop) from DAQ events of this sensor
+    settings: QualitySettings
+
+    returns dict
+    """
+
+    time = data["time"]
+    n = len(time)
+    rtn = {"n_samples": n}
+    if n == 0:
+        return rtn
+
+    interval = 1000.0 / settings.rate
+    diff = np.diff(time)
+    in_period = diff <= settings.pause_criterion
+
+    # intervals & gaps
+    d = diff[in_period]
+    hist = np.bincount(np.clip(np.round(d).astype(int), 0,
+                               settings.interval_range),
+                       minlength=settings.interval_range + 1)
+    gaps = d[d > settings.gap_factor * interval]
+    rtn["duration"] = float(np.sum(d))
+    rtn["interval_histogram"] = hist.tolist()
+    rtn["interval_mean"] = float(np.mean(d)) if len(d) else None
+    rtn["n_gaps"] = int(len(gaps))
+    rtn["max_gap"] = float(np.max(gaps)) if len(gaps) else 0.0
+    rtn["missing_samples"] = int(np.sum(np.round(gaps / interval) - 1))
+
+    # acquisition delay
+    if "delay" in data:
+        rtn["delay_percentiles"] = _percentiles(data["delay"],
+                                                DELAY_PERCENTILES)
+        rtn["delay_max"] = float(np.max(data["delay"]))
+
+    # pauses and event consistency
+    pauses = _pauses_idx_from_timeline(time, settings.pause_criterion)
+    rtn["n_periods"] = len(pauses)
+    rtn["n_daq_periods"] = len(daq_periods)
+    sample_diff = []
+    for idx, per in zip(pauses, daq_periods):
+        if per[0] is not None and per[1] is not None:
+            expected = 1 + int((per[1] - per[0]) // interval)
+            sample_diff.append(int(idx[1] - idx[0] + 1 - expected))
+        else:
+            sample_diff.append(None)
+    rtn["period_sample_difference"] = sample_diff
+    rtn["periods_consistent"] = len(pauses) == len(daq_periods)
+
+    # saturation
+    saturation = {}
+    for v in FORCE_VARIABLES:
+        if v in data:
+            x = data[v]
+            saturation[v] = int(np.count_nonzero(
+                            (x <= settings.minVal) | (x >= settings.maxVal)))
+    rtn["saturated_samples"] = saturation
+    return rtn
+
+
+def file_quality(path, settings=None):
+    """quality measures for all sensors in a data file
+
+    returns dict
+    """
+
+    if settings is None:
+        settings = QualitySettings()
+    rtn = {"file": path}
+    try:
+        data, udp, daq_events, comments = read_raw_data_as_arrays(path)
+    except Exception as err:
+        rtn["error"] = str(err)
+        return rtn
+
+    if "time" not in data:
+        rtn["error"] = "no data"
+        return rtn
+
+    periods = _periods_from_daq_events(daq_events)
+    sensor_ids = _sensor_ids_from_comments(comments)
+    rtn["n_udp_events"] = len(udp["time"])
+    rtn["n_daq_events"] = len(daq_events["time"])
+    rtn["sensors"] = {}
+    if "device_tag" in data:
+        for dev in np.unique(data["device_tag"]).astype(int):
+            idx = data["device_tag"] == dev
+            sensor_data = dict((k, v[idx]) for k, v in data.items())
+            rtn["sensors"][str(dev)] = sensor_quality(sensor_data,
+                                            periods.get(dev, []), settings)
+    else:
+        if len(sensor_ids) > 0:
+            dev = sensor_ids[0]
+        else:
+            dev = None
+        rtn["sensors"][str(dev)] = sensor_quality(data, periods.get(dev, []),
+                                                  settings)
+    return rtn
+
+
+def _file_quality(args):
+    return file_quality(*args)
+
+
+def _aggregate(reports, settings):
+    rtn = {"n_files": len(reports),
+           "n_errors": 0,
+           "n_samples": 0,
+           "n_gaps": 0,
+           "missing_samples": 0,
+           "max_gap": 0.0,
+           "delay_max": None,
+           "inconsistent_files": [],
+           "saturated_files": [],
+           "interval_histogram": np.zeros(settings.interval_range + 1,
+                                          dtype=int)}
+    for rep in reports:
+        if "error" in rep:
+            rtn["n_errors"] += 1
+            continue
+        for sensor in rep["sensors"].values():
+            if sensor["n_samples"] == 0:
+                continue
+            rtn["n_samples"] += sensor["n_samples"]
+            rtn["n_gaps"] += sensor["n_gaps"]
+            rtn["missing_samples"] += sensor["missing_samples"]
+            rtn["max_gap"] = max(rtn["max_gap"], sensor["max_gap"])
+            rtn["interval_histogram"] += sensor["interval_histogram"]
+            if "delay_max" in sensor:
+                if rtn["delay_max"] is None:
+                    rtn["delay_max"] = sensor["delay_max"]
+                else:
+                    rtn["delay_max"] = max(rtn["delay_max"],
+                                           sensor["delay_max"])
+            if not sensor["periods_consistent"] and \
+                    rep["file"] not in rtn["inconsistent_files"]:
+                rtn["inconsistent_files"].append(rep["file"])
+            if sum(sensor["saturated_samples"].values()) > 0 and \
+                    rep["file"] not in rtn["saturated_files"]:
+                rtn["saturated_files"].append(rep["file"])
+
+    rtn["interval_histogram"] = rtn["interval_histogram"].tolist()
+    return rtn
+
+
+def quality_report(files, settings=None, n_processes=None):
+    """quality report for multiple files, processed in parallel
+
+    files: list of files or folder
+
+    returns dict with "summary" and "files"
+    """
+
+    if settings is None:
+        settings = QualitySettings()
+    if isinstance(files, str):
+        files = get_all_data_files(files)
+
+    args = [(f, settings) for f in files]
+    if n_processes == 1 or len(files) < 2:
+        reports = list(map(_file_quality, args))
+    else:
+        with Pool(processes=n_processes) as pool:
+            reports = pool.map(_file_quality, args, chunksize=4)
+
+    return {"summary": _aggregate(reports, settings),
+            "settings": settings.__dict__,
+            "files": reports}
+
+
+def save_quality_report(report, filename):
+    with open(filename, "w") as fl:
+        json.dump(report, fl, indent=2)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("usage: quality_report.py data_folder [summary.json]")
+        sys.exit()
+    folder = sys.argv[1]
+    if len(sys.argv) > 2:
+        output = sys.argv[2]
+    else:
+        output = os.path.join(folder, "quality_report.json")
+    report = quality_report(folder)
+    save_quality_report(report, output)
+    print(json.dumps(report["summary"], indent=2))
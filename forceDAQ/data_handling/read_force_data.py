@@ -10,6 +10,8 @@ import gzip
 from collections import OrderedDict
 import numpy as np
 
+from .._lib.types import TAG_SAMPLE_CLOCK, TAG_TIME_UNIT, TIME_UNITS
+
 TAG_COMMENTS = "#"
 TAG_UDPDATA  = TAG_COMMENTS + "UDP"
 TAG_DAQEVENTS = TAG_COMMENTS + "T"
@@ -44,9 +46,20 @@ def data_frame_to_text(data_frame):
     return rtn
 
 
+def file_time_unit(comments):
+    """time unit of the timestamps of a data file ("ms" for files without
+    time unit in the header)"""
+    for ln in comments.splitlines():
+        if ln.startswith(TAG_TIME_UNIT):
+            return ln[len(TAG_TIME_UNIT):].strip()
+    return "ms"
+
+
 def read_raw_data(path):
     """reading trigger and udp data
 
+    The timestamps are the strings of the file (see file_time_unit).
+
     Returns: data, udp_event, daq_events and comments
 
             data, udp_event, daq_events: DataFrameDict
@@ -87,3 +100,78 @@ def read_raw_data(path):
             DataFrameDict(daq_events, ["time", "value"]),
             comments)
 
+
+def _event_frame(lines, tag):
+    """helper: event lines to data frame with numerical time array"""
+    times = []
+    values = []
+    for ln in lines:
+        t, _, v = ln[len(tag) + 1:].partition(",")
+        times.append(t)
+        values.append(v.strip())
+    rtn = OrderedDict()
+    rtn["time"] = np.array(times, dtype=float)
+    rtn["value"] = values
+    return rtn
+
+
+def read_raw_data_as_arrays(path, time_unit="ms"):
+    """fast reading of force data into numpy arrays
+
+    In contrast to `read_raw_data`, the samples are not split into lists of
+    strings line by line, but parsed at once into a float array.
+
+    The timestamps of samples and events are converted to time_unit ("ns",
+    "us" or "ms"), independent of the time unit of the file. Default are
+    milliseconds (float).
+
+    Returns: data, udp_event, daq_events and comments
+
+            data: OrderedDict of numpy arrays (float)
+            udp_event, daq_events: OrderedDict with "time" (numpy array) and
+                        "value" (list of strings)
+            comments: text string
+    """
+
+    app_dir = os.path.split(sys.argv[0])[0]
+    path = os.path.abspath(os.path.join(app_dir, path))
+
+    if path.endswith("gz"):
+        fl = gzip.open(path, "rt")
+    else:
+        fl = open(path, "rt")
+    lines = fl.read().splitlines()
+    fl.close()
+
+    comment_lines = [ln for ln in lines if ln.startswith(TAG_COMMENTS)]
+    data_lines = [ln for ln in lines if len(ln) > 0 and
+                  not ln.startswith(TAG_COMMENTS)]
+
+    data = OrderedDict()
+    if len(data_lines) > 0:
+        varnames = _csv(data_lines[0])
+        if len(data_lines) > 1:
+            values = np.loadtxt(data_lines[1:], delimiter=",", ndmin=2)
+        else:
+            values = np.empty((0, len(varnames)))
+        for c, v in enumerate(varnames):
+            data[v] = values[:, c]
+
+    udp_events = _event_frame([ln for ln in comment_lines
+                               if ln.startswith(TAG_UDPDATA + ",")],
+                              TAG_UDPDATA)
+    daq_events = _event_frame([ln for ln in comment_lines
+                               if ln.startswith(TAG_DAQEVENTS + ",")],
+                              TAG_DAQEVENTS)
+    comments = "\n".join(comment_lines)
+    if len(comments) > 0:
+        comments += "\n"
+
+    factor = TIME_UNITS[file_time_unit(comments)] / float(TIME_UNITS[time_unit])
+    if factor != 1:
+        for frame in (data, udp_events, daq_events):
+            if "time" in frame:
+                frame["time"] = frame["time"] * factor
+
+    return data, udp_events, daq_events, comments
+
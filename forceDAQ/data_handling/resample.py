@@ -0,0 +1,318 @@
+"""
+Resampling of force data onto a uniform time grid
+
+Host timestamps are integer milliseconds with jitter. The resampler
+interpolates force channels onto a uniform timeline of a chosen rate and
+keeps trigger channels as step signals (sample and hold). Data can be
+processed chunk by chunk (streaming), the state between chunks is kept by
+the Resampler object.
+
+Methods:
+    "linear": linear interpolation based on the timestamps
+    "polyphase": anti-aliased rational resampling (polyphase FIR filter)
+            based on the sample order, that is, the samples are assumed to
+            be recorded at a constant source rate (hardware clock)
+"""
+
+from fractions import Fraction
+from collections import OrderedDict
+import numpy as np
+
+from .read_force_data import read_raw_data_as_arrays
+from .convert import PAUSE_CRITERION, _pauses_idx_from_timeline
+
+FORCE_VARIABLES = ("Fx", "Fy", "Fz", "Tx", "Ty", "Tz")
+TRIGGER_VARIABLES = ("trigger1", "trigger2")
+METHODS = ("linear", "polyphase")
+
+
+def lowpass_fir(cutoff, n_taps, kaiser_beta=5.0):
+    """windowed-sinc low-pass FIR filter (normalized to unity gain)
+
+    cutoff: float
+        cutoff frequency in cycles per sample (0 < cutoff <= 0.5)
+    """
+    n = np.arange(n_taps) - (n_taps - 1) / 2.0
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(n_taps, kaiser_beta)
+    return h / np.sum(h)
+
+
+class Resampler(object):
+    """Streaming resampler for force data
+
+    Example::
+
+        rs = Resampler(rate=250, method="polyphase", source_rate=1000)
+        for times, forces, trigger in chunks:
+            t, f, tr = rs.process(times, forces, trigger)
+            ...
+        t, f, tr = rs.flush()
+
+    """
+
+    def __init__(self, rate, method="linear", source_rate=None,
+                 taps_per_phase=20, kaiser_beta=5.0):
+        """Create a Resampler
+
+        Parameters
+        ----------
+        rate: float
+            the target sampling rate (in Hz)
+        method: str
+            "linear" or "polyphase"
+        source_rate: float, optional
+            the sampling rate of the input (required for "polyphase")
+        taps_per_phase: int, optional
+            length of the polyphase filter relative to the resampling
+            ratio (only "polyphase")
+        kaiser_beta: float, optional
+            kaiser window parameter of the filter (only "polyphase")
+
+        """
+
+        if method not in METHODS:
+            raise RuntimeError("Unknown resampling method: {}".format(method))
+        if method == "polyphase" and source_rate is None:
+            raise RuntimeError("Polyphase resampling requires a source rate.")
+
+        self.rate = float(rate)
+        self.method = method
+        self.source_rate = source_rate
+        self.step = 1000.0 / self.rate  # ms
+
+        if method == "polyphase":
+            ratio = Fraction(self.rate / source_rate).limit_denominator(1000)
+            self._up = ratio.numerator
+            self._down = ratio.denominator
+            n_taps = 2 * taps_per_phase * max(self._up, self._down) + 1
+            h = lowpass_fir(cutoff=0.5 / max(self._up, self._down),
+                            n_taps=n_taps, kaiser_beta=kaiser_beta)
+            # polyphase matrix (up, n_taps_per_phase)
+            k = int(np.ceil(n_taps / self._up))
+            h = np.append(h, np.zeros(k * self._up - n_taps))
+            self._phases = h.reshape((k, self._up)).T * self._up
+            self._n_phase_taps = k
+            self._delay = (n_taps - 1) / (2.0 * self._up)  # in input samples
+
+        self.reset()
+
+    def reset(self):
+        """reset the streaming state (e.g. after a pause in the recording)"""
+        self._last_time = None
+        self._last_values = None
+        self._next_time = None
+        # polyphase
+        self._t0 = None
+        self._buffer = None
+        self._buffer_start = 0  # global input index of buffer[0]
+        self._n_input = 0
+        self._next_output = 0
+
+    def process(self, times, forces, trigger=None):
+        """resample the next chunk of data
+
+        Parameters
+        ----------
+        times: array (n_samples)
+            timestamps in ms
+        forces: array (n_samples, n_force_channels)
+        trigger: array (n_samples, n_trigger_channels), optional
+            trigger channels, resampled as step signals
+
+        Returns
+        -------
+        times, forces, trigger: numpy arrays of the uniform grid
+            (trigger is None if not defined)
+
+        """
+
+        times = np.asarray(times, dtype=float)
+        forces = np.asarray(forces, dtype=float).reshape((len(times), -1))
+        n_forces = forces.shape[1]
+        if trigger is not None:
+            trigger = np.asarray(trigger, dtype=float).reshape((len(times), -1))
+            values = np.hstack((forces, trigger))
+        else:
+            values = forces
+
+        if len(times) == 0:
+            return self._split(np.empty(0), np.empty((0, values.shape[1])),
+                               n_forces, trigger is not None)
+
+        if self.method == "linear":
+            t, v = self._process_linear(times, values, n_forces)
+        else:
+            t, v = self._process_polyphase(times, values, n_forces)
+        return self._split(t, v, n_forces, trigger is not None)
+
+    def flush(self, n_forces=None, has_trigger=True):
+        """emits the remaining samples delayed by the filter
+        (polyphase only) and resets the resampler"""
+
+        if self.method == "linear" or self._buffer is None:
+            self.reset()
+            return None, None, None
+        if n_forces is None:
+            n_forces = self._n_forces
+        last = self._buffer[-1:]
+        n_pad = int(np.ceil(self._delay)) + 2
+        last_input = self._n_input - 1
+        t, v = self._process_polyphase(None, np.repeat(last, n_pad, axis=0),
+                                       n_forces, last_input=last_input)
+        self.reset()
+        return self._split(t, v, n_forces, has_trigger)
+
+    @staticmethod
+    def _split(t, v, n_forces, has_trigger):
+        if has_trigger:
+            return t, v[:, :n_forces], v[:, n_forces:]
+        else:
+            return t, v, None
+
+    def _process_linear(self, times, values, n_forces):
+        if self._last_time is not None:
+            times = np.append(self._last_time, times)
+            values = np.vstack((self._last_values, values))
+        else:
+            # first grid point: first full step
+            self._next_time = np.ceil(times[0] / self.step) * self.step
+
+        n_grid = int(np.floor((times[-1] - self._next_time) / self.step)) + 1
+        if n_grid > 0:
+            grid = self._next_time + np.arange(n_grid) * self.step
+            rtn = np.empty((n_grid, values.shape[1]))
+            for c in range(n_forces):
+                rtn[:, c] = np.interp(grid, times, values[:, c])
+            # trigger: step signal (last sample at or before grid time)
+            idx = np.searchsorted(times, grid, side="right") - 1
+            rtn[:, n_forces:] = values[np.maximum(idx, 0), n_forces:]
+            self._next_time = grid[-1] + self.step
+        else:
+            grid = np.empty(0)
+            rtn = np.empty((0, values.shape[1]))
+
+        self._last_time = times[-1:]
+        self._last_values = values[-1:]
+        return grid, rtn
+
+    def _process_polyphase(self, times, values, n_forces, last_input=None):
+        k = self._n_phase_taps
+        if self._buffer is None:
+            # edge handling: pad history with the first sample
+            self._t0 = times[0]
+            self._n_forces = n_forces
+            self._buffer = np.repeat(values[:1], k, axis=0)
+            self._buffer_start = -k
+            self._next_output = int(np.ceil(self._delay * self._up /
+                                            self._down))
+        self._buffer = np.vstack((self._buffer, values))
+        if last_input is None:
+            self._n_input += len(values)
+            last_input = self._n_input - 1
+
+        buffer_end = self._buffer_start + len(self._buffer) - 1
+        # outputs: filter input index i (<= buffer_end) and sample position
+        # pos (<= last_input) must be available
+        n_max_filter = ((buffer_end + 1) * self._up - 1) // self._down
+        n_max_pos = int(np.floor((last_input + self._delay) *
+                                  self._up / self._down))
+        n_out = np.arange(self._next_output,
+                          min(n_max_filter, n_max_pos) + 1)
+        if len(n_out) > 0:
+            pos_up = n_out * self._down
+            i = pos_up // self._up
+            phase = pos_up % self._up
+            idx = (i - self._buffer_start)[:, np.newaxis] - np.arange(k)
+            x = self._buffer[idx, :n_forces]  # (n_out, k, n_forces)
+            forces = np.einsum("nk,nkc->nc", self._phases[phase], x)
+            pos = n_out * self._down / float(self._up) - self._delay
+            trig_idx = np.floor(pos).astype(int) - self._buffer_start
+            rtn = np.hstack((forces, self._buffer[trig_idx, n_forces:]))
+            t = self._t0 + pos * 1000.0 / self.source_rate
+            self._next_output = n_out[-1] + 1
+        else:
+            t = np.empty(0)
+            rtn = np.empty((0, values.shape[1]))
+
+        # trim buffer: keep what the next output needs
+        next_i = (self._next_output * self._down) // self._up
+        next_pos = int(np.floor(self._next_output * self._down /
+                                float(self._up) - self._delay))
+        keep_from = min(next_i - k + 1, next_pos) - self._buffer_start
+        if keep_from > 0:
+            self._buffer = self._buffer[keep_from:]
+            self._buffer_start += keep_from
+        return t, rtn
+
+
+def resample_data(data, rate, method="linear", source_rate=None,
+                  chunk_size=100000, pause_criterion=PAUSE_CRITERION):
+    """resample data frame (dict of arrays) of a single sensor
+
+    Periods separated by recording pauses are resampled separately.
+
+    Returns: OrderedDict of numpy arrays (time, forces & trigger)
+    """
+
+    times = np.asarray(data["time"], dtype=float)
+    force_vars = [v for v in FORCE_VARIABLES if v in data]
+    trigger_vars = [v for v in TRIGGER_VARIABLES if v in data]
+    forces = np.column_stack([np.asarray(data[v], dtype=float)
+                              for v in force_vars])
+    if len(trigger_vars) > 0:
+        trigger = np.column_stack([np.asarray(data[v], dtype=float)
+                                   for v in trigger_vars])
+    else:
+        trigger = np.empty((len(times), 0))
+
+    rs = Resampler(rate=rate, method=method, source_rate=source_rate)
+    rtn_t, rtn_f, rtn_tr = [], [], []
+    for first, last in _pauses_idx_from_timeline(times, pause_criterion):
+        for p in range(first, last + 1, chunk_size):
+            q = min(p + chunk_size, last + 1)
+            t, f, tr = rs.process(times[p:q], forces[p:q], trigger[p:q])
+            rtn_t.append(t)
+            rtn_f.append(f)
+            rtn_tr.append(tr)
+        t, f, tr = rs.flush(n_forces=len(force_vars))
+        if t is not None:
+            rtn_t.append(t)
+            rtn_f.append(f)
+            rtn_tr.append(tr)
+
+    rtn = OrderedDict()
+    rtn["time"] = np.concatenate(rtn_t)
+    f = np.vstack(rtn_f)
+    tr = np.vstack(rtn_tr)
+    for c, v in enumerate(force_vars):
+        rtn[v] = f[:, c]
+    for c, v in enumerate(trigger_vars):
+        rtn[v] = tr[:, c]
+    return rtn
+
+
+def resample_file(path, rate, method="linear", source_rate=None,
+                  chunk_size=100000):
+    """read a raw data file and resample the data of each sensor
+
+    Returns: dict (key: device_tag) of data frames (OrderedDict of
+             numpy arrays). Key is None for single-sensor recordings.
+    """
+
+    data, _udp, _daq, _comments = read_raw_data_as_arrays(path)
+    if "device_tag" in data:
+        devices = np.unique(data["device_tag"]).astype(int)
+    else:
+        devices = [None]
+
+    rtn = OrderedDict()
+    for dev in devices:
+        if dev is None:
+            sensor_data = data
+        else:
+            idx = data["device_tag"] == dev
+            sensor_data = OrderedDict((k, v[idx]) for k, v in data.items())
+        rtn[dev] = resample_data(sensor_data, rate=rate, method=method,
+                                 source_rate=source_rate,
+                                 chunk_size=chunk_size)
+    return rtn
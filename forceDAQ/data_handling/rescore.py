@@ -0,0 +1,260 @@
+#!/usr/bin/env python
+
+"""
+Offline re-scoring of responses in recorded force data
+
+Replays the level change and response min/max detection (see
+_lib.detection, same semantics as the online detection in the sensor
+process) over recorded data with new thresholds. Detections start
+
+    * at the detection starts logged by the sensor processes (DAQ events
+      "level_change_detection:<sensor>" and
+      "response_minmax_detection:<sensor>:<n_samples>"), or
+    * at UDP markers that start with a given prefix (e.g. trial onsets).
+
+A detection runs until it has detected its event or until the next
+detection of the same sensor starts. Levels are determined from the moving
+average of the detection parameter. Files are processed in parallel. For
+threshold sweeps, multiple threshold sets can be scored while reading each
+file only once.
+
+This module can be also executed:
+
+    python -m forceDAQ.data_handling.rescore thresholds data_folder [output.csv]
+
+    thresholds: comma separated list, e.g. "-5,5,20"
+"""
+
+import os
+import sys
+from multiprocessing import Pool
+import numpy as np
+
+from .read_force_data import read_raw_data_as_arrays
+from .convert import get_all_data_files
+from .quality_report import _sensor_ids_from_comments
+from .._lib.detection import ThresholdClassifier, DetectionEngine, \
+    LEVEL_CHANGE, RESPONSE_MINMAX
+
+VARNAMES = ("file", "sensor", "thresholds", "start_time", "detection",
+            "n_samples", "time", "value", "online_time", "online_value")
+
+
+class RescoreSettings(object):
+    """Settings of the re-scoring"""
+
+    def __init__(self, thresholds, parameter="Fz", moving_average_size=5,
+                 marker=None, detection=LEVEL_CHANGE, duration=None,
+                 rate=1000):
+        """
+        Parameters
+        ----------
+        thresholds: list of floats or list of threshold lists (sweep)
+        parameter: string
+            detection parameter (Fx, Fy, Fz, Tx, Ty or Tz)
+        moving_average_size: int
+            number of samples of the moving average
+        marker: bytes or string, optional
+            if defined, detections start at the UDP markers with this prefix
+            (instead of the logged detection starts)
+        detection: detection started at the markers (LEVEL_CHANGE or
+            RESPONSE_MINMAX)
+        duration: int, optional
+            response period (ms) of the min/max detection. Required for
+            detections started at markers, otherwise it overrides the
+            logged period.
+        rate: float
+            sampling rate (Hz), to convert the duration to samples
+
+        """
+
+        thresholds = list(thresholds)
+        if len(thresholds) > 0 and not isinstance(thresholds[0],
+                                                  (list, tuple, np.ndarray)):
+            thresholds = [thresholds]
+        self.thresholds = [sorted(map(float, x)) for x in thresholds]
+        self.parameter = parameter
+        self.moving_average_size = moving_average_size
+        if isinstance(marker, bytes):
+            marker = marker.decode("utf-8", "replace")
+        self.marker = marker
+        self.detection = detection
+        self.duration = duration
+        self.rate = rate
+
+    @property
+    def n_samples(self):
+        """duration in samples or None"""
+        if self.duration is None:
+            return None
+        return int(round(self.duration * self.rate / 1000.0))
+
+
+def _daq_event_values(daq_events, prefix, sensor):
+    """times and values of DAQ events '<prefix>:<sensor>:value'"""
+    rtn = []
+    needle = "{}:{}".format(prefix, sensor)
+    for t, v in zip(daq_events["time"], daq_events["value"]):
+        if v == needle or v.startswith(needle + ":"):
+            rtn.append((t, v[len(needle) + 1:]))
+    return rtn
+
+
+def detection_starts(daq_events, udp_events, sensor, settings):
+    """list of detection starts (time, detection, n_samples) of a sensor"""
+    if settings.marker is not None:
+        times = [t for t, v in zip(udp_events["time"], udp_events["value"])
+                 if v.startswith(settings.marker)]
+        return [(t, settings.detection, settings.n_samples) for t in times]
+
+    rtn = [(t, LEVEL_CHANGE, None) for t, _ in _daq_event_values(
+                        daq_events, LEVEL_CHANGE + "_detection", sensor)]
+    for t, v in _daq_event_values(daq_events, RESPONSE_MINMAX + "_detection",
+                                  sensor):
+        if settings.n_samples is not None:
+            n = settings.n_samples
+        else:
+            n = int(v)
+        rtn.append((t, RESPONSE_MINMAX, n))
+    rtn.sort(key=lambda x: x[0])
+    return rtn
+
+
+def rescore_sensor(times, values, starts, thresholds, moving_average_size=5,
+                   online_events=()):
+    """re-scoring of the detections of a single sensor
+
+    times, values: arrays of timestamps and detection parameter
+    starts: list of detection starts (time, detection, n_samples)
+    thresholds: list of floats
+    online_events: list of online detected events (time, detection, value)
+
+    returns list of dicts
+    """
+
+    engine = DetectionEngine(thresholds,
+                             moving_average_size=moving_average_size)
+    levels = engine.get_level(engine.moving_average(values))
+    classifier = ThresholdClassifier(thresholds)
+    start_idx = np.searchsorted(times, [s[0] for s in starts], side="right")
+    end_idx = np.append(start_idx[1:], len(times))
+
+    rtn = []
+    for (t, detection, n_samples), i, end in zip(starts, start_idx, end_idx):
+        row = {"start_time": t, "detection": detection,
+               "n_samples": n_samples, "time": None, "value": None,
+               "online_time": None, "online_value": None}
+        # online result (the next logged event before the next start)
+        for ot, od, ov in online_events:
+            if od == detection and ot >= t and (end >= len(times) or
+                                                ot < times[end]):
+                row["online_time"], row["online_value"] = ot, ov
+                break
+        if i < end:
+            # start level: level of the moving average before the start
+            start_level = levels[max(i - 1, 0)]
+            if detection == LEVEL_CHANGE:
+                classifier.start_level_change_detection(0, start_level)
+            else:
+                classifier.start_response_minmax_detection(0, start_level,
+                                                           n_samples)
+            events = classifier.process(levels[i:end])
+            classifier.stop()
+            if len(events) > 0:
+                _, idx, _, value = events[0]
+                row["time"] = times[i + idx]
+                if isinstance(value, tuple):
+                    value = "{}:{}".format(*value)
+                row["value"] = value
+        rtn.append(row)
+    return rtn
+
+
+def _online_events(daq_events, sensor):
+    rtn = []
+    for detection in (LEVEL_CHANGE, RESPONSE_MINMAX):
+        for t, v in _daq_event_values(daq_events, detection, sensor):
+            rtn.append((t, detection, v))
+    rtn.sort(key=lambda x: x[0])
+    return rtn
+
+
+def rescore_file(path, settings):
+    """re-scoring of all sensors and threshold sets of a data file
+
+    returns list of dicts (see VARNAMES)
+    """
+
+    data, udp, daq_events, comments = read_raw_data_as_arrays(path)
+    if "time" not in data or settings.parameter not in data:
+        return []
+
+    if "device_tag" in data:
+        sensors = [(int(dev), data["device_tag"] == dev)
+                   for dev in np.unique(data["device_tag"])]
+    else:
+        ids = _sensor_ids_from_comments(comments)
+        sensors = [(ids[0] if len(ids) > 0 else 0, slice(None))]
+
+    rtn = []
+    for sensor, idx in sensors:
+        times = data["time"][idx]
+        values = data[settings.parameter][idx]
+        starts = detection_starts(daq_events, udp, sensor, settings)
+        online = _online_events(daq_events, sensor)
+        for thresholds in settings.thresholds:
+            for row in rescore_sensor(times, values, starts, thresholds,
+                            moving_average_size=settings.moving_average_size,
+                            online_events=online):
+                row["file"] = path
+                row["sensor"] = sensor
+                row["thresholds"] = ":".join(map(str, thresholds))
+                rtn.append(row)
+    return rtn
+
+
+def _rescore_file(args):
+    return rescore_file(*args)
+
+
+def rescore(files, settings, n_processes=None):
+    """re-scoring of multiple files, processed in parallel
+
+    files: list of files or folder
+
+    returns list of dicts (see VARNAMES)
+    """
+
+    if isinstance(files, str):
+        files = get_all_data_files(files)
+
+    args = [(f, settings) for f in files]
+    if n_processes == 1 or len(files) < 2:
+        results = list(map(_rescore_file, args))
+    else:
+        with Pool(processes=n_processes) as pool:
+            results = pool.map(_rescore_file, args, chunksize=4)
+    return [row for rows in results for row in rows]
+
+
+def save_rescored(rows, filename):
+    with open(filename, "w") as fl:
+        fl.write(",".join(VARNAMES) + "\n")
+        for row in rows:
+            fl.write(",".join(["NA" if row[v] is None else str(row[v])
+                               for v in VARNAMES]) + "\n")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("usage: rescore.py thresholds data_folder [output.csv]")
+        sys.exit()
+    thresholds = [float(x) for x in sys.argv[1].split(",")]
+    folder = sys.argv[2]
+    if len(sys.argv) > 3:
+        output = sys.argv[3]
+    else:
+        output = os.path.join(folder, "rescored.csv")
+    rows = rescore(folder, RescoreSettings(thresholds))
+    save_rescored(rows, output)
+    print("{} detections rescored, saved to {}".format(len(rows), output))
@@ -0,0 +1,139 @@
+"""
+Extraction of trigger events from recorded force data
+
+The trigger columns of a recording are converted into a compact event table
+(onset, offset and sample index per channel), which is saved as sidecar file
+next to the data file. Trial segmentation can then use the event table
+instead of rescanning all samples.
+
+As for the online detection (see force.stages.TriggerEdgeStage), the
+detection restarts with each acquisition period and sample indices refer to
+the hardware sample index (column sample_index or, if not recorded, the
+sample number in the acquisition period).
+
+This module can be also executed.
+"""
+
+import os
+import sys
+from collections import OrderedDict
+import numpy as np
+
+from .read_force_data import read_raw_data_as_arrays
+from .._lib.types import TriggerEvent
+from .._lib.trigger_edges import TriggerEdgeDetector, \
+    trigger_events_filename, write_trigger_events
+
+TRIGGER_VARIABLES = ("trigger1", "trigger2")
+
+
+def _period_starts(times, sample_index=None, pause_times=()):
+    """helper: row indices of the starts of the acquisition periods
+    (incl. end of data)"""
+    if sample_index is not None:
+        starts = np.flatnonzero(np.diff(sample_index) < 0) + 1
+    else:
+        starts = np.searchsorted(times, pause_times, side="right")
+    return np.unique(np.concatenate(([0], starts, [len(times)])))
+
+
+def extract_trigger_events(data, threshold=0.9, debounce=1, daq_events=None):
+    """extract trigger events from a data frame (dict of arrays)
+
+    daq_events: DAQ events of the recording (see read_raw_data_as_arrays)
+        to determine the acquisition periods, if the data do not contain the
+        sample index
+
+    Returns: list of TriggerEvents
+    """
+
+    channels = [c for c, v in enumerate(TRIGGER_VARIABLES) if v in data]
+    if len(channels) == 0:
+        return []
+
+    if "device_tag" in data:
+        devices = np.unique(data["device_tag"]).astype(int)
+    else:
+        devices = [0]
+
+    rtn = []
+    for dev in devices:
+        if "device_tag" in data:
+            idx = data["device_tag"] == dev
+        else:
+            idx = slice(None)
+        times = data["time"][idx]
+        trigger = np.zeros((len(times), len(TRIGGER_VARIABLES)))
+        for c in channels:
+            trigger[:, c] = data[TRIGGER_VARIABLES[c]][idx]
+        if "sample_index" in data:
+            sample_index = data["sample_index"][idx].astype(int)
+        else:
+            sample_index = None
+        pause_times = []
+        if daq_events is not None:
+            pause_times = [t for t, v in zip(daq_events["time"],
+                                             daq_events["value"])
+                           if v == "pause:{}".format(dev)]
+
+        detector = TriggerEdgeDetector(n_channels=len(TRIGGER_VARIABLES),
+                                       threshold=threshold,
+                                       debounce=debounce,
+                                       device_id=dev)
+        starts = _period_starts(times, sample_index, pause_times)
+        for a, b in zip(starts[:-1], starts[1:]):
+            if sample_index is None:
+                period_index = None  # counted from start of period
+            else:
+                period_index = sample_index[a:b]
+            events = detector.process(times[a:b], trigger[a:b],
+                                      period_index)
+            events.extend(detector.flush())
+            rtn.extend(filter(lambda x: x.channel in channels, events))
+
+    rtn.sort(key=lambda x: (x.onset_time, x.device_id, x.channel))
+    return rtn
+
+
+def trigger_events_from_file(path, threshold=0.9, debounce=1,
+                             write_sidecar=True):
+    """extract trigger events from a data file and (optionally) save them
+    as sidecar file
+
+    Returns: list of TriggerEvents
+    """
+
+    data, _udp, daq, _comments = read_raw_data_as_arrays(path)
+    events = extract_trigger_events(data, threshold=threshold,
+                                    debounce=debounce, daq_events=daq)
+    if write_sidecar:
+        app_dir = os.path.split(sys.argv[0])[0]
+        path = os.path.abspath(os.path.join(app_dir, path))
+        write_trigger_events(trigger_events_filename(path), events)
+    return events
+
+
+def read_trigger_events(path):
+    """read trigger event sidecar file
+
+    path: data file or sidecar file
+
+    Returns: data frame (OrderedDict of numpy arrays, NaN for missing
+             offsets)
+    """
+
+    if not path.endswith(".trigger.csv"):
+        path = trigger_events_filename(path)
+    values = np.genfromtxt(path, delimiter=",", skip_header=1,
+                           missing_values="NA", filling_values=np.nan,
+                           ndmin=2)
+    rtn = OrderedDict()
+    for c, v in enumerate(TriggerEvent.varnames):
+        rtn[v] = values[:, c]
+    return rtn
+
+
+if __name__ == "__main__":
+    for flname in sys.argv[1:]:
+        evts = trigger_events_from_file(flname)
+        print("{}: {} trigger events".format(flname, len(evts)))
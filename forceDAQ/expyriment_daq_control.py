@@ -139,6 +139,15 @@ def force_button_box_wait(exp, duration=None, minimum_level=-1):
     return sensor, level, rt, last_key
 
 
+def get_forces(n_sensors=2):
+    """returns Fx, Fy & Fz of all sensors (list of tuples) with one request
+    """
+    rtn = rc.get_values([(s, p) for s in range(n_sensors) for p in range(3)])
+    if rtn is None:
+        return None
+    return [values for _, _, _, values in rtn]
+
+
 def wait_no_button_pressed(exp, feedback_stimulus=None, polling_intervall=500):
     """level detection needs to be switch on
     display feedback_stimulus (optional) if one button pressed
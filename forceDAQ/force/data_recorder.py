@@ -12,12 +12,19 @@ import logging
 from time import localtime, strftime,asctime
 
 from .. import __version__ as forceDAQVersion
-from .._lib.types import ForceData, UDPData, DAQEvents, TAG_DAQEVENT, \
-                        TAG_UDPDATA, TAG_COMMENTS, PollingPriority
+from .._lib.types import ForceData, FilteredForceData, UDPData, \
+                        DAQEvents, TriggerEvent, \
+                        TAG_DAQEVENT, TAG_UDPDATA, TAG_COMMENTS, PollingPriority, \
+                        TAG_TIME_UNIT, TIME_UNITS
 from .._lib.types import GUIRemoteControlCommands as RemoteCmd
-from .._lib.udp_connection import UDPConnectionProcess
+from .._lib.udp_connection import UDPConnectionProcess, SendQueue
 from .._lib.process_priority_manager import ProcessPriorityManager
 from .._lib.timer import app_timer
+from .._lib.trigger_edges import trigger_events_filename
+from .._lib.filters import filtered_data_filename
+from .._lib.clock_sync import ClockMapping
+from .._lib.sample_clock import SampleClockMapping
+from .._lib import wire_protocol
 from .sensor import SensorSettings
 from .sensor_process import SensorProcess
 
@@ -29,6 +36,7 @@ class DataRecorder(object):
     def __init__(self, force_sensor_settings,
                  poll_udp_connection=False,
                  write_deviceid = False,
+                 write_sample_index = False,
                  write_Fx = True,
                  write_Fy = True,
                  write_Fz = True,
@@ -37,7 +45,15 @@ class DataRecorder(object):
                  write_Tz = False,
                  write_trigger1 = True,
                  write_trigger2 = False,
-                 polling_priority=None):
+                 polling_priority=None,
+                 write_trigger_events=False,
+                 trigger_debounce=1,
+                 udp_peer_permissions=None,
+                 udp_multicast_group=None,
+                 udp_multicast_stream=None,
+                 filter_settings=None,
+                 write_raw_data=True,
+                 time_unit="ms"):
 
 
         """queue_data will be saved
@@ -45,36 +61,94 @@ class DataRecorder(object):
 
         polling_priority has to be types.PollingPriority.{HIGH},
         {REALTIME} or {NORMAL} or None
+
+        write_sample_index: if True, the hardware sample index of each
+            sample is saved (see sample_clock)
+
+        write_trigger_events: if True, trigger pulses are detected online and
+            saved as event table in a sidecar file next to the data file
+            (see trigger_edges.trigger_events_filename)
+        trigger_debounce: debounce of the trigger pulse detection in samples
+
+        udp_peer_permissions: dict {ip: permissions} of the remote peers
+            (see udp_connection.Peer)
+        udp_multicast_group, udp_multicast_stream: see UDPConnectionProcess
+
+        filter_settings: if not None (filters.FilterSettings), the force data
+            are filtered (and decimated) online in the sensor processes. The
+            filtered data are saved in a separate file next to the data file
+            (see filters.filtered_data_filename).
+        write_raw_data: if False, the raw force data are not saved in the
+            data file (e.g. to reduce the disk usage, if only the decimated
+            data are required). Events are always saved.
+
+        time_unit: unit of the timestamps of samples, UDP data and DAQ events
+            in the data file ("ns", "us" or "ms", default: "ms" as in files of
+            older versions). Timestamps are integer nanoseconds and written
+            as decimals, if required (e.g. "ms"). "ns" saves the integer
+            timestamps. The unit is noted in the header of the file.
         """
 
+        if time_unit not in TIME_UNITS:
+            raise RuntimeError("Unknown time unit: {}".format(time_unit))
+
         self._write_deviceid = write_deviceid
+        self._write_sample_index = write_sample_index
         self._write_forces = [write_Fx, write_Fy, write_Fz, write_Tx, write_Ty, write_Tz]
         self._write_trigger = [write_trigger1, write_trigger2]
+        self._write_trigger_events = write_trigger_events
+        self._filter_settings = filter_settings
+        self._write_raw_data = write_raw_data
+        self._time_unit = time_unit
+        self._ns_per_time_unit = TIME_UNITS[time_unit]
+        self._time_decimals = len(str(self._ns_per_time_unit)) - 1
+        if write_trigger_events:
+            trigger_edge_debounce = trigger_debounce
+        else:
+            trigger_edge_debounce = None
 
         #create sensor processes
         if not isinstance(force_sensor_settings, list):
             force_sensor_settings = [force_sensor_settings]
         self._force_sensor_processes =[]
 
-        event_trigger = []
         for fs in force_sensor_settings:
             if not isinstance(fs, SensorSettings):
                 RuntimeError("Recorder needs a list of Force Sensor Settings!")
             else:
                 fst = SensorProcess(settings = fs,
-                                    pipe_buffered_data_after_pause=True)
-                fst.start()
-                event_trigger.append(fst.event_trigger)
+                                    pipe_buffered_data_after_pause=True,
+                                    trigger_edge_debounce=trigger_edge_debounce,
+                                    filter_settings=filter_settings)
                 self._force_sensor_processes.append(fst)
 
         # create udp connection process
         if poll_udp_connection:
-            self.udp = UDPConnectionProcess(event_trigger=event_trigger,
-                                            event_ignore_tag = RemoteCmd.COMMAND_STR)
+            self.udp = UDPConnectionProcess(marker_buffers=[fsp.marker_buffer
+                                                for fsp in self._force_sensor_processes],
+                                            event_ignore_tag = RemoteCmd.COMMAND_STR,
+                                            stream_buffers=[fsp.stream_buffer
+                                                for fsp in self._force_sensor_processes],
+                                            peer_permissions=udp_peer_permissions,
+                                            multicast_group=udp_multicast_group,
+                                            multicast_stream=udp_multicast_stream)
             self.udp.start()
         else:
             self.udp = None
 
+        # send queue of the detected events: the queue of the udp process or,
+        # without udp process, a queue that has to be read by the remote
+        # control (see remote_control_async.RemoteControlServerProtocol)
+        if self.udp is not None:
+            self.send_queue = self.udp.send_queue
+        else:
+            self.send_queue = SendQueue()
+
+        # start sensor processes
+        for fsp in self._force_sensor_processes:
+            fsp.udp_send_queue = self.send_queue
+            fsp.start()
+
         # process managing
         self._proc_manager = ProcessPriorityManager()
         self._proc_manager.add_subprocess(self.udp)
@@ -90,6 +164,8 @@ class DataRecorder(object):
 
         self._is_recording = False
         self._file = None
+        self._trigger_events_file = None
+        self._filtered_file = None
         self._daq_event = []
         self.filename = None
         atexit.register(self.quit)
@@ -148,11 +224,11 @@ class DataRecorder(object):
         buffer = []
         while True:
             try:
-                data = self.udp.receive_queue.get_nowait()
+                batch = self.udp.receive_queue.get_nowait()
             except:
                 # until queue empty or no udp connection
                 break
-            buffer.append(data)
+            buffer.extend(batch)
         if len(buffer)>0:
             self._save_data(buffer)
         return buffer
@@ -172,33 +248,70 @@ class DataRecorder(object):
         buffer_len = len(data_buffer)
         for c, d in enumerate(data_buffer):
             if self._file is not None:
-                if isinstance(d, ForceData):
-                    line = "{}, {},".format(d.time, d.acquisition_delay)
-                    if self._write_deviceid:
-                        line += "{0},".format(d.device_id)
-                    for x in range(6):
-                        if self._write_forces[x]:
-                            line += float_format.format(d.forces[x])
-                    for x in range(2):
-                        if self._write_trigger[x]:
-                            if isinstance(d.trigger[x], int):
-                                line += "{0},".format(d.trigger[x])
-                            else:
-                                line += float_format.format(d.trigger[x])
-                    self._file_write(line[:-1] + NEWLINE)
+                if isinstance(d, FilteredForceData):
+                    if self._filtered_file is not None:
+                        self._filtered_file.write(self._force_data_line(d,
+                                                float_format).encode())
+
+                elif isinstance(d, ForceData):
+                    if self._write_raw_data:
+                        self._file_write(self._force_data_line(d,
+                                                               float_format))
 
                 elif isinstance(d, DAQEvents):
-                    self._file_write("{0},{1},{2}".format(TAG_DAQEVENT, d.time, str(d.code)) + NEWLINE)
+                    self._file_write("{0},{1},{2}".format(TAG_DAQEVENT,
+                                self._time_str(d.time_ns), str(d.code)) + NEWLINE)
 
                 elif isinstance(d, UDPData):
                     if not d.is_remote_control_command:
-                        self._file_write("{0},{1},{2}".format(TAG_UDPDATA, d.time, d.unicode) + NEWLINE)
+                        self._file_write("{0},{1},{2}".format(TAG_UDPDATA,
+                                self._time_str(d.time_ns), d.unicode) + NEWLINE)
+                    elif d.startswith(RemoteCmd.CLOCK_MAPPING):
+                        try:
+                            mapping = ClockMapping(*wire_protocol.decode(
+                                d.byte_string[len(RemoteCmd.CLOCK_MAPPING):]))
+                        except Exception:
+                            logging.warning("Invalid clock mapping received")
+                        else:
+                            self._file_write(mapping.log_line(
+                                        d.time_ns // 1000000) + NEWLINE)
+
+                elif isinstance(d, SampleClockMapping):
+                    self._file_write(d.log_line() + NEWLINE)
+
+                elif isinstance(d, TriggerEvent):
+                    if self._trigger_events_file is not None:
+                        self._trigger_events_file.write(str(d) + NEWLINE)
 
             if recording_screen is not None and c % BLOCKSIZE == 0:
                 recording_screen.stimulus(
                     "Writing {0} of {1} blocks".format(c//BLOCKSIZE,
                                                        buffer_len//BLOCKSIZE)).present()
 
+    def _time_str(self, time_ns):
+        """timestamp in the time unit of the data file"""
+        if time_ns % self._ns_per_time_unit == 0:
+            return str(time_ns // self._ns_per_time_unit)
+        return "{0:.{1}f}".format(time_ns / float(self._ns_per_time_unit),
+                                  self._time_decimals).rstrip("0")
+
+    def _force_data_line(self, d, float_format):
+        line = "{}, {},".format(self._time_str(d.time_ns), d.acquisition_delay)
+        if self._write_deviceid:
+            line += "{0},".format(d.device_id)
+        if self._write_sample_index:
+            line += "{0},".format(d.sample_index)
+        for x in range(6):
+            if self._write_forces[x]:
+                line += float_format.format(d.forces[x])
+        for x in range(2):
+            if self._write_trigger[x]:
+                if isinstance(d.trigger[x], int):
+                    line += "{0},".format(d.trigger[x])
+                else:
+                    line += float_format.format(d.trigger[x])
+        return line[:-1] + NEWLINE
+
     def _file_write(self, str):
         self._file.write(str.encode())
 
@@ -209,8 +322,18 @@ class DataRecorder(object):
 
         """
         if time is None:
-            time = app_timer.time
-        self._daq_event.append(DAQEvents(time = time, code = code))
+            self._daq_event.append(DAQEvents(time_ns=app_timer.time_ns,
+                                             code=code))
+        else:
+            self._daq_event.append(DAQEvents(time=time, code=code))
+
+    def save_udp_event(self, udp_data):
+        """Save UDPData that has not been received via the udp process of
+        the recorder (e.g. asyncio server, see remote_control_async)
+
+        The data will be written to the output with the DAQ events.
+        """
+        self._daq_event.append(udp_data)
 
 
     def start_recording(self, determine_bias=False):
@@ -262,10 +385,11 @@ class DataRecorder(object):
         # udp event
         data.extend(self.process_and_write_udp_events())
 
-        # soft trigger
-        self._save_data(self._daq_event)
-        data.extend(self._daq_event)
-        self._daq_event = []
+        # soft trigger (events might be added by other threads, see
+        # remote_control_async)
+        events, self._daq_event = self._daq_event, []
+        self._save_data(events)
+        data.extend(events)
         return data
 
     def determine_biases(self, n_samples):
@@ -365,28 +489,51 @@ class DataRecorder(object):
             self._file = open(full_path_file, 'w+')
         print("Data file: {}".format(full_path_file))
 
-        self._file_write(TAG_COMMENTS + "Recorded at {0} with pyForceDAQ {1}\n".format(
-            asctime(localtime()), forceDAQVersion))
+        self._file_write(self._header(comment_line, varnames))
         logging.info("new file: {}".format(filename))
 
+        if self._filter_settings is not None:
+            flname = filtered_data_filename(full_path_file)
+            if zipped:
+                self._filtered_file = gzip.open(flname, 'wb')
+            else:
+                self._filtered_file = open(flname, 'wb')
+            self._filtered_file.write(self._header(comment_line, varnames,
+                                    self._filter_settings).encode())
+
+        if self._write_trigger_events:
+            self._trigger_events_file = open(
+                        trigger_events_filename(full_path_file), 'w')
+            self._trigger_events_file.write(
+                        ",".join(TriggerEvent.varnames) + NEWLINE)
+
+        return full_path_file
+
+    def _header(self, comment_line="", varnames=True, filter_settings=None):
+        rtn = TAG_COMMENTS + "Recorded at {0} with pyForceDAQ {1}\n".format(
+            asctime(localtime()), forceDAQVersion)
+
         for s in self.sensor_settings_list:
             txt = " Sensor: id={0}, name={1}, cal-file={2}\n".format(s.device_id,
                                 s.sensor_name, s.calibration_file)
-            self._file_write(TAG_COMMENTS + txt)
+            rtn += TAG_COMMENTS + txt
+        rtn += TAG_TIME_UNIT + " {0}\n".format(self._time_unit)
+        if filter_settings is not None:
+            rtn += TAG_COMMENTS + " Filter: {0}\n".format(filter_settings)
 
         if len(comment_line)>0:
-            self._file_write(TAG_COMMENTS + comment_line + "\n")
+            rtn += TAG_COMMENTS + comment_line + "\n"
         if varnames:
             line = "time,delay,"
             if self._write_deviceid: line += "device_tag,"
+            if self._write_sample_index: line += "sample_index,"
             for x in range(6):
                 if self._write_forces[x]:
                     line += ForceData.forces_names[x] + ","
             if self._write_trigger[0]: line += "trigger1,"
             if self._write_trigger[1]: line += "trigger2,"
-            self._file_write(line[:-1] + NEWLINE)
-
-        return full_path_file
+            rtn += line[:-1] + NEWLINE
+        return rtn
 
     def close_data_file(self):
         """Close the data file
@@ -398,3 +545,9 @@ class DataRecorder(object):
         if self._file is not None:
             self._file.close()
             self._file = None
+        if self._trigger_events_file is not None:
+            self._trigger_events_file.close()
+            self._trigger_events_file = None
+        if self._filtered_file is not None:
+            self._filtered_file.close()
+            self._filtered_file = None
@@ -13,6 +13,7 @@ from ..daq import ATI_CDLL, DAQConfiguration,  DAQReadAnalog
 from .._lib.misc import find_calibration_file
 from .._lib.types import ForceData
 from .._lib.timer import Timer, app_timer
+from .._lib.sample_clock import SampleClock
 
 class SensorSettings(DAQConfiguration):
     def __init__(self,
@@ -93,7 +94,22 @@ class Sensor(DAQReadAnalog):
             self._atidaq.setTorqueUnits("N-m")
 
         self._reverse_parameters = copy(settings.reverse_parameters)
-
+        # sample timestamps from hardware sample clock
+        self.sample_clock = SampleClock(rate=settings.rate.value,
+                                        device_id=self.device_id)
+        self._sample_index = 0
+        # number of acquired, but not yet read samples (at last poll_data)
+        self.samples_pending = 0
+        self._samples_acquired = 0
+
+    def start_data_acquisition(self):
+        """Start data acquisition, the sample index restarts at zero"""
+        if not self.is_acquiring_data:
+            self._sample_index = 0
+            self.samples_pending = 0
+            self._samples_acquired = 0
+            self.sample_clock.reset()
+        super(Sensor, self).start_data_acquisition()
 
     def determine_bias(self, n_samples=100):
         """determines the bias
@@ -104,7 +120,8 @@ class Sensor(DAQReadAnalog):
         self.start_data_acquisition()
         data = None
         for x in range(n_samples):
-            read_buffer, _read_samples = self.read_analog()
+            read_buffer, read_samples = self.read_analog()
+            self._sample_index += read_samples
             sample = read_buffer[Sensor.SENSOR_CHANNELS]
             if data is None:
                 data = sample
@@ -125,6 +142,12 @@ class Sensor(DAQReadAnalog):
         Reading data from NI device and converting voltages to force data using
         the ATIDAO libraray.
 
+        The timestamp is derived from the hardware sample index (see
+        sample_clock). The number of acquired samples is queried (driver
+        call) only if all previously acquired samples have been read, that
+        is, once per block of samples (see samples_pending). The sample
+        clock is then correlated with the host clock.
+
         Returns
         -------
         data: ForceData
@@ -132,8 +155,18 @@ class Sensor(DAQReadAnalog):
 
         """
 
-        start = self.timer.time
-        read_buffer, _read_samples = self.read_analog()
+        start = self.timer.time_ns
+        read_buffer, read_samples = self.read_analog()
+        t = self.timer.time_ns
+        index = self._sample_index
+        self._sample_index += read_samples
+        if self.samples_pending == 0:
+            # new block: latest acquired sample was available at host time
+            self._samples_acquired = self.samples_acquired
+            self.sample_clock.update(self._samples_acquired - 1, t / 1000.0,
+                                     next_index=index)
+        self.samples_pending = max(0, self._samples_acquired -
+                                   self._sample_index)
         if self.convert_to_FT:
             forces = self._atidaq.convertToFT( voltages=read_buffer[Sensor.SENSOR_CHANNELS],
                                                 reverse_parameters=self._reverse_parameters)
@@ -143,11 +176,12 @@ class Sensor(DAQReadAnalog):
             for x in self._reverse_parameters:
                 forces[x] = -1 * forces[x]
 
-        t = self.timer.time
-        return ForceData(time = t, acquisition_delay = t-start,
+        return ForceData(time_ns = self.sample_clock.time_ns(index),
+                         acquisition_delay = (t - start) // 1000000,
                          device_id = self.device_id,
                          forces = forces,
-                         trigger = read_buffer[Sensor.TRIGGER_CHANNELS].tolist())
+                         trigger = read_buffer[Sensor.TRIGGER_CHANNELS].tolist(),
+                         sample_index = index)
 
 
 if __name__ == "__main__":
@@ -6,23 +6,55 @@ from multiprocessing import Process, Event, sharedctypes, Pipe
 import logging
 
 from .._lib.types import DAQEvents
+from .._lib.detection import LEVEL_CHANGE, RESPONSE_MINMAX
+from .._lib import wire_protocol
+from .._lib.shared_ring import SharedRingBuffer
+from .._lib.shared_sample import SharedSample
+from .._lib.sample_markers import marker_buffer
+from .._lib.processing import ProcessingPipeline, SampleBlock, StageContext
+from .._lib.streaming import STREAM_BUFFER_SIZE, STREAM_VALUES
 from .._lib.timer import app_timer
 from .._lib.polling_time_profile import PollingTimeProfile
 from .._lib.process_priority_manager import get_priority
 
 from .sensor import SensorSettings, Sensor
+from .stages import SampleMarkerStage, LatestSampleStage, RecordStage, \
+    TriggerEdgeStage, FilterStage, DetectionStage
 
 class SensorProcess(Process):
+    MAX_BLOCK_SIZE = 100  # max. number of acquired samples per block
+    # remote control feedback of detected events (channel 0, channel 1)
+    DETECTION_FEEDBACK = DetectionStage.FEEDBACK
+
     def __init__(self, settings, pipe_buffered_data_after_pause=True,
-                  chunk_size=10000):
+                  chunk_size=10000, trigger_edge_debounce=None,
+                  udp_send_queue=None, filter_settings=None, stages=()):
         """ForceSensorProcess
 
         return_buffered_data_after_pause: does not write shared data queue continuously and
             writes it the buffer data to queue only after pause (or stop)
 
-        """
+        trigger_edge_debounce: if not None, trigger pulses are detected online
+            (see TriggerEdgeDetector) and TriggerEvents are added to the
+            buffer. The value defines the debounce in samples.
+
+        udp_send_queue: send queue of the UDPConnectionProcess. Required for
+            the online level change and response min/max detection (see
+            set_thresholds), the detected events are sent directly to the
+            remote control peers. The attribute can also be set before the
+            process is started.
 
-        # DOC explain usage
+        filter_settings: if not None (filters.FilterSettings), the force data
+            are filtered (and decimated) online. The filtered samples are
+            added as FilteredForceData to the buffer, in addition to the raw
+            samples. The online detection uses the filtered data.
+
+        stages: list of additional processing stages (see
+            _lib.processing.ProcessingStage). The stages are inserted after
+            the filtering and before the online detection. The samples are
+            already recorded and published (shared memory) at that point.
+
+        """
 
         # type checks
         if not isinstance(settings, SensorSettings):
@@ -33,74 +65,151 @@ class SensorProcess(Process):
         self.sensor_settings = settings
         self._pipe_buffer_after_pause = pipe_buffered_data_after_pause
         self._chunk_size = chunk_size
+        self._trigger_edge_debounce = trigger_edge_debounce
+        self.udp_send_queue = udp_send_queue
+        self.filter_settings = filter_settings
 
         self._pipe_i, self._pipe_o = Pipe()
+        self._detection_i, self._detection_o = Pipe()
+        self._is_detecting = sharedctypes.RawValue(ct.c_bool, False)
         self._event_is_polling = Event()
         self._event_sending_data = Event()
         self._event_new_data = Event()
         self.event_bias_is_available = Event()
-        self.event_trigger = Event()
-
-        self._last_Fx = sharedctypes.RawValue(ct.c_float)
-        self._last_Fy = sharedctypes.RawValue(ct.c_float)
-        self._last_Fz = sharedctypes.RawValue(ct.c_float)
-        self._last_Tx = sharedctypes.RawValue(ct.c_float)
-        self._last_Ty = sharedctypes.RawValue(ct.c_float)
-        self._last_Tz = sharedctypes.RawValue(ct.c_float)
-        self._last_time = sharedctypes.RawValue(ct.c_float)
+
+        self._last_sample = SharedSample()  # consistent snapshots
         self._buffer_size = sharedctypes.RawValue(ct.c_uint64)
-        self._sample_cnt = sharedctypes.Value(ct.c_uint64)
         self._event_quit_request = Event()
         self._determine_bias_flag = Event()
 
+        # latest samples (time, forces, trigger) for live streaming
+        self.stream_buffer = SharedRingBuffer(STREAM_BUFFER_SIZE,
+                                              STREAM_VALUES)
+        # arrival times of UDP markers (written by the UDP process)
+        self.marker_buffer = marker_buffer()
+
+        # processing pipeline
+        self._detection_stage = DetectionStage(self._is_detecting)
+        pipeline = [SampleMarkerStage(self.marker_buffer),
+                    LatestSampleStage(self._last_sample, self.stream_buffer),
+                    RecordStage()]
+        if trigger_edge_debounce is not None:
+            pipeline.append(TriggerEdgeStage(
+                                debounce=trigger_edge_debounce,
+                                n_channels=len(Sensor.TRIGGER_CHANNELS),
+                                block_size=SensorProcess.MAX_BLOCK_SIZE))
+        if filter_settings is not None:
+            pipeline.append(FilterStage(filter_settings,
+                                        rate=settings.rate.value))
+        pipeline.extend(stages)
+        pipeline.append(self._detection_stage)
+        self.pipeline = ProcessingPipeline(pipeline)
+
         self._bias_n_samples = 200
         atexit.register(self.join)
 
+    def _last_forces(self):
+        smpl = self._last_sample.read()
+        if smpl is None:
+            return (0.0,) * 6
+        return smpl[2]
+
     @property
     def Fx(self):
-        return self._last_Fx.value
+        return self._last_forces()[0]
 
     @property
     def Fy(self):
-        return self._last_Fy.value
+        return self._last_forces()[1]
 
     @property
     def Fz(self):
-        return self._last_Fz.value
+        return self._last_forces()[2]
 
     @property
     def Tx(self):
-        return self._last_Tx.value
+        return self._last_forces()[3]
 
     @property
     def Ty(self):
-        return self._last_Ty.value
+        return self._last_forces()[4]
 
     @property
     def Tz(self):
-        return self._last_Tz.value
+        return self._last_forces()[5]
 
     def get_force(self, parameter_id):
-        if   parameter_id == 0: return self._last_Fx.value
-        elif parameter_id == 1: return self._last_Fy.value
-        elif parameter_id == 2: return self._last_Fz.value
-        elif parameter_id == 3: return self._last_Tx.value
-        elif parameter_id == 4: return self._last_Ty.value
-        elif parameter_id == 5: return self._last_Tz.value
-        else: return None
+        if 0 <= parameter_id < 6:
+            return self._last_forces()[parameter_id]
+        else:
+            return None
 
     def get_Fxyz(self):
-        return (self._last_Fx.value, self._last_Fy.value, self._last_Fz.value)
+        return self._last_forces()[0:3]
 
     def Txyz(self):
-        return (self._last_Tx.value, self._last_Ty.value, self._last_Tz.value)
+        return self._last_forces()[3:6]
+
+    def get_snapshot(self):
+        """returns sample counter, time, forces and trigger of the last sample
+
+        All values are taken from the same sample. Sample counter is None if
+        no sample has been polled yet.
+        """
+        smpl = self._last_sample.read()
+        if smpl is None:
+            return None, None, None, None
+        return smpl[0], smpl[1], list(smpl[2]), list(smpl[3])
 
     @property
     def sample_cnt(self):
-        return self._sample_cnt.value
+        return self._last_sample.counter
 
     def get_sample_cnt(self):
-        return int(self._sample_cnt.value)
+        return int(self._last_sample.counter)
+
+    def set_thresholds(self, thresholds, parameter=2, moving_average_size=5):
+        """set the thresholds of the online detection (see detection)
+
+        thresholds: list of floats or None to switch off the detection
+        parameter: index of the detection parameter (0-5, Fx to Tz)
+        moving_average_size: levels are determined from the moving average
+            of this number of samples
+        """
+        if thresholds is not None:
+            thresholds = list(thresholds)
+        self._detection_i.send(("thresholds", thresholds, parameter,
+                                moving_average_size))
+
+    def start_level_change_detection(self, channel=0,
+                                     wire_version=wire_protocol.PICKLE):
+        """the detected level change is sent as CHANGED_LEVEL (channel 0)
+        or CHANGED_LEVEL2 (channel 1) to the remote control peers"""
+        self._detection_i.send((LEVEL_CHANGE, channel, wire_version))
+
+    def start_response_minmax_detection(self, duration, channel=0,
+                                        wire_version=wire_protocol.PICKLE):
+        """duration of the response period in ms
+
+        The detected min/max levels are sent as RESPONSE_MINMAX (channel 0)
+        or RESPONSE_MINMAX2 (channel 1) to the remote control peers"""
+        rate = self.sensor_settings.rate.value
+        if self.filter_settings is not None:
+            rate = rate / self.filter_settings.decimation
+        n_samples = int(round(duration * rate / 1000.0))
+        self._detection_i.send((RESPONSE_MINMAX, channel, wire_version,
+                                n_samples))
+
+    @property
+    def is_detecting(self):
+        """true if a level change or response min/max detection is
+        running"""
+        return self._is_detecting.value
+
+    def get_stage_timing(self):
+        """timing of the processing stages (see
+        ProcessingPipeline.timing)"""
+        return self.pipeline.timing()
 
     def get_buffer_size(self):
         return int(self._buffer_size.value)
@@ -153,42 +262,52 @@ class SensorProcess(Process):
         self._event_is_polling.clear()
         self._event_sending_data.clear()
         is_polling = False
-        ptp = PollingTimeProfile() #TODO just for testing?
+        ptp = PollingTimeProfile()  # logged at quit
+        pipeline = self.pipeline
+        pipeline.setup(StageContext(device_id=sensor.device_id,
+                                    rate=self.sensor_settings.rate.value,
+                                    timer=sensor.timer, buffer=buffer,
+                                    udp_send_queue=self.udp_send_queue))
 
         while not self._event_quit_request.is_set():
+            while self._detection_o.poll():
+                # detection commands
+                self._detection_stage.command(self._detection_o.recv())
+
             if self._event_is_polling.is_set():
                 # is polling
                 if not is_polling:
                     # start NI device and acquire one first dummy sample to
                     # ensure good timing
                     sensor.start_data_acquisition()
-                    buffer.append(DAQEvents(time=sensor.timer.time,
+                    buffer.append(DAQEvents(time_ns=sensor.timer.time_ns,
                                             code="started:"+repr(sensor.device_id)))
                     logging.info("Sensor start, pid {}, priority {}".format(
                         self.pid, get_priority(self.pid)))
 
                     self._buffer_size.value = len(buffer)
+                    pipeline.start()
                     is_polling = True
 
-                d = sensor.poll_data()
-                ptp.update(d.time)
-
-                self._last_Fx.value, self._last_Fy.value, self._last_Fz.value, \
-				                     self._last_Tx.value, self._last_Ty.value, \
-                                     self._last_Tz.value = d.forces
-                self._sample_cnt.value += 1
-                if self.event_trigger.is_set():
-                    self.event_trigger.clear()
-                    d.trigger[0] = 1
-
-                buffer.append(d)
+                samples = []
+                while True:
+                    samples.append(sensor.poll_data())
+                    mapping = sensor.sample_clock.pop_mapping()
+                    if mapping is not None:
+                        buffer.append(mapping)
+                    if sensor.samples_pending == 0 or \
+                            len(samples) >= SensorProcess.MAX_BLOCK_SIZE:
+                        break
+                ptp.tick()
+                pipeline.process(SampleBlock(samples))
                 self._buffer_size.value = len(buffer)
 
             else:
                 # pause: not polling
                 if is_polling:
                     sensor.stop_data_acquisition()
-                    buffer.append(DAQEvents(time=sensor.timer.time,
+                    pipeline.stop()
+                    buffer.append(DAQEvents(time_ns=sensor.timer.time_ns,
                                             code="pause:"+repr(sensor.device_id)))
                     self._buffer_size.value = len(buffer)
                     logging.info("Sensor stop, pid {}, priority {}".format(
@@ -222,5 +341,7 @@ class SensorProcess(Process):
         sensor.stop_data_acquisition()
         self._buffer_size.value = 0
 
+        logging.info("Sensor process {}, {}".format(sensor.device_id,
+                                                    pipeline.get_timing_str()))
         logging.info("Sensor quit, {}, {}".format(
-            sensor.name, ptp.get_profile_str()))
\ No newline at end of file
+            sensor.name, ptp.get_profile_str()))
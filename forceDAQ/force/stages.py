@@ -0,0 +1,230 @@
+"""Built-in processing stages of the sensor process
+
+See _lib.processing for the stage API.
+"""
+
+from collections import deque
+
+from .._lib.types import DAQEvents, FilteredForceData, \
+    GUIRemoteControlCommands as RcCmd
+from .._lib.processing import ProcessingStage, SampleBlock
+from .._lib.detection import DetectionEngine, LEVEL_CHANGE, RESPONSE_MINMAX
+from .._lib.filters import FilterPipeline
+from .._lib.trigger_edges import TriggerEdgeDetector
+from .._lib.sample_markers import SampleMarker
+from .._lib import wire_protocol
+
+
+class SampleMarkerStage(ProcessingStage):
+    """trigger1 of marked samples: number of UDP markers (see
+    sample_markers)"""
+
+    def __init__(self, marker_buffer):
+        self.sample_marker = SampleMarker(marker_buffer)
+        self._recent = deque(maxlen=self.sample_marker.lookback)
+
+    def start(self):
+        self.sample_marker.reset()
+        self._recent.clear()
+
+    def transform(self, block):
+        self._recent.extend(block.samples)
+        for idx, n_markers in self.sample_marker.process(block.times):
+            self._recent[idx].n_markers = n_markers
+            self._recent[idx].trigger[0] = n_markers
+        return block
+
+
+class LatestSampleStage(ProcessingStage):
+    """publishes the latest sample (SharedSample) and the live stream
+    (SharedRingBuffer)"""
+
+    def __init__(self, last_sample, stream_buffer):
+        self.last_sample = last_sample
+        self.stream_buffer = stream_buffer
+        self._counter = 0
+
+    def setup(self, context):
+        super(LatestSampleStage, self).setup(context)
+        self._counter = self.last_sample.counter
+
+    def transform(self, block):
+        for d in block.samples:
+            self.stream_buffer.write([d.time] + list(d.forces) +
+                                     list(d.trigger))
+        d = block.samples[-1]
+        self._counter += len(block)
+        self.last_sample.write(self._counter, d.time, d.forces, d.trigger)
+        return block
+
+
+class RecordStage(ProcessingStage):
+    """adds the samples to the recording buffer"""
+
+    def transform(self, block):
+        self.context.record_all(block.samples)
+        return block
+
+
+class TriggerEdgeStage(ProcessingStage):
+    """online detection of trigger pulses (see TriggerEdgeDetector)
+
+    The trigger values are processed in blocks of `block_size` samples.
+    Onset and offset samples refer to the hardware sample index, which
+    restarts with each acquisition period. Pulses that are still on at
+    pause are recorded without offset.
+    """
+
+    def __init__(self, debounce, n_channels=2, block_size=100):
+        self.debounce = debounce
+        self.n_channels = n_channels
+        self.block_size = block_size
+        self._detector = None
+        self._times = []
+        self._values = []
+        self._index = []
+
+    def setup(self, context):
+        super(TriggerEdgeStage, self).setup(context)
+        self._detector = TriggerEdgeDetector(n_channels=self.n_channels,
+                                             debounce=self.debounce,
+                                             device_id=context.device_id)
+
+    def _process(self):
+        self.context.record_all(self._detector.process(
+                            self._times, self._values, self._index))
+        self._times = []
+        self._values = []
+        self._index = []
+
+    def start(self):
+        self._detector.reset()
+        self._times = []
+        self._values = []
+        self._index = []
+
+    def transform(self, block):
+        for d in block.samples:
+            self._times.append(d.time)
+            self._values.append(d.trigger)
+            self._index.append(d.sample_index)
+        if len(self._times) >= self.block_size:
+            self._process()
+        return block
+
+    def stop(self):
+        if len(self._times) > 0:
+            self._process()
+        self.context.record_all(self._detector.flush())
+
+
+class FilterStage(ProcessingStage):
+    """online filtering and decimation (see filters.FilterPipeline)
+
+    The filtered samples (FilteredForceData) are recorded and passed to the
+    next stage. The trigger values (markers) of dropped samples are carried
+    into the next kept sample (see FilteredForceData.raw_samples).
+    """
+
+    def __init__(self, filter_settings, rate):
+        self.filters = FilterPipeline(filter_settings, rate=rate)
+        self._dropped = []  # dropped samples since last kept one
+        self._last = None
+
+    def start(self):
+        self.filters.reset()
+        self._dropped = []
+        self._last = None
+
+    def transform(self, block):
+        idx, forces = self.filters.filter_and_decimate(block.forces)
+        rtn = []
+        prev = 0
+        for i, f in zip(idx, forces):
+            d = block.samples[i]
+            fd = FilteredForceData(time_ns=d.time_ns,
+                                   acquisition_delay=d.acquisition_delay,
+                                   device_id=d.device_id,
+                                   forces=f.tolist(),
+                                   sample_index=d.sample_index)
+            # trigger of the raw samples, incl. later markers
+            self._dropped.extend(block.samples[prev:i])
+            fd.raw_samples = self._dropped + [d]
+            self._dropped = []
+            prev = i + 1
+            rtn.append(fd)
+        self._dropped.extend(block.samples[prev:])
+        if len(rtn) > 0:
+            self._last = rtn[-1]
+        self.context.record_all(rtn)
+        return SampleBlock(rtn)
+
+    def stop(self):
+        # no next sample: dropped samples at the end to the last one
+        if self._last is not None:
+            self._last.raw_samples.extend(self._dropped)
+        self._dropped = []
+
+
+class DetectionStage(ProcessingStage):
+    """online level change and response min/max detection
+
+    Detected events are sent to the remote control peers and recorded as
+    DAQEvents.
+    """
+
+    # remote control feedback of detected events (channel 0, channel 1)
+    FEEDBACK = {LEVEL_CHANGE: (RcCmd.CHANGED_LEVEL, RcCmd.CHANGED_LEVEL2),
+                RESPONSE_MINMAX: (RcCmd.RESPONSE_MINMAX,
+                                  RcCmd.RESPONSE_MINMAX2)}
+
+    def __init__(self, is_detecting):
+        """is_detecting: shared boolean (RawValue), the detection state"""
+        self._is_detecting = is_detecting
+        self.engine = None
+        self._feedback = None  # channel, wire version
+
+    def command(self, cmd):
+        """process a detection command (see SensorProcess.set_thresholds)"""
+        if cmd[0] == "thresholds":
+            if cmd[1] is None:
+                self.engine = None
+            else:
+                self.engine = DetectionEngine(thresholds=cmd[1],
+                                              parameter=cmd[2],
+                                              moving_average_size=cmd[3])
+        elif self.engine is not None:
+            self._feedback = cmd[1:3]
+            if cmd[0] == LEVEL_CHANGE:
+                self.engine.start_level_change_detection()
+                code = "{}_detection:{}".format(cmd[0],
+                                                self.context.device_id)
+            else:
+                self.engine.start_response_minmax_detection(cmd[3])
+                code = "{}_detection:{}:{}".format(cmd[0],
+                                            self.context.device_id, cmd[3])
+            self.context.record(DAQEvents(time_ns=self.context.timer.time_ns,
+                                          code=code))
+        self._is_detecting.value = self.engine is not None and \
+                                   self.engine.is_detecting
+
+    def transform(self, block):
+        if self.engine is None:
+            return block
+        if not self.engine.is_detecting:
+            # idle: moving average window only, no block arrays
+            p = self.engine.parameter
+            self.engine.update([d.forces[p] for d in block.samples])
+            return block
+        events = self.engine.process(block.times, block.forces)
+        if len(events) > 0:
+            self._is_detecting.value = self.engine.is_detecting
+        for t, event, value in events:
+            channel, version = self._feedback
+            self.context.send(self.FEEDBACK[event][channel] +
+                              wire_protocol.encode(value, version))
+            if isinstance(value, tuple):
+                value = ":".join(map(str, value))
+            self.context.record(DAQEvents(time=t, code="{}:{}:{}".format(
+                event, self.context.device_id, value)))
+        return block
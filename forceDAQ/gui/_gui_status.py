@@ -1,12 +1,12 @@
 __author__ = "Oliver Lindemann"
 
-from pickle import dumps, loads
-
 from expyriment import io, misc
 
 from .. import __version__ as forceDAQVersion
 from .._lib.misc import SensorHistory
 from .._lib.types import ForceData, Thresholds, GUIRemoteControlCommands as RcCmd
+from .._lib.udp_connection import UDPConnection
+from .._lib import wire_protocol
 from ..force.sensor_process import SensorProcess
 
 from . import settings
@@ -57,16 +57,17 @@ class GUIStatus(object):
 
         self.sensor_processes = recorder.force_sensor_processes
         self.n_sensors = len(self.sensor_processes)
-        self.history = []
-        for _ in range(self.n_sensors):
-            self.history.append( SensorHistory(history_size = settings.gui.moving_average_size,
-                                               number_of_parameter= 3) )
+        self.history = SensorHistory(history_size = settings.gui.moving_average_size,
+                                     number_of_parameter = 6,
+                                     n_sensors = self.n_sensors)
+        self._history_counter = [0] * self.n_sensors  # of the stream buffers
 
         self._start_recording_time = 0
         self.pause_recording = True
         self.quit_recording = False
         self.clear_screen = True
         self.thresholds = None
+        self.wire_versions = {} # peer ip: protocol version
         self.set_marker = False
         self.last_udp_data = None
         self._last_processed_smpl = [0] * self.n_sensors
@@ -99,6 +100,43 @@ class GUIStatus(object):
             self.plot_data_plotter_names.append(str(x[0]) + "_" + ForceData.forces_names[ x[1]])
 
 
+    def wire_version(self, peer=None):
+        """protocol version of a peer or, if peer is None, of all connected
+        peers (lowest negotiated protocol version)"""
+        if peer is not None:
+            return self.wire_versions.get(peer, wire_protocol.PICKLE)
+        elif len(self.wire_versions) > 0:
+            return min(self.wire_versions.values())
+        else:
+            return wire_protocol.PICKLE
+
+    def encode(self, value, peer=None):
+        """encode remote control payload (see wire_version)"""
+        return wire_protocol.encode(value, self.wire_version(peer))
+
+    def set_thresholds(self, thresholds):
+        """set thresholds (or None) and forward them to the detection of
+        the sensor processes"""
+        self.thresholds = thresholds
+        if thresholds is not None:
+            thresholds.set_number_of_channels(self.n_sensors)
+            thresholds = thresholds.thresholds
+        for fsp in self.sensor_processes:
+            fsp.set_thresholds(thresholds,
+                               parameter=self.level_detection_parameter,
+                               moving_average_size=settings.gui.moving_average_size)
+
+    def is_detecting_anything(self):
+        """is detecting something in at least one sensor"""
+        return any([fsp.is_detecting for fsp in self.sensor_processes])
+
+    def reply(self, udp_event, value):
+        """send value to the sender of the udp_event"""
+        reply = RcCmd.VALUE + self.encode(value, udp_event.sender)
+        self.recorder.udp.send_queue.put(
+            (wire_protocol.encode_reply(udp_event.request_id, reply),
+             udp_event.sender))
+
     def set_start_recording_time(self):
         self._start_recording_time = self._clock.time
 
@@ -186,9 +224,9 @@ class GUIStatus(object):
                                     background_stimulus=logo_text_line("")).get())
             self.background.stimulus().present()
             if tmp is not None:
-                self.thresholds = Thresholds(tmp, n_channels=self.n_sensors)
+                self.set_thresholds(Thresholds(tmp, n_channels=self.n_sensors))
             else:
-                self.thresholds = None
+                self.set_thresholds(None)
 
     def process_udp_event(self, udp_event):
         """remote control
@@ -203,89 +241,87 @@ class GUIStatus(object):
                 self.pause_recording = True
             elif udp_event.byte_string == RcCmd.QUIT:
                 self.quit_recording = True
+            elif udp_event.byte_string == UDPConnection.CONNECT:
+                self.wire_versions[udp_event.sender] = wire_protocol.PICKLE # new client
+            elif udp_event.byte_string == UDPConnection.UNCONNECT:
+                self.wire_versions.pop(udp_event.sender, None)
+            elif udp_event.startswith(RcCmd.PROTOCOL):
+                self.wire_versions[udp_event.sender] = \
+                    wire_protocol.negotiate_version(
+                            udp_event.byte_string[len(RcCmd.PROTOCOL):])
+                self.reply(udp_event, self.wire_versions[udp_event.sender])
 
             elif udp_event.startswith(RcCmd.SET_THRESHOLDS): # thresholds
                 try:
-                    self.thresholds = loads(
+                    tmp = wire_protocol.decode(
                         udp_event.byte_string[len(RcCmd.SET_THRESHOLDS):])
-                    if not isinstance(self.thresholds, Thresholds): # ensure not strange types
-                        self.thresholds = None
-                    else:
-                        self.thresholds.set_number_of_channels(self.n_sensors)
+                    if isinstance(tmp, (list, tuple)):
+                        tmp = Thresholds(tmp)
+                    if not isinstance(tmp, Thresholds): # ensure not strange types
+                        tmp = None
                 except:
-                    self.thresholds = None
+                    tmp = None
+                self.set_thresholds(tmp)
 
             elif udp_event.startswith(RcCmd.GET_THRESHOLD_LEVEL) or \
                  udp_event.startswith(RcCmd.GET_THRESHOLD_LEVEL2):
                 if self.thresholds is not None:
                     s = int(udp_event.startswith(RcCmd.GET_THRESHOLD_LEVEL2))
                     tmp = self.thresholds.get_level(self.level_detection_parameter_average(s))
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE + dumps(tmp))
+                    self.reply(udp_event, tmp)
                 else:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE + dumps(None))
+                    self.reply(udp_event, None)
             elif udp_event.startswith(RcCmd.SET_LEVEL_CHANGE_DETECTION) or \
                  udp_event.startswith(RcCmd.SET_LEVEL_CHANGE_DETECTION2):
-                if self.thresholds is not None:
-                    s = int(udp_event.startswith(RcCmd.SET_LEVEL_CHANGE_DETECTION2))
-                    self.thresholds.set_level_change_detection(self.level_detection_parameter_average(s),
-                                                               channel=s)
+                s = int(udp_event.startswith(RcCmd.SET_LEVEL_CHANGE_DETECTION2))
+                if self.thresholds is not None and s < self.n_sensors:
+                    self.sensor_processes[s].start_level_change_detection(
+                        channel=s, wire_version=self.wire_version())
 
             elif udp_event.startswith(RcCmd.SET_RESPONSE_MINMAX_DETECTION) or \
                     udp_event.startswith(RcCmd.SET_RESPONSE_MINMAX_DETECTION2):
                 try:
-                    duration =  int(loads(
+                    duration =  int(wire_protocol.decode(
                         udp_event.byte_string[len(RcCmd.SET_RESPONSE_MINMAX_DETECTION):]))
                 except:
                     duration = None
 
-                s = int(udp_event.startswith(RcCmd.SET_LEVEL_CHANGE_DETECTION2))
-                if self.thresholds is not None and duration is not None:
-                    self.thresholds.set_response_minmax_detection(
-                        value = self.level_detection_parameter_average(s), duration = duration,
-                        channel=s)
+                s = int(udp_event.startswith(RcCmd.SET_RESPONSE_MINMAX_DETECTION2))
+                if self.thresholds is not None and duration is not None and \
+                        s < self.n_sensors:
+                    self.sensor_processes[s].start_response_minmax_detection(
+                        duration=duration, channel=s,
+                        wire_version=self.wire_version())
 
             elif udp_event.byte_string == RcCmd.GET_VERSION:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                            dumps(forceDAQVersion))
+                self.reply(udp_event, forceDAQVersion)
             elif udp_event.byte_string == RcCmd.PING:
-                self.recorder.udp.send_queue.put(RcCmd.PING)
+                self.recorder.udp.send_queue.put((RcCmd.PING, udp_event.sender))
             elif udp_event.byte_string == RcCmd.GET_FX1:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                 dumps(self.sensor_processes[0].Fx))
+                self.reply(udp_event, self.sensor_processes[0].Fx)
             elif udp_event.byte_string == RcCmd.GET_FY1:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                 dumps(self.sensor_processes[0].Fy))
+                self.reply(udp_event, self.sensor_processes[0].Fy)
             elif udp_event.byte_string == RcCmd.GET_FZ1:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                 dumps(self.sensor_processes[0].Fz))
+                self.reply(udp_event, self.sensor_processes[0].Fz)
             elif udp_event.byte_string == RcCmd.GET_TX1:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                 dumps(self.sensor_processes[0].Fx))
+                self.reply(udp_event, self.sensor_processes[0].Fx)
             elif udp_event.byte_string == RcCmd.GET_TY1:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                 dumps(self.sensor_processes[0].Fy))
+                self.reply(udp_event, self.sensor_processes[0].Fy)
             elif udp_event.byte_string == RcCmd.GET_TZ1:
-                self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                 dumps(self.sensor_processes[0].Fz))
+                self.reply(udp_event, self.sensor_processes[0].Fz)
             elif self.n_sensors > 1:
                 if udp_event.byte_string == RcCmd.GET_FX2:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                     dumps(self.sensor_processes[1].Fx))
+                    self.reply(udp_event, self.sensor_processes[1].Fx)
                 elif udp_event.byte_string == RcCmd.GET_FY2:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                     dumps(self.sensor_processes[1].Fy))
+                    self.reply(udp_event, self.sensor_processes[1].Fy)
                 elif udp_event.byte_string == RcCmd.GET_FZ2:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                     dumps(self.sensor_processes[1].Fz))
+                    self.reply(udp_event, self.sensor_processes[1].Fz)
                 elif udp_event.byte_string == RcCmd.GET_TX2:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                     dumps(self.sensor_processes[1].Fx))
+                    self.reply(udp_event, self.sensor_processes[1].Fx)
                 elif udp_event.byte_string == RcCmd.GET_TY2:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                     dumps(self.sensor_processes[1].Fy))
+                    self.reply(udp_event, self.sensor_processes[1].Fy)
                 elif udp_event.byte_string == RcCmd.GET_TZ2:
-                    self.recorder.udp.send_queue.put(RcCmd.VALUE +
-                                                     dumps(self.sensor_processes[1].Fz))
+                    self.reply(udp_event, self.sensor_processes[1].Fz)
         else:
             # not remote control command
             self.set_marker = True
@@ -293,12 +329,18 @@ class GUIStatus(object):
 
 
     def update_history(self, sensor):
-        self.history[sensor].update(self.sensor_processes[sensor].get_Fxyz())
+        """adds all new samples of the sensor to the history"""
+        ring = self.sensor_processes[sensor].stream_buffer
+        # older samples would be overwritten in the history anyway
+        counter = max(self._history_counter[sensor],
+                      ring.counter - self.history.history_size)
+        rows, _, self._history_counter[sensor], _ = ring.read_since(counter)
+        self.history.update_block(rows[:, 1:7], sensor=sensor)
 
     def level_detection_parameter_average(self, sensor):
         """just a short cut"""
         if sensor < self.n_sensors:
-            return self.history[sensor].moving_average[self.level_detection_parameter]
+            return self.history.moving_average[sensor, self.level_detection_parameter]
         else:
             return None
 
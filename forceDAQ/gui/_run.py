@@ -5,7 +5,6 @@ See COPYING file distributed along with the pyForceDAQ copyright and license ter
 __author__ = "Oliver Lindemann"
 
 import pygame
-from pickle import dumps
 
 import numpy as np
 from expyriment import control, design, stimuli, io, misc
@@ -79,30 +78,11 @@ def _main_loop(exp, recorder, remote_control=False):
             s.process_udp_event(udp.pop(0))
 
         ########################### process new samples
+        # (level change and response min/max detection run in the sensor
+        # processes, see SensorProcess.set_thresholds)
         for x in s.check_new_samples():
             s.update_history(sensor=x)
 
-            if s.thresholds is not None:
-                # level change detection
-                level_change, tmp = s.thresholds.get_level_change(
-                                                s.history[x].moving_average[s.level_detection_parameter],
-                                                channel=x)
-                if level_change:
-                    if x==1:
-                        recorder.udp.send_queue.put(RcCmd.CHANGED_LEVEL2+ dumps(tmp))
-                    else:
-                        recorder.udp.send_queue.put(RcCmd.CHANGED_LEVEL+ dumps(tmp))
-
-                # minmax detection
-                tmp = s.thresholds.get_response_minmax(
-                                                s.history[x].moving_average[s.level_detection_parameter],
-                                                channel=x)
-                if tmp is not None:
-                    if x==1:
-                        recorder.udp.send_queue.put(RcCmd.RESPONSE_MINMAX2 + dumps(tmp))
-                    else:
-                        recorder.udp.send_queue.put(RcCmd.RESPONSE_MINMAX + dumps(tmp))
-
 
         ######################## show pause or recording screen
         if s.check_recording_status_change():
@@ -224,18 +204,16 @@ def _main_loop(exp, recorder, remote_control=False):
                     s.clear_screen = False
 
                 if s.plot_filtered:
-                    tmp = np.array(list(map(lambda x: s.history[x[
-                        0]].moving_average[x[1]], s.plot_data_plotter)),
+                    average = s.history.moving_average
+                    tmp = np.array(list(map(lambda x: average[x[0], x[1]],
+                                            s.plot_data_plotter)),
                                    dtype=float)
                 else:
                     tmp = np.array(list(map(lambda x: s.sensor_processes[x[
                         0]].get_force(x[1]), s.plot_data_plotter)),
                                    dtype=float)
 
-                if s.thresholds is not None:
-                    point_marker = s.thresholds.is_detecting_anything()
-                else:
-                    point_marker = False
+                point_marker = s.is_detecting_anything()
 
                 plotter_thread.add_values(
                     values = s.scaling_plotter.data2pixel(tmp),
@@ -469,14 +447,18 @@ def run_with_options(remote_control,
             app_timer.wait(100)
 
         logo_text_line("Wait for filename").present()
-        while True:
+        filename = None
+        while filename is None:
             try:
-                x = recorder.udp.receive_queue.get_nowait()
+                batch = recorder.udp.receive_queue.get_nowait()
             except:
-                x = None
+                batch = []
 
-            if x is not None and x.startswith(RcCmd.FILENAME):
-                filename = x.byte_string[len(RcCmd.FILENAME):].decode('utf-8', 'replace')
+            for x in batch:
+                if x.startswith(RcCmd.FILENAME):
+                    filename = x.byte_string[len(RcCmd.FILENAME):].decode('utf-8', 'replace')
+                    break
+            if filename is not None:
                 break
             exp.keyboard.check()
             app_timer.wait(100)
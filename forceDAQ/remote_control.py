@@ -5,13 +5,19 @@ import this module to have all relevant classes and function for the remote_cont
 __author__ = 'Oliver Lindemann'
 
 import atexit
-from pickle import dumps, loads
 
+from ._lib import wire_protocol
 from ._lib.types import Thresholds, bytes_startswith
 from ._lib.types import GUIRemoteControlCommands as Command
 from ._lib.udp_connection import UDPConnection
+from ._lib.timer import app_timer
+from ._lib.clock_sync import ClockSync, encode_sync_request, decode_sync_reply
+from ._lib.streaming import encode_subscribe, decode_stream_packet, \
+    encode_get_values
 
 udp = None
+wire_version = wire_protocol.PICKLE
+clock_sync = ClockSync()
 
 def init_udp_connection():
     """init udp connecting afterwards udp connection is available via
@@ -21,10 +27,26 @@ def init_udp_connection():
 
     returns udp connection
     """
-    global udp
+    global udp, wire_version
     udp = UDPConnection()
+    wire_version = wire_protocol.PICKLE
     return udp
 
+def negotiate_protocol():
+    """use the binary wire protocol, if supported by the recording PC
+    (call after connecting)
+
+    returns the protocol version (wire_protocol.PICKLE for old servers)
+    """
+    global wire_version
+    version = get_data(Command.PROTOCOL +
+                       bytes(bytearray([wire_protocol.PROTOCOL_VERSION])))
+    if isinstance(version, int):
+        wire_version = version
+    else:
+        wire_version = wire_protocol.PICKLE
+    return wire_version
+
 def quit():
     global udp
     if isinstance(udp, UDPConnection):
@@ -45,10 +67,23 @@ def get_data(get_command):
     udp.send(get_command)
     d = udp.receive(1)
     try:
-        return loads(d[len(Command.VALUE):])
+        return wire_protocol.decode(d[len(Command.VALUE):])
     except:
         return None
 
+def get_values(selections):
+    """Get multiple values from the recording PC with one request
+
+    selections: list of tuples (sensor, parameter_id), e.g.
+                [(0, 0), (0, 1), (0, 2), (1, 0), (1, 1), (1, 2)] for Fx, Fy
+                and Fz of both sensors. parameter_id: 0-5 (Fx, Fy, Fz, Tx,
+                Ty, Tz), 6 & 7 (trigger1 & trigger2)
+
+    returns list of tuples (sensor, sample counter, time, values) for
+    each requested sensor. The values of a sensor are from the same sample.
+    """
+    return get_data(encode_get_values(selections))
+
 def poll_event(event_type):
     """polling response minmax level
     event_tag:
@@ -58,7 +93,7 @@ def poll_event(event_type):
     """
     rcv = udp.poll()
     if rcv is not None and bytes_startswith(rcv, event_type):
-        x = loads(rcv[len(event_type):])
+        x = wire_protocol.decode(rcv[len(event_type):])
         return x
     else:
         return None
@@ -76,14 +111,15 @@ def poll_multiple_events(event_type_list):
     if rcv is not None:
         for event_type in event_type_list:
             if bytes_startswith(rcv, event_type):
-                x = loads(rcv[len(event_type):])
+                x = wire_protocol.decode(rcv[len(event_type):])
                 return (event_type, x)
     return (None, None)
 
 
 def set_force_thresholds(lower, upper):
     thr = Thresholds([lower, upper])
-    return udp.send(Command.SET_THRESHOLDS + dumps(thr))
+    return udp.send(Command.SET_THRESHOLDS +
+                    wire_protocol.encode(thr, wire_version))
 
 
 def set_level_change_detection(sensor=1):
@@ -91,3 +127,67 @@ def set_level_change_detection(sensor=1):
         return udp.send(Command.SET_LEVEL_CHANGE_DETECTION2)
     else:
         return udp.send(Command.SET_LEVEL_CHANGE_DETECTION)
+
+
+def subscribe(selections, packet_rate=100, decimation=1):
+    """subscribe to live streaming of force data
+
+    selections: list of tuples (sensor, parameter_id), e.g. [(0, 2), (1, 2)]
+                for Fz of both sensors. parameter_id: 0-5 (Fx, Fy, Fz, Tx,
+                Ty, Tz), 6 & 7 (trigger1 & trigger2)
+    packet_rate: packets per second (per sensor)
+    decimation: stream only every n-th sample
+
+    Use poll_stream() to receive the data.
+    """
+    return udp.send(encode_subscribe(selections, packet_rate=packet_rate,
+                                     decimation=decimation))
+
+
+def unsubscribe():
+    return udp.send(Command.UNSUBSCRIBE)
+
+
+def poll_stream():
+    """polling stream data
+
+    returns dict with seq, sensor, parameters, samples (sample indices),
+    times (array) and values (array, samples x parameters) or None
+    """
+    rcv = udp.poll()
+    if rcv is not None:
+        return decode_stream_packet(rcv)
+    return None
+
+
+def sync_clock(n_exchanges=10, log_mapping=True):
+    """Estimate offset and drift between the clock of this PC (app_timer)
+    and the recorder clock (NTP-style, see clock_sync)
+
+    Call it on demand or periodically (e.g. between trials); the drift
+    estimate improves with multiple calls.
+
+    log_mapping: send the mapping to the recorder, which logs it into the
+                 data file (#SYNC)
+
+    returns ClockMapping or None
+    """
+    exchanges = []
+    for _ in range(n_exchanges):
+        t1 = app_timer.time_us
+        udp.send(encode_sync_request(t1))
+        while True:
+            rcv = udp.receive(0.2)
+            t4 = app_timer.time_us
+            if rcv is None:
+                break
+            if bytes_startswith(rcv, Command.CLOCK_SYNC):
+                r1, t2, t3 = decode_sync_reply(rcv)
+                if r1 == t1:
+                    exchanges.append((t1, t2, t3, t4))
+                    break
+    clock_sync.add_round(exchanges)
+    mapping = clock_sync.mapping
+    if log_mapping and mapping is not None:
+        udp.send(Command.CLOCK_MAPPING + wire_protocol.encode(tuple(mapping)))
+    return mapping
@@ -0,0 +1,608 @@
+"""
+asyncio implementation of the remote control (client and server side)
+
+Client example (e.g. in an experiment script)::
+
+    from forceDAQ.remote_control_async import RemoteControlClient, Command
+    from forceDAQ._lib import wire_protocol
+
+    async def main():
+        rc = RemoteControlClient(server_ip="192.168.1.2")
+        await rc.connect()
+        await rc.negotiate_protocol()  # binary payloads and request ids
+        fz, version = await asyncio.gather(rc.get_data(Command.GET_FZ1),
+                                           rc.get_data(Command.GET_VERSION))
+        rc.send(Command.SET_THRESHOLDS +
+                wire_protocol.encode([-5.0, 5.0], rc.wire_version))
+        rc.send(Command.SET_LEVEL_CHANGE_DETECTION)
+        event, level = await rc.wait_event([Command.CHANGED_LEVEL],
+                                           timeout=2.0)
+        rc.close()
+
+Server example (recorder without UDP process)::
+
+    recorder = DataRecorder(settings, poll_udp_connection=False)
+    await serve(RecorderCommandHandler(recorder))
+
+"""
+
+import asyncio
+from collections import deque
+
+from . import __version__ as forceDAQVersion
+from ._lib import wire_protocol
+from ._lib.types import UDPData, Thresholds, bytes_startswith
+from ._lib.types import GUIRemoteControlCommands as Command
+from ._lib.udp_connection import UDPConnection
+from ._lib.streaming import encode_subscribe, decode_stream_packet, \
+    encode_get_values, get_values
+from ._lib.timer import app_timer
+from ._lib.sample_markers import write_marker
+from ._lib.clock_sync import ClockSync, encode_sync_request, \
+    decode_sync_reply, sync_reply
+
+UDP_PORT = 5005
+
+
+class _ClientProtocol(asyncio.DatagramProtocol):
+
+    def __init__(self, client):
+        self._client = client
+
+    def datagram_received(self, data, addr):
+        self._client._datagram_received(data, addr)
+
+    def error_received(self, exc):
+        pass
+
+
+class RemoteControlClient(object):
+    """asyncio remote control client
+
+    Replies are awaitable and multiple requests can be in-flight at the same
+    time. After `negotiate_protocol`, requests are sent with request ids and
+    the replies (VALUE) are assigned by the id. Replies of timed out requests
+    are dropped. Old servers don't support request ids; the replies are
+    then assigned to the requests in the order of the requests. Feedback
+    events (e.g. CHANGED_LEVEL, RESPONSE_MINMAX, FEEDBACK) are collected in
+    an event queue (see `wait_event`).
+    """
+
+    def __init__(self, server_ip, udp_port=UDP_PORT, ip=None):
+        """
+        server_ip: ip of the recording pc
+        ip: the ip to bind to, default: UDPConnection.MY_IP
+        """
+        self.server_ip = server_ip
+        self.udp_port = udp_port
+        if ip is None:
+            ip = UDPConnection.MY_IP
+        self.ip = ip
+        self._transport = None
+        self._value_waiters = deque()
+        self._id_waiters = {}  # request id: future
+        self._request_id = 0
+        self.request_ids = False
+        self._reply_waiters = deque()
+        self._ping_waiters = deque()
+        self._sync_waiters = deque()
+        self._events = None
+        self._stream = None
+        self.wire_version = wire_protocol.PICKLE
+        self.clock_sync = ClockSync()
+
+    @property
+    def is_connected(self):
+        return self._transport is not None
+
+    async def connect(self, timeout=1.0):
+        """open the socket and connect to the server
+
+        returns True if connection has been established
+        """
+        loop = asyncio.get_running_loop()
+        if self._transport is None:
+            self._events = asyncio.Queue()
+            self._stream = asyncio.Queue()
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _ClientProtocol(self),
+                local_addr=(self.ip, self.udp_port))
+        self.wire_version = wire_protocol.PICKLE
+        self.request_ids = False
+        try:
+            await self._request(UDPConnection.CONNECT, self._reply_waiters,
+                                timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self, quit_server=False):
+        """unconnect from the server and close the socket"""
+        if self._transport is not None:
+            if quit_server:
+                self.send(Command.QUIT)
+            self.send(UDPConnection.UNCONNECT)
+            self._transport.close()
+            self._transport = None
+        for waiters in (self._value_waiters, self._reply_waiters,
+                        self._ping_waiters, self._sync_waiters):
+            while len(waiters) > 0:
+                waiters.popleft().cancel()
+        for fut in self._id_waiters.values():
+            fut.cancel()
+        self._id_waiters.clear()
+
+    def send(self, data):
+        """send command or data without waiting for a reply"""
+        if isinstance(data, str):
+            data = data.encode()
+        self._transport.sendto(data, (self.server_ip, self.udp_port))
+
+    async def _request(self, data, waiters, timeout):
+        fut = asyncio.get_running_loop().create_future()
+        waiters.append(fut)
+        self.send(data)
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            if fut in waiters:
+                waiters.remove(fut)
+
+    async def _id_request(self, data, timeout):
+        """request with request id (see wire_protocol.encode_request)"""
+        self._request_id = (self._request_id + 1) & 0xFFFF
+        request_id = self._request_id
+        fut = asyncio.get_running_loop().create_future()
+        self._id_waiters[request_id] = fut
+        self.send(wire_protocol.encode_request(request_id, data))
+        try:
+            return await asyncio.wait_for(fut, timeout)
+        finally:
+            if self._id_waiters.get(request_id) is fut:
+                del self._id_waiters[request_id]
+
+    async def get_data(self, get_command, timeout=1.0):
+        """Get data from the recording PC
+        get_commands e.g.
+            Command.GET_FZ1 or
+            Command.GET_VERSION
+
+        returns None if no reply within timeout
+        """
+        try:
+            if self.request_ids:
+                rtn = await self._id_request(get_command, timeout)
+            else:
+                rtn = await self._request(get_command, self._value_waiters,
+                                          timeout)
+        except asyncio.TimeoutError:
+            return None
+        if not bytes_startswith(rtn, Command.VALUE):
+            return None
+        try:
+            return wire_protocol.decode(rtn[len(Command.VALUE):])
+        except RuntimeError:
+            return None
+
+    async def get_values(self, selections, timeout=1.0):
+        """Get multiple values with one request (see
+        remote_control.get_values)"""
+        return await self.get_data(encode_get_values(selections), timeout)
+
+    async def negotiate_protocol(self, timeout=1.0):
+        """use the binary wire protocol and request ids, if supported by the
+        server (call after connect)
+
+        Old servers ignore requests with id, the negotiation takes then
+        `timeout` seconds longer.
+
+        returns the protocol version (wire_protocol.PICKLE for old servers)
+        """
+        cmd = Command.PROTOCOL + bytes(bytearray(
+                                        [wire_protocol.PROTOCOL_VERSION]))
+        self.request_ids = True
+        version = await self.get_data(cmd, timeout)
+        if version is None:
+            # no reply: server without request ids
+            self.request_ids = False
+            version = await self.get_data(cmd, timeout)
+        if isinstance(version, int):
+            self.wire_version = version
+        else:
+            self.wire_version = wire_protocol.PICKLE
+        return self.wire_version
+
+    async def ping(self, timeout=0.5):
+        """returns round trip time (ms) or None"""
+        t = app_timer.time
+        try:
+            await self._request(Command.PING, self._ping_waiters, timeout)
+        except asyncio.TimeoutError:
+            return None
+        return app_timer.time - t
+
+    async def sync_clock(self, n_exchanges=10, log_mapping=True,
+                         timeout=0.2):
+        """Estimate offset and drift to the recorder clock (see
+        remote_control.sync_clock)
+
+        returns ClockMapping or None
+        """
+        exchanges = []
+        for _ in range(n_exchanges):
+            t1 = app_timer.time_us
+            try:
+                rcv = await self._request(encode_sync_request(t1),
+                                          self._sync_waiters, timeout)
+            except asyncio.TimeoutError:
+                continue
+            t4 = app_timer.time_us
+            r1, t2, t3 = decode_sync_reply(rcv)
+            if r1 == t1:
+                exchanges.append((t1, t2, t3, t4))
+        self.clock_sync.add_round(exchanges)
+        mapping = self.clock_sync.mapping
+        if log_mapping and mapping is not None:
+            self.send(Command.CLOCK_MAPPING +
+                      wire_protocol.encode(tuple(mapping)))
+        return mapping
+
+    async def sync_clock_periodically(self, interval=10.0, n_exchanges=10):
+        """synchronizes the clock every interval (seconds) until cancelled,
+        e.g. asyncio.create_task(rc.sync_clock_periodically())"""
+        while self.is_connected:
+            await self.sync_clock(n_exchanges=n_exchanges)
+            await asyncio.sleep(interval)
+
+    async def wait_event(self, event_types=None, timeout=None):
+        """waits for a feedback event, e.g.
+            [Command.CHANGED_LEVEL, Command.CHANGED_LEVEL2]
+        event_types None: waits for any event
+
+        returns tuple (event_type, event_data) or (None, None)
+        """
+        loop = asyncio.get_running_loop()
+        end = None if timeout is None else loop.time() + timeout
+        while True:
+            remaining = None if end is None else max(0, end - loop.time())
+            try:
+                rcv = await asyncio.wait_for(self._events.get(), remaining)
+            except asyncio.TimeoutError:
+                return None, None
+            if event_types is None:
+                return rcv, None
+            for event_type in event_types:
+                if bytes_startswith(rcv, event_type):
+                    try:
+                        return event_type, wire_protocol.decode(
+                                                    rcv[len(event_type):])
+                    except RuntimeError:
+                        return event_type, None
+
+    def subscribe(self, selections, packet_rate=100, decimation=1):
+        """subscribe to live streaming of force data
+        (see remote_control.subscribe and `stream_packet`)"""
+        self.send(encode_subscribe(selections, packet_rate=packet_rate,
+                                   decimation=decimation))
+
+    def unsubscribe(self):
+        self.send(Command.UNSUBSCRIBE)
+
+    async def stream_packet(self, timeout=None):
+        """waits for the next stream packet
+
+        returns dict (see streaming.decode_stream_packet) or None
+        """
+        try:
+            return await asyncio.wait_for(self._stream.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _datagram_received(self, data, addr):
+        if addr[0] != self.server_ip:
+            return
+        if bytes_startswith(data, Command.STREAM):
+            self._stream.put_nowait(decode_stream_packet(data))
+            return
+        elif bytes_startswith(data, Command.REPLY):
+            request_id, data = wire_protocol.decode_reply(data)
+            fut = self._id_waiters.pop(request_id, None)
+            if fut is not None and not fut.done():
+                fut.set_result(data)
+            return  # replies of unknown or timed out requests are dropped
+        elif data == UDPConnection.COMMAND_REPLY:
+            waiters = self._reply_waiters
+        elif data == Command.PING:
+            waiters = self._ping_waiters
+        elif bytes_startswith(data, Command.CLOCK_SYNC):
+            waiters = self._sync_waiters
+        elif bytes_startswith(data, Command.VALUE):
+            waiters = self._value_waiters
+        else:
+            self._events.put_nowait(data)
+            return
+
+        while len(waiters) > 0:
+            fut = waiters.popleft()
+            if not fut.done():
+                fut.set_result(data)
+                break
+
+
+class RecorderCommandHandler(object):
+    """handles the remote control commands for a DataRecorder
+
+    Values are taken directly from the sensor processes and UDP markers are
+    saved via the recorder and marked in the data of the sensor processes.
+    The events of the online detection (see SET_THRESHOLDS) are sent via
+    the send queue of the recorder (see RemoteControlServerProtocol).
+    """
+
+    _getter = {Command.GET_FX1: (0, 0), Command.GET_FY1: (0, 1),
+               Command.GET_FZ1: (0, 2), Command.GET_TX1: (0, 3),
+               Command.GET_TY1: (0, 4), Command.GET_TZ1: (0, 5),
+               Command.GET_FX2: (1, 0), Command.GET_FY2: (1, 1),
+               Command.GET_FZ2: (1, 2), Command.GET_TX2: (1, 3),
+               Command.GET_TY2: (1, 4), Command.GET_TZ2: (1, 5)}
+
+    def __init__(self, recorder, level_detection_parameter=2,
+                 moving_average_size=5):
+        """
+        level_detection_parameter: index of the force parameter (0-5, Fx to
+            Tz) used for the level detection
+        moving_average_size: levels are determined from the moving average
+            of this number of samples
+        """
+        self.recorder = recorder
+        self.quit_request = False
+        self.wire_version = wire_protocol.PICKLE
+        self.thresholds = None
+        self.level_detection_parameter = level_detection_parameter
+        self.moving_average_size = moving_average_size
+
+    @property
+    def send_queue(self):
+        """queue with the detected events of the sensor processes"""
+        return getattr(self.recorder, "send_queue", None)
+
+    def _sensor_process(self, sensor):
+        try:
+            return self.recorder.force_sensor_processes[sensor]
+        except IndexError:
+            return None
+
+    def level_detection_parameter_average(self, sensor):
+        """moving average of the level detection parameter"""
+        fsp = self._sensor_process(sensor)
+        if fsp is None:
+            return None
+        ring = fsp.stream_buffer
+        rows = ring.read_since(ring.counter - self.moving_average_size)[0]
+        if len(rows) == 0:
+            return None
+        return float(rows[:, 1 + self.level_detection_parameter].mean())
+
+    def set_thresholds(self, thresholds):
+        """set the thresholds of all sensor processes (None: detection off)"""
+        self.thresholds = thresholds
+        if thresholds is not None:
+            thresholds = thresholds.thresholds
+        for fsp in self.recorder.force_sensor_processes:
+            fsp.set_thresholds(thresholds,
+                               parameter=self.level_detection_parameter,
+                               moving_average_size=self.moving_average_size)
+
+    def encode(self, value):
+        return wire_protocol.encode(value, self.wire_version)
+
+    def connected(self):
+        """a new client has been connected"""
+        self.wire_version = wire_protocol.PICKLE
+
+    def process_command(self, udp_data):
+        """process remote control command and returns reply (bytes), None or
+        a coroutine that returns the reply (blocking recorder functions)
+        """
+        cmd = udp_data.byte_string
+        if cmd in self._getter:
+            sensor, para = self._getter[cmd]
+            fsp = self._sensor_process(sensor)
+            if fsp is None:
+                return Command.VALUE + self.encode(None)
+            return Command.VALUE + self.encode(fsp.get_force(para))
+        elif cmd in (Command.GET_THRESHOLD_LEVEL, Command.GET_THRESHOLD_LEVEL2):
+            level = None
+            if self.thresholds is not None:
+                value = self.level_detection_parameter_average(
+                                    int(cmd == Command.GET_THRESHOLD_LEVEL2))
+                if value is not None:
+                    level = self.thresholds.get_level(value)
+            return Command.VALUE + self.encode(level)
+        elif bytes_startswith(cmd, Command.SET_THRESHOLDS):
+            try:
+                tmp = wire_protocol.decode(cmd[len(Command.SET_THRESHOLDS):])
+                if isinstance(tmp, (list, tuple)):
+                    tmp = Thresholds(tmp)
+                if not isinstance(tmp, Thresholds):  # ensure not strange types
+                    tmp = None
+            except Exception:
+                tmp = None
+            self.set_thresholds(tmp)
+        elif cmd in (Command.SET_LEVEL_CHANGE_DETECTION,
+                     Command.SET_LEVEL_CHANGE_DETECTION2):
+            s = int(cmd == Command.SET_LEVEL_CHANGE_DETECTION2)
+            fsp = self._sensor_process(s)
+            if self.thresholds is not None and fsp is not None:
+                fsp.start_level_change_detection(
+                    channel=s, wire_version=self.wire_version)
+        elif bytes_startswith(cmd, Command.SET_RESPONSE_MINMAX_DETECTION) or \
+                bytes_startswith(cmd, Command.SET_RESPONSE_MINMAX_DETECTION2):
+            try:
+                duration = int(wire_protocol.decode(
+                        cmd[len(Command.SET_RESPONSE_MINMAX_DETECTION):]))
+            except Exception:
+                duration = None
+            s = int(bytes_startswith(cmd,
+                                     Command.SET_RESPONSE_MINMAX_DETECTION2))
+            fsp = self._sensor_process(s)
+            if self.thresholds is not None and duration is not None and \
+                    fsp is not None:
+                fsp.start_response_minmax_detection(
+                    duration=duration, channel=s,
+                    wire_version=self.wire_version)
+        elif bytes_startswith(cmd, Command.FILENAME):
+            filename = cmd[len(Command.FILENAME):].decode('utf-8', 'replace')
+            if len(filename) > 0:
+                # creates the file and writes the header
+                return self._in_executor(
+                        lambda: self.recorder.open_data_file(filename), None)
+        elif cmd == Command.GET_VERSION:
+            return Command.VALUE + self.encode(forceDAQVersion)
+        elif bytes_startswith(cmd, Command.GET_VALUES):
+            try:
+                return Command.VALUE + wire_protocol.encode(get_values(
+                    [fsp.stream_buffer
+                     for fsp in self.recorder.force_sensor_processes],
+                    cmd[len(Command.GET_VALUES):]))
+            except Exception:
+                return Command.VALUE + wire_protocol.encode(None)
+        elif bytes_startswith(cmd, Command.PROTOCOL):
+            self.wire_version = wire_protocol.negotiate_version(
+                                            cmd[len(Command.PROTOCOL):])
+            return Command.VALUE + self.encode(self.wire_version)
+        elif cmd == Command.PING:
+            return Command.PING
+        elif cmd == Command.START:
+            # waits until the sensor processes are polling
+            return self._in_executor(self.recorder.start_recording,
+                                     Command.FEEDBACK_STARTED)
+        elif cmd == Command.PAUSE:
+            # waits for the sensor processes and writes the data
+            return self._in_executor(self.recorder.pause_recording,
+                                     Command.FEEDBACK_PAUSED)
+        elif cmd == Command.QUIT:
+            self.quit_request = True
+        elif bytes_startswith(cmd, Command.CLOCK_MAPPING):
+            self.recorder.save_udp_event(udp_data)  # logged as #SYNC
+        return None
+
+    async def _in_executor(self, function, reply):
+        """runs a blocking function outside the event loop, returns reply"""
+        await asyncio.get_running_loop().run_in_executor(None, function)
+        return reply
+
+    def process_marker(self, udp_data):
+        """process udp data that are not commands (marker)"""
+        write_marker([fsp.marker_buffer
+                      for fsp in self.recorder.force_sensor_processes],
+                     udp_data.time_ns / 1000000.0)
+        self.recorder.save_udp_event(udp_data)
+
+
+class RemoteControlServerProtocol(asyncio.DatagramProtocol):
+    """asyncio server of the remote control
+
+    Handles the connection commands (see UDPConnection) and passes remote
+    control commands and markers to the handler (see RecorderCommandHandler)
+
+    If the handler has a send queue (udp_connection.SendQueue, e.g. the
+    detected events of the sensor processes), its data are sent to the peer.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.peer = None
+        self.timer = app_timer
+        self._transport = None
+        self._forwarding = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+        send_queue = getattr(self.handler, "send_queue", None)
+        if send_queue is not None:
+            self._forwarding = asyncio.ensure_future(
+                                    self._forward(send_queue))
+
+    def connection_lost(self, exc):
+        if self._forwarding is not None:
+            self._forwarding.cancel()
+            self._forwarding = None
+
+    async def _forward(self, send_queue):
+        """sends the data of the send queue to the peer"""
+        loop = asyncio.get_running_loop()
+        while True:
+            # the queue is a pipe, wait for it outside the event loop
+            data = await loop.run_in_executor(None, _receive,
+                                              send_queue.connection, 0.1)
+            if isinstance(data, tuple):
+                data = data[0]  # (data, peer), there is only one peer
+            if data is not None:
+                self.send(data)
+
+    def send(self, data):
+        if self.peer is not None:
+            self._transport.sendto(data, self.peer)
+
+    def datagram_received(self, data, addr):
+        t_ns = self.timer.time_ns
+        t_us = t_ns // 1000
+        if data == UDPConnection.CONNECT:
+            self.peer = addr
+            if hasattr(self.handler, "connected"):
+                self.handler.connected()
+            self.send(UDPConnection.COMMAND_REPLY)
+            return
+        elif self.peer is None or addr[0] != self.peer[0]:
+            return
+        elif data == UDPConnection.PING:
+            self.send(UDPConnection.COMMAND_REPLY)
+            return
+        elif data == UDPConnection.UNCONNECT:
+            self.peer = None
+            return
+        elif bytes_startswith(data, Command.CLOCK_SYNC):
+            self.send(sync_reply(data, t_us, self.timer.time_us))
+            return
+
+        request_id, data = wire_protocol.decode_request(data)
+        d = UDPData(string=data, time_ns=t_ns, request_id=request_id)
+        if d.is_remote_control_command:
+            reply = self.handler.process_command(d)
+            if asyncio.iscoroutine(reply):
+                asyncio.ensure_future(self._send_later(reply, request_id))
+            elif reply is not None:
+                self.send(wire_protocol.encode_reply(request_id, reply))
+        else:
+            self.handler.process_marker(d)
+
+    async def _send_later(self, reply, request_id):
+        reply = await reply
+        if reply is not None:
+            self.send(wire_protocol.encode_reply(request_id, reply))
+
+
+def _receive(connection, timeout):
+    """receives from connection, returns None if nothing within timeout"""
+    if connection.poll(timeout):
+        return connection.recv()
+    return None
+
+
+async def serve(handler, ip=None, udp_port=UDP_PORT):
+    """server coroutine, runs until cancelled or QUIT command received
+
+    handler: e.g. RecorderCommandHandler
+    """
+
+    if ip is None:
+        ip = UDPConnection.MY_IP
+    loop = asyncio.get_running_loop()
+    transport, protocol = await loop.create_datagram_endpoint(
+        lambda: RemoteControlServerProtocol(handler),
+        local_addr=(ip, udp_port))
+    try:
+        while not getattr(handler, "quit_request", False):
+            await asyncio.sleep(0.1)
+    finally:
+        transport.close()
@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from forceDAQ._lib.clock_sync import ClockMapping, ClockSync, \
+    decode_sync_reply, encode_sync_request, read_clock_mappings, \
+    sync_reply, to_sender_time
+
+OFFSET = 250000.0  # us, recorder - remote at recorder time 0
+DRIFT = 80.0  # ppm
+
+
+def _remote_time(recorder_time):
+    return recorder_time - (OFFSET + DRIFT * 1e-6 * recorder_time)
+
+
+def _rounds(n_rounds, seed=1):
+    """synchronization rounds (5 exchanges each, one per second) with
+    asymmetric network delays"""
+    rng = np.random.RandomState(seed)
+    for r in range(n_rounds):
+        exchanges = []
+        for e in range(5):
+            t1_recorder = r * 1e6 + e * 1000
+            t2 = t1_recorder + 100 + rng.exponential(500)
+            t3 = t2 + 20
+            t4_recorder = t3 + 100 + rng.exponential(500)
+            exchanges.append((_remote_time(t1_recorder), t2, t3,
+                              _remote_time(t4_recorder)))
+        yield exchanges
+
+
+def test_sync_request_and_reply():
+    request = encode_sync_request(1234)
+    assert decode_sync_reply(sync_reply(request, 2000, 2010)) == \
+           (1234, 2000, 2010)
+
+
+def test_best_exchange_of_round():
+    sync = ClockSync()
+    best = sync.add_round([(0, 1100, 1110, 400), (10, 1050, 1060, 120)])
+    assert best == (1055.0, 990.0, 100)
+    assert sync.add_round([]) is None
+
+
+def test_offset_and_drift_estimation():
+    sync = ClockSync(n_rounds=20)
+    for exchanges in _rounds(30):
+        sync.add_round(exchanges)
+    mp = sync.mapping
+    assert abs(mp.drift - DRIFT) < 5
+    t = 29e6
+    assert abs(mp.to_sender_time(t) - _remote_time(t)) < 100
+    assert mp.to_recorder_time(mp.to_sender_time(t)) == pytest.approx(t)
+
+
+def test_single_round_without_drift():
+    sync = ClockSync()
+    sync.add_round(next(_rounds(1)))
+    assert sync.mapping.drift == 0
+
+
+def test_logged_mappings_convert_marker_times():
+    early = ClockMapping(ref=0, offset=1000.0, drift=0.0, rtt=50)
+    late = ClockMapping(ref=10e6, offset=3000.0, drift=0.0, rtt=50)
+    comments = "#Recorded at test\n" + early.log_line(5) + "\n" + \
+               late.log_line(10000) + "\n"
+    mappings = read_clock_mappings(comments)
+    assert [t for t, _ in mappings] == [5, 10000]
+    assert mappings[1][1] == late
+    np.testing.assert_allclose(to_sender_time([0, 9000, 12000], mappings),
+                               [-1.0, 8999.0, 11997.0])
+    with pytest.raises(RuntimeError):
+        to_sender_time([0], [])
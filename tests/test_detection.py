@@ -0,0 +1,151 @@
+import numpy as np
+
+from forceDAQ._lib.detection import DetectionEngine, ThresholdClassifier, \
+    LEVEL_CHANGE, RESPONSE_MINMAX
+from forceDAQ._lib.types import Thresholds
+
+THRESHOLDS = [-5, 0, 5]
+
+
+def _signal(n=5000, seed=2):
+    rng = np.random.RandomState(seed)
+    times = np.arange(n) * 1.0
+    return times, 8 * np.sin(times / 150.0) + rng.normal(0, 1, n)
+
+
+def _run(engine, times, values, block_sizes, starts):
+    """process blocks, detections start before the given sample indices"""
+    events = []
+    i = 0
+    sizes = iter(block_sizes * len(times))
+    while i < len(times):
+        for idx, mode in starts:
+            if idx == i:
+                if mode == LEVEL_CHANGE:
+                    engine.start_level_change_detection()
+                else:
+                    engine.start_response_minmax_detection(n_samples=20)
+        n = next(sizes)
+        nxt = [idx for idx, _ in starts if idx > i]
+        if len(nxt) > 0:
+            n = min(n, min(nxt) - i)
+        events.extend(engine.process(times[i:i + n], values[i:i + n]))
+        i += n
+    return events
+
+
+def test_idle_blocks_do_not_change_detection():
+    times, values = _signal()
+    starts = [(0, LEVEL_CHANGE), (700, RESPONSE_MINMAX),
+              (2500, LEVEL_CHANGE), (4000, RESPONSE_MINMAX)]
+    reference = _run(DetectionEngine(THRESHOLDS, moving_average_size=5),
+                     times, values, [1], starts)
+    assert len(reference) >= 4
+    for sizes in ([7], [100], [1, 13, 64]):
+        engine = DetectionEngine(THRESHOLDS, moving_average_size=5)
+        assert _run(engine, times, values, sizes, starts) == reference
+
+
+def test_current_level_while_idle():
+    engine = DetectionEngine(THRESHOLDS, moving_average_size=4)
+    assert engine.current_level is None
+    engine.process([0, 1, 2], np.array([[0, 0, x, 0, 0, 0]
+                                        for x in (10, 10, 10)]))
+    assert not engine.is_detecting
+    engine.update([-20, -20, -20])
+    # moving average of the last 4 values: -12.5
+    assert engine.current_level == 0
+
+
+class _ReferenceClassifier(object):
+    """per-sample reference of ThresholdClassifier (one channel)"""
+
+    def __init__(self, thresholds):
+        self.thresholds = sorted(thresholds)
+        self.state = None
+
+    def level(self, value):
+        return sum(t <= value for t in self.thresholds)
+
+    def start(self, mode, start_level, n_samples=None):
+        self.state = [mode, start_level, n_samples, None, None, None]
+
+    def process(self, value):
+        if self.state is None:
+            return None
+        mode, start, n_samples, remaining, lmin, lmax = self.state
+        level = self.level(value)
+        if remaining is None:
+            if level == start:
+                return None
+            if mode == LEVEL_CHANGE:
+                self.state = None
+                return LEVEL_CHANGE, level
+            remaining, lmin, lmax = n_samples, start, start
+        lmin, lmax = min(lmin, level), max(lmax, level)
+        remaining -= 1
+        if remaining == 0:
+            self.state = None
+            return RESPONSE_MINMAX, (lmin, lmax)
+        self.state = [mode, start, n_samples, remaining, lmin, lmax]
+        return None
+
+
+def test_classifier_matches_per_sample_reference():
+    n_channels = 4
+    thresholds = [-20, -5, 0, 5, 20]
+    rng = np.random.RandomState(7)
+    # mean-reverting random walks
+    noise = rng.normal(0, 3, (40000, n_channels))
+    values = np.zeros(noise.shape)
+    for i in range(1, len(values)):
+        values[i] = 0.95 * values[i - 1] + noise[i]
+
+    classifier = ThresholdClassifier(thresholds, n_channels=n_channels)
+    reference = [_ReferenceClassifier(thresholds)
+                 for _ in range(n_channels)]
+    events = []
+    expected = []
+    i = 0
+    while i < len(values):
+        # start detections of idle channels
+        for ch in range(n_channels):
+            if reference[ch].state is None and rng.uniform() < 0.3:
+                level = reference[ch].level(values[max(i - 1, 0), ch])
+                if rng.uniform() < 0.5:
+                    classifier.start_level_change_detection(ch, level)
+                    reference[ch].start(LEVEL_CHANGE, level)
+                else:
+                    n = rng.randint(1, 30)
+                    classifier.start_response_minmax_detection(ch, level, n)
+                    reference[ch].start(RESPONSE_MINMAX, level, n)
+        n = rng.randint(1, 50)
+        block = values[i:i + n]
+        for ch, idx, event, value in classifier.process(
+                                            classifier.get_level(block)):
+            events.append((ch, i + idx, event, value))
+        for k, x in enumerate(block):
+            for ch in range(n_channels):
+                evt = reference[ch].process(x[ch])
+                if evt is not None:
+                    expected.append((ch, i + k) + evt)
+        i += n
+
+    assert len(expected) > 1000
+    assert sorted(events) == sorted(expected)
+    assert {e[2] for e in events} == {LEVEL_CHANGE, RESPONSE_MINMAX}
+
+
+def test_get_level_is_thresholds_get_level():
+    thresholds = Thresholds([3, -1, 7.5, 0])
+    classifier = ThresholdClassifier(thresholds.thresholds)
+    values = np.array([-2, -1, -0.5, 0, 1, 3, 5, 7.5, 8])
+    assert list(classifier.get_level(values)) == \
+           [thresholds.get_level(x) for x in values]
+
+
+def test_get_level_without_thresholds():
+    assert Thresholds([]).get_level(-3.0) == 1
+    assert Thresholds([]).get_level(100) == 1
+    classifier = ThresholdClassifier([])
+    assert list(classifier.get_level(np.array([-3.0, 0, 100]))) == [1, 1, 1]
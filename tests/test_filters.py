@@ -0,0 +1,181 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib.filters import FilterSettings, FilterPipeline, \
+    SOSFilter, Decimator, lowpass_sos, notch_sos
+from forceDAQ._lib.processing import SampleBlock, StageContext
+from forceDAQ._lib.types import ForceData, FilteredForceData
+from forceDAQ.force.stages import FilterStage
+
+RATE = 1000
+
+
+def _amplitude(sos, freq, n_channels=1):
+    """steady-state amplitude of a filtered sine"""
+    t = np.arange(4 * RATE) / float(RATE)
+    x = np.sin(2 * np.pi * freq * t)[:, np.newaxis]
+    y = SOSFilter(sos, n_channels=n_channels).process(x)[2 * RATE:]
+    return np.sqrt(2 * np.mean(y ** 2))
+
+
+@pytest.mark.parametrize("order", [2, 3, 4])
+def test_lowpass_response(order):
+    sos = lowpass_sos(50, RATE, order=order)
+    y = SOSFilter(sos, n_channels=1).process(np.full((100, 1), 3.0))
+    np.testing.assert_allclose(y, 3.0)  # unity gain, steady-state start
+    assert _amplitude(sos, 5) == pytest.approx(1, abs=1e-3)
+    assert _amplitude(sos, 50) == pytest.approx(np.sqrt(0.5), abs=1e-2)
+    # Butterworth: -6 dB per octave and order (bilinear: even more)
+    assert _amplitude(sos, 200) < 0.5 ** (2 * order)
+
+
+def test_notch_response():
+    sos = notch_sos(50, RATE, q=30)
+    assert _amplitude(sos, 50) < 1e-3
+    assert _amplitude(sos, 10) == pytest.approx(1, abs=1e-3)
+    assert _amplitude(sos, 100) == pytest.approx(1, abs=1e-2)
+
+
+def test_block_processing_is_consistent():
+    rng = np.random.RandomState(6)
+    x = rng.normal(5, 1, (2000, 6))
+    settings = FilterSettings(lowpass=40, notch=50, decimation=3)
+    times = np.arange(len(x))
+    idx, y = FilterPipeline(settings, rate=RATE).process(times, x)
+
+    filters = FilterPipeline(settings, rate=RATE)
+    blocks = []
+    i = 0
+    while i < len(x):
+        n = rng.randint(1, 40)
+        blocks.append(filters.process(times[i:i + n], x[i:i + n]))
+        i += n
+    np.testing.assert_array_equal(np.concatenate([b[0] for b in blocks]),
+                                  idx)
+    np.testing.assert_allclose(np.vstack([b[1] for b in blocks]), y,
+                               rtol=1e-12)
+    np.testing.assert_array_equal(idx, np.arange(0, len(x), 3))
+
+
+def test_decimator_phase_between_blocks():
+    dec = Decimator(4)
+    idx = [dec.indices(n) for n in (3, 1, 6, 2, 9)]
+    assert [list(x) for x in idx] == [[0], [], [0, 4], [], [0, 4, 8]]
+    dec.reset()
+    assert list(dec.indices(5)) == [0, 4]
+
+
+def test_decimation_requires_lowpass():
+    with pytest.raises(RuntimeError):
+        FilterPipeline(FilterSettings(decimation=2), rate=RATE)
+    with pytest.raises(RuntimeError):
+        FilterPipeline(FilterSettings(lowpass=300, decimation=2), rate=RATE)
+
+
+
+def _mark(sample):
+    # as the sample marker assignment in SensorProcess
+    sample.n_markers += 1
+    sample.trigger[0] = sample.n_markers
+
+
+def _filtered(raw_samples):
+    d = FilteredForceData(time=raw_samples[-1].time, forces=[0] * 6)
+    d.raw_samples = list(raw_samples)
+    return d
+
+
+def test_filtered_sample_combines_markers():
+    raw = [ForceData(time=i, forces=[0] * 6) for i in range(4)]
+    raw[3].trigger[1] = -5.0  # analog pulse
+    d = _filtered(raw)
+    assert d.n_markers == 0
+    assert d.trigger == [0, -5.0]
+    _mark(raw[0])
+    _mark(raw[2])
+    _mark(raw[2])  # markers assigned after filtering
+    assert d.n_markers == 3
+    assert d.trigger == [3, -5.0]
+
+
+def test_filtered_sample_analog_trigger1_without_markers():
+    raw = [ForceData(time=i, forces=[0] * 6) for i in range(4)]
+    raw[1].trigger[0] = -2.0  # analog value, no marker
+    raw[2].trigger[0] = 1.5
+    d = _filtered(raw)
+    assert d.trigger[0] == -2.0
+    _mark(raw[3])
+    assert d.trigger[0] == 1
+
+
+def test_pickled_filtered_sample_keeps_trigger():
+    raw = [ForceData(time=i, forces=[0] * 6) for i in range(4)]
+    _mark(raw[1])
+    _mark(raw[2])
+    raw[0].trigger[1] = 2.0
+    d = pickle.loads(pickle.dumps(_filtered(raw)))
+    assert d.raw_samples == []
+    assert d.n_markers == 2
+    assert d.trigger == [2, 2.0]
+
+
+def _filter_stage(decimation):
+    buffer = []
+    stage = FilterStage(FilterSettings(lowpass=20, decimation=decimation),
+                        rate=RATE)
+    stage.setup(StageContext(device_id=1, rate=RATE, timer=None,
+                             buffer=buffer))
+    return stage, buffer
+
+
+def _samples(n, seed=4):
+    rng = np.random.RandomState(seed)
+    samples = [ForceData(time=i, forces=list(rng.normal(0, 1, 6)),
+                         sample_index=i) for i in range(n)]
+    for i in range(0, n, 50):
+        samples[i].trigger[1] = 5.0  # analog pulse of one sample
+    return samples
+
+
+def _process(stage, samples, block_sizes):
+    stage.start()
+    i = 0
+    sizes = iter(block_sizes * len(samples))
+    while i < len(samples):
+        n = next(sizes)
+        stage.transform(SampleBlock(samples[i:i + n]))
+        i += n
+    stage.stop()
+
+
+def test_decimation_keeps_markers_of_dropped_samples():
+    samples = _samples(1003)
+    stage, buffer = _filter_stage(decimation=4)
+    rng = np.random.RandomState(5)
+    marked = rng.choice(len(samples), 300, replace=True)
+    for i in marked[:150]:
+        _mark(samples[i])
+    _process(stage, samples, [1, 3, 10, 37])
+    for i in marked[150:]:
+        # markers assigned after filtering (see SampleMarkerStage)
+        _mark(samples[i])
+
+    assert len(buffer) == 251
+    assert sum(d.n_markers for d in buffer) == len(marked)
+    assert sum(d.trigger[0] for d in buffer) == len(marked)
+    # analog trigger: maximum of the window
+    assert sum(d.trigger[1] == 5.0 for d in buffer) == 21
+    for d in buffer:
+        raw = samples[d.sample_index - 3:d.sample_index + 1]
+        if d.sample_index not in (0, 1000):
+            assert d.trigger[0] == sum(s.n_markers for s in raw)
+
+
+def test_no_decimation_shares_trigger():
+    samples = _samples(100)
+    stage, buffer = _filter_stage(decimation=1)
+    _process(stage, samples, [7])
+    samples[10].trigger[0] = 2
+    assert [d.trigger for d in buffer] == [s.trigger for s in samples]
@@ -0,0 +1,49 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from forceDAQ.data_handling import read_raw_data_as_arrays
+from forceDAQ.data_handling.ft_conversion import convert_voltage_file
+
+CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), "..",
+                                "FT34108.cal")
+
+N_SAMPLES = 2000
+
+
+def _voltage_file(folder, time_unit):
+    """voltage recording of 2000 s (one sample per second)"""
+    ns_per_unit = {"ns": 1, "ms": 1000000}[time_unit]
+    rng = np.random.RandomState(1)
+    filename = os.path.join(str(folder), "voltages_{}.csv.gz".format(
+                                                                time_unit))
+    with gzip.open(filename, "wt") as fl:
+        fl.write("#Recorded at test\n")
+        if time_unit != "ms":
+            fl.write("# Time unit: {}\n".format(time_unit))
+        fl.write("time,delay,Fx,Fy,Fz,Tx,Ty,Tz,trigger1\n")
+        fl.write("#T,{},started:1\n".format(100 * 1000000 // ns_per_unit))
+        for i in range(N_SAMPLES):
+            t_ms = 1000 + i * 1000
+            fl.write("{},0,{},{}\n".format(t_ms * 1000000 // ns_per_unit,
+                        ",".join("{:.4f}".format(x)
+                                 for x in rng.normal(0, 0.01, 6)), i % 3))
+    return filename
+
+
+@pytest.mark.parametrize("time_unit", ["ns", "ms"])
+def test_convert_voltage_file_round_trip(tmp_path, time_unit):
+    filename = _voltage_file(tmp_path, time_unit)
+    raw, _, raw_daq, _ = read_raw_data_as_arrays(filename)
+
+    converted = convert_voltage_file(filename, CALIBRATION_FILE)
+    data, _, daq, comments = read_raw_data_as_arrays(converted)
+
+    assert len(data["time"]) == N_SAMPLES
+    np.testing.assert_array_equal(data["time"], raw["time"])
+    assert len(np.unique(data["time"])) == N_SAMPLES
+    np.testing.assert_array_equal(daq["time"], raw_daq["time"])
+    np.testing.assert_array_equal(data["trigger1"], raw["trigger1"])
+    assert "# Converted:" in comments
@@ -0,0 +1,135 @@
+import ctypes as ct
+import time
+from multiprocessing import sharedctypes
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib.processing import ProcessingPipeline, ProcessingStage, \
+    SampleBlock, StageContext
+from forceDAQ._lib.timer import Timer
+from forceDAQ._lib.types import ForceData
+from forceDAQ.force.sensor import Sensor, SensorSettings
+from forceDAQ.force.sensor_process import SensorProcess
+from forceDAQ.force.stages import RecordStage
+
+
+def _samples(n, first=0):
+    return [ForceData(time=t, forces=[t, 0, 2 * t, 0, 0, 0],
+                      sample_index=t) for t in range(first, first + n)]
+
+
+class _Scale(ProcessingStage):
+
+    def transform(self, block):
+        return SampleBlock([ForceData(time=d.time,
+                                      forces=[x * 10 for x in d.forces])
+                            for d in block.samples])
+
+
+class _DropAll(ProcessingStage):
+
+    def transform(self, block):
+        return SampleBlock([])
+
+
+class _Collect(ProcessingStage):
+
+    def __init__(self):
+        self.blocks = []
+        self.started = 0
+
+    def start(self):
+        self.started += 1
+
+    def transform(self, block):
+        self.blocks.append(block)
+        self.context.send(b"n=%d" % len(block))
+        return block
+
+
+class _SendQueue(list):
+
+    def put(self, data):
+        self.append(data)
+
+
+class _CountSamples(ProcessingStage):
+    """user stage: counts the samples in shared memory"""
+
+    def __init__(self):
+        self.n = sharedctypes.RawValue(ct.c_uint64, 0)
+
+    def transform(self, block):
+        self.n.value += len(block)
+        return block
+
+
+def _context(buffer):
+    return StageContext(device_id=1, rate=1000, timer=Timer(),
+                        buffer=buffer, udp_send_queue=_SendQueue())
+
+
+def test_sample_block_arrays():
+    block = SampleBlock(_samples(3))
+    assert len(block) == 3
+    np.testing.assert_array_equal(block.times, [0, 1, 2])
+    np.testing.assert_array_equal(block.forces[:, 2], [0, 2, 4])
+    assert block.trigger.shape == (3, 2)
+
+
+def test_pipeline_passes_blocks_through_stages():
+    buffer = []
+    collect = _Collect()
+    pipeline = ProcessingPipeline([RecordStage(), _Scale(), collect])
+    context = _context(buffer)
+    pipeline.setup(context)
+    pipeline.start()
+    assert collect.started == 1
+    samples = _samples(5)
+    pipeline.process(SampleBlock(samples))
+    pipeline.process(SampleBlock(_samples(3, first=5)))
+    assert buffer[:5] == samples  # recorded before scaling
+    np.testing.assert_array_equal(collect.blocks[0].forces[:, 2],
+                                  [0, 20, 40, 60, 80])
+    assert context.udp_send_queue == [b"n=5", b"n=3"]
+    timing = pipeline.timing()
+    assert [(name, n) for name, n, _, _ in timing] == \
+           [("RecordStage", 2), ("_Scale", 2), ("_Collect", 2)]
+    assert all(maximum >= mean >= 0 for _, _, mean, maximum in timing)
+    pipeline.reset_timing()
+    assert pipeline.timing()[0][1] == 0
+
+
+def test_empty_block_stops_pipeline():
+    collect = _Collect()
+    pipeline = ProcessingPipeline([_DropAll(), collect])
+    pipeline.setup(_context([]))
+    assert len(pipeline.process(SampleBlock(_samples(4)))) == 0
+    assert collect.blocks == []
+    assert [n for _, n, _, _ in pipeline.timing()] == [1, 0]
+
+
+def test_user_stage_in_sensor_process():
+    if Sensor.DAQ_TYPE != "dummy":
+        pytest.skip("requires the dummy DAQ")
+    counter = _CountSamples()
+    process = SensorProcess(SensorSettings(device_id=1, sensor_name="test",
+                                           calibration_folder=".",
+                                           rate=1000, convert_to_FT=False),
+                            stages=[counter])
+    process.start()
+    try:
+        time.sleep(0.5)  # run() resets the polling state at start
+        process.start_polling()
+        time.sleep(0.3)
+        process.pause_polling()
+        time.sleep(0.1)
+        samples = [d for d in process.get_buffer()
+                   if isinstance(d, ForceData)]
+        assert counter.n.value == len(samples) > 100
+        names = [x[0] for x in process.get_stage_timing()]
+        assert names.index("_CountSamples") > names.index("RecordStage")
+        assert names[-1] == "DetectionStage"
+    finally:
+        process.join()
@@ -0,0 +1,71 @@
+import gzip
+import json
+import os
+
+from forceDAQ.data_handling.quality_report import QualitySettings, \
+    file_quality, quality_report, save_quality_report
+
+
+def _recording(folder, name, missing=(), saturated=(), events=True):
+    """two recording periods (1000 and 500 samples at 1 kHz)"""
+    filename = os.path.join(str(folder), name)
+    with gzip.open(filename, "wt") as fl:
+        fl.write("#Recorded at test\n")
+        fl.write("# Sensor: id=1, name=x, cal-file=None\n")
+        fl.write("time,delay,Fz,trigger1\n")
+        for start, n in ((100, 1000), (3000, 500)):
+            if events or start == 100:
+                fl.write("#T,{},started:1\n".format(start))
+            for i in range(start, start + n):
+                if i in missing:
+                    continue
+                fz = 10.0 if i in saturated else 1.0
+                fl.write("{},{},{:.4f},0\n".format(i, i % 10, fz))
+            if events or start == 100:
+                fl.write("#T,{},pause:1\n".format(start + n - 1))
+    return filename
+
+
+def test_gaps_delays_and_saturation(tmp_path):
+    filename = _recording(tmp_path, "a.csv.gz", missing=range(500, 505),
+                          saturated=(200, 3100))
+    report = file_quality(filename, QualitySettings(rate=1000))
+    sensor = report["sensors"]["1"]
+    assert sensor["n_samples"] == 1495
+    assert sensor["n_gaps"] == 1
+    assert sensor["max_gap"] == 6.0
+    assert sensor["missing_samples"] == 5
+    assert sensor["interval_histogram"][1] == 1492
+    assert sensor["interval_histogram"][6] == 1
+    assert sensor["delay_max"] == 9.0
+    assert 4.0 <= sensor["delay_percentiles"]["50"] <= 5.0
+    assert sensor["n_periods"] == 2
+    assert sensor["periods_consistent"]
+    assert sensor["period_sample_difference"] == [-5, 0]
+    assert sensor["saturated_samples"]["Fz"] == 2
+
+
+def test_summary_of_multiple_files(tmp_path):
+    _recording(tmp_path, "good.csv.gz")
+    _recording(tmp_path, "missing_events.csv.gz", missing=(150,),
+               events=False)
+    _recording(tmp_path, "saturated.csv.gz", saturated=(3200,))
+    with open(os.path.join(str(tmp_path), "broken.csv"), "w") as fl:
+        fl.write("no data\n")
+
+    report = quality_report(str(tmp_path), n_processes=2)
+    summary = report["summary"]
+    assert summary["n_files"] == 4
+    assert summary["n_errors"] == 1
+    assert summary["n_samples"] == 3 * 1500 - 1
+    assert summary["missing_samples"] == 1
+    assert summary["delay_max"] == 9.0
+    assert [os.path.basename(f) for f in summary["inconsistent_files"]] == \
+           ["missing_events.csv.gz"]
+    assert [os.path.basename(f) for f in summary["saturated_files"]] == \
+           ["saturated.csv.gz"]
+
+    output = os.path.join(str(tmp_path), "report.json")
+    save_quality_report(report, output)
+    with open(output) as fl:
+        assert json.load(fl)["summary"] == summary
@@ -0,0 +1,104 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib.timer import Timer
+from forceDAQ._lib.types import ForceData, UDPData, DAQEvents
+from forceDAQ.data_handling import read_raw_data, read_raw_data_as_arrays
+from forceDAQ.data_handling.convert import convert_raw_data, Method, \
+    converted_filename
+
+N_SAMPLES = 3000
+NS_PER_UNIT = {"ns": 1, "ms": 1000000}
+
+
+def _raw_file(folder, time_unit):
+    """recording of 3 s with jittered integer ms timestamps"""
+    f = 1000000 // NS_PER_UNIT[time_unit]
+    filename = os.path.join(str(folder), "rec_{}.csv.gz".format(time_unit))
+    with gzip.open(filename, "wt") as fl:
+        fl.write("#Recorded at test\n")
+        fl.write("# Sensor: id=1, name=x, cal-file=None\n")
+        if time_unit != "ms":
+            fl.write("# Time unit: {}\n".format(time_unit))
+        fl.write("time,delay,Fz,trigger1\n")
+        fl.write("#T,{},started:1\n".format(100 * f))
+        for i in range(N_SAMPLES):
+            jitter = [0, 0, 1, 0][i % 4] if i % 50 else 3
+            fl.write("{}, 0,{:.4f},{}\n".format((100 + i + jitter) * f,
+                                                i / 10.0, int(i % 7 == 0)))
+        fl.write("#UDP,{:.10g},marker\n".format(150.5 * f))
+        fl.write("#T,{},pause:1\n".format(3100 * f))
+    return filename
+
+
+@pytest.mark.parametrize("time_unit", ["ns", "ms"])
+def test_read_arrays_in_all_time_units(tmp_path, time_unit):
+    filename = _raw_file(tmp_path, time_unit)
+    data, udp, daq, comments = read_raw_data_as_arrays(filename)
+    assert len(data["time"]) == N_SAMPLES
+    assert data["time"][:3].tolist() == [103, 101, 103]
+    assert udp["time"].tolist() == [150.5] and udp["value"] == ["marker"]
+    assert daq["time"].tolist() == [100, 3100]
+    assert daq["value"] == ["started:1", "pause:1"]
+
+    data_ns = read_raw_data_as_arrays(filename, time_unit="ns")[0]
+    np.testing.assert_array_equal(data_ns["time"], data["time"] * 1000000)
+    data_us = read_raw_data_as_arrays(filename, time_unit="us")[0]
+    np.testing.assert_array_equal(data_us["time"], data["time"] * 1000)
+
+    # line-based reader: same values, strings in file unit
+    text = read_raw_data(filename)[0]
+    np.testing.assert_array_equal(np.array(text["time"], dtype=float),
+                    data["time"] * 1000000 / NS_PER_UNIT[time_unit])
+    np.testing.assert_array_equal(np.array(text["Fz"], dtype=float),
+                                  data["Fz"])
+
+
+def test_converted_files_do_not_depend_on_time_unit(tmp_path):
+    converted = {}
+    for time_unit in ("ns", "ms"):
+        filename = _raw_file(tmp_path, time_unit)
+        convert_raw_data(filename, Method(1), save_time_adjustments=True)
+        folder, name = converted_filename(filename)
+        converted[time_unit] = read_raw_data_as_arrays(
+                                                os.path.join(folder, name))
+        data, _, _, comments = converted[time_unit]
+        ns_per_unit = NS_PER_UNIT[time_unit]
+        if time_unit == "ns":
+            assert "# Time unit: ns" in comments
+        # adjustment in file unit
+        f = 1000000 // ns_per_unit
+        assert data["time_adjustment"][:3].tolist() == [3 * f, 0, f]
+
+    ns, ms = converted["ns"], converted["ms"]
+    np.testing.assert_array_equal(ns[0]["time"], 100 + np.arange(N_SAMPLES))
+    for k in ("time", "Fz", "trigger1"):
+        np.testing.assert_array_equal(ns[0][k], ms[0][k])
+    np.testing.assert_array_equal(ns[1]["time"], ms[1]["time"])
+    np.testing.assert_array_equal(ns[2]["time"], ms[2]["time"])
+
+
+def test_time_properties_are_float_ms():
+    d = ForceData(time_ns=1500001)
+    assert d.time == 1.500001
+    d.time = 2.25
+    assert d.time_ns == 2250000
+    udp = UDPData(string=b"x", time_ns=1234567)
+    assert udp.time == 1.234567 and udp.time_us == 1234
+    assert DAQEvents(time_ns=5000000, code="x").time == 5.0
+
+
+def test_sample_string_keeps_sub_millisecond_time():
+    line = str(ForceData(time_ns=1500001, device_id=1))
+    assert line.startswith("1,1.500,")
+
+
+def test_timer_time_is_float_ms():
+    timer = Timer()
+    t_ns = timer.time_ns
+    t = timer.time
+    assert isinstance(t, float)
+    assert t_ns / 1e6 <= t < t_ns / 1e6 + 100
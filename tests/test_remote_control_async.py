@@ -0,0 +1,326 @@
+import asyncio
+import time
+from ctypes import c_bool
+from multiprocessing import sharedctypes
+
+from forceDAQ import __version__ as forceDAQVersion
+from forceDAQ._lib import wire_protocol
+from forceDAQ._lib.detection import LEVEL_CHANGE, RESPONSE_MINMAX
+from forceDAQ._lib.processing import SampleBlock, StageContext
+from forceDAQ._lib.shared_ring import SharedRingBuffer
+from forceDAQ._lib.streaming import STREAM_VALUES
+from forceDAQ._lib.timer import app_timer
+from forceDAQ._lib.types import ForceData, GUIRemoteControlCommands as Command
+from forceDAQ._lib.udp_connection import SendQueue
+from forceDAQ.force.stages import DetectionStage
+from forceDAQ.remote_control_async import RemoteControlClient, \
+    RemoteControlServerProtocol, RecorderCommandHandler
+
+SERVER_IP = "127.0.0.1"
+CLIENT_IP = "127.0.0.2"
+PORT = 5117
+
+
+class _Handler(object):
+    """replies the version after a delay, doesn't reply to GET_FX1"""
+
+    def __init__(self, delays):
+        self.delays = list(delays)
+        self.wire_version = wire_protocol.PICKLE
+
+    def process_command(self, udp_data):
+        cmd = udp_data.byte_string
+        if cmd.startswith(Command.PROTOCOL):
+            self.wire_version = wire_protocol.negotiate_version(
+                                                cmd[len(Command.PROTOCOL):])
+            return Command.VALUE + wire_protocol.encode(self.wire_version)
+        elif cmd == Command.GET_VERSION:
+            return self._delayed(self.delays.pop(0))
+        elif cmd == Command.GET_FZ1:
+            return Command.VALUE + wire_protocol.encode(1.5)
+        return None
+
+    async def _delayed(self, delay):
+        await asyncio.sleep(delay)
+        return Command.VALUE + wire_protocol.encode("delay {}".format(delay))
+
+    def process_marker(self, udp_data):
+        pass
+
+
+def _run(coro):
+    return asyncio.new_event_loop().run_until_complete(coro)
+
+
+async def _with_server(handler, client_coro):
+    loop = asyncio.get_running_loop()
+    transport, _ = await loop.create_datagram_endpoint(
+        lambda: RemoteControlServerProtocol(handler),
+        local_addr=(SERVER_IP, PORT))
+    rc = RemoteControlClient(SERVER_IP, udp_port=PORT, ip=CLIENT_IP)
+    try:
+        assert await rc.connect()
+        return await client_coro(rc)
+    finally:
+        rc.close()
+        transport.close()
+        await asyncio.sleep(0.01)  # connection_lost of the server
+
+
+def test_late_reply_is_dropped():
+    async def client(rc):
+        assert await rc.negotiate_protocol() == wire_protocol.PROTOCOL_VERSION
+        assert rc.request_ids
+        # first reply arrives after the timeout
+        assert await rc.get_data(Command.GET_VERSION, timeout=0.1) is None
+        late = rc.get_data(Command.GET_VERSION, timeout=1.0)
+        return await late, await rc.get_data(Command.GET_FZ1)
+
+    version, fz = _run(_with_server(_Handler(delays=[0.3, 0.4]), client))
+    assert version == "delay 0.4"
+    assert fz == 1.5
+
+
+def test_unanswered_request_does_not_shift_replies():
+    async def client(rc):
+        await rc.negotiate_protocol()
+        assert await rc.get_data(Command.GET_FX1, timeout=0.1) is None
+        return await rc.get_data(Command.GET_FZ1)
+
+    assert _run(_with_server(_Handler(delays=[]), client)) == 1.5
+
+
+class _Recorder(object):
+
+    force_sensor_processes = []
+
+    def pause_recording(self):
+        time.sleep(0.3)  # blocking, as DataRecorder.pause_recording
+
+
+def test_pause_does_not_stall_server():
+    async def client(rc):
+        await rc.negotiate_protocol()
+        rc.send(Command.PAUSE)
+        await asyncio.sleep(0.05)
+        loop = asyncio.get_running_loop()
+        t = loop.time()
+        version = await rc.get_data(Command.GET_VERSION, timeout=0.2)
+        latency = loop.time() - t
+        event, _ = await rc.wait_event([Command.FEEDBACK_PAUSED], timeout=1)
+        return version, latency, event
+
+    version, latency, event = _run(_with_server(
+                    RecorderCommandHandler(_Recorder()), client))
+    assert version == forceDAQVersion
+    assert latency < 0.2
+    assert event == Command.FEEDBACK_PAUSED
+
+
+def test_request_framing():
+    data = wire_protocol.encode_request(70000, Command.GET_FZ1)
+    assert wire_protocol.decode_request(data) == (70000 & 0xFFFF,
+                                                  Command.GET_FZ1)
+    assert wire_protocol.decode_request(Command.GET_FZ1) == (None,
+                                                             Command.GET_FZ1)
+    reply = wire_protocol.encode_reply(3, Command.VALUE + b"x")
+    assert wire_protocol.decode_reply(reply) == (3, Command.VALUE + b"x")
+    assert wire_protocol.encode_reply(None, b"x") == b"x"
+
+
+class _SensorProcess(object):
+    """sensor process with the detection stage running in the test"""
+
+    def __init__(self, send_queue, rate=1000):
+        self.stream_buffer = SharedRingBuffer(100, STREAM_VALUES)
+        self.detection = DetectionStage(sharedctypes.RawValue(c_bool, False))
+        self.detection.setup(StageContext(device_id=0, rate=rate,
+                                          timer=app_timer, buffer=[],
+                                          udp_send_queue=send_queue))
+        self.rate = rate
+        self.time = 0
+
+    def feed(self, fz, n=10):
+        samples = []
+        for _ in range(n):
+            self.time += 1000.0 / self.rate
+            samples.append(ForceData(time=self.time, forces=[0, 0, fz, 0, 0, 0]))
+        for d in samples:
+            self.stream_buffer.write([d.time] + d.forces + [0, 0])
+        self.detection.transform(SampleBlock(samples))
+
+    def get_force(self, parameter_id):
+        return self.stream_buffer.latest()[1][1 + parameter_id]
+
+    def set_thresholds(self, thresholds, parameter=2, moving_average_size=5):
+        self.detection.command(("thresholds", thresholds, parameter,
+                                moving_average_size))
+
+    def start_level_change_detection(self, channel=0,
+                                     wire_version=wire_protocol.PICKLE):
+        self.detection.command((LEVEL_CHANGE, channel, wire_version))
+
+    def start_response_minmax_detection(self, duration, channel=0,
+                                        wire_version=wire_protocol.PICKLE):
+        n_samples = int(duration * self.rate / 1000)
+        self.detection.command((RESPONSE_MINMAX, channel, wire_version,
+                                n_samples))
+
+
+class _DetectionRecorder(object):
+
+    def __init__(self, n_sensors=1):
+        self.send_queue = SendQueue()
+        self.force_sensor_processes = [_SensorProcess(self.send_queue)
+                                       for _ in range(n_sensors)]
+        self.filenames = []
+        self.is_recording = False
+
+    def start_recording(self):
+        time.sleep(0.3)  # blocking, as DataRecorder.start_recording
+        self.is_recording = True
+
+    def open_data_file(self, filename):
+        self.filenames.append(filename)
+
+
+async def _set_thresholds(rc, thresholds, baseline_processes):
+    rc.send(Command.SET_THRESHOLDS +
+            wire_protocol.encode(thresholds, rc.wire_version))
+    await _processed(rc)
+    for fsp in baseline_processes:
+        fsp.feed(0.0)
+
+
+async def _processed(rc):
+    """waits until the previous commands have been processed"""
+    assert await rc.get_data(Command.GET_VERSION) == forceDAQVersion
+
+
+def test_level_change_detection():
+    recorder = _DetectionRecorder()
+    fsp = recorder.force_sensor_processes[0]
+
+    async def client(rc):
+        # example of the module docstring
+        await rc.negotiate_protocol()
+        await _set_thresholds(rc, [-5.0, 5.0], [fsp])
+        rc.send(Command.SET_LEVEL_CHANGE_DETECTION)
+        await _processed(rc)
+        fsp.feed(10.0)
+        return await rc.wait_event([Command.CHANGED_LEVEL], timeout=2.0)
+
+    event, level = _run(_with_server(RecorderCommandHandler(recorder), client))
+    assert event == Command.CHANGED_LEVEL
+    assert level == 2
+
+
+def test_level_change_detection_second_sensor():
+    recorder = _DetectionRecorder(n_sensors=2)
+    fsp = recorder.force_sensor_processes[1]
+
+    async def client(rc):
+        await rc.negotiate_protocol()
+        await _set_thresholds(rc, [-5.0, 5.0], [fsp])
+        rc.send(Command.SET_LEVEL_CHANGE_DETECTION2)
+        await _processed(rc)
+        fsp.feed(-10.0)
+        return await rc.wait_event([Command.CHANGED_LEVEL2], timeout=2.0)
+
+    assert _run(_with_server(RecorderCommandHandler(recorder), client)) == \
+           (Command.CHANGED_LEVEL2, 0)
+
+
+def test_no_detection_without_thresholds():
+    recorder = _DetectionRecorder()
+    fsp = recorder.force_sensor_processes[0]
+    fsp.feed(0.0)
+
+    async def client(rc):
+        await rc.negotiate_protocol()
+        rc.send(Command.SET_LEVEL_CHANGE_DETECTION)
+        await _processed(rc)
+        fsp.feed(10.0)
+        return await rc.wait_event(timeout=0.3)
+
+    assert _run(_with_server(RecorderCommandHandler(recorder), client)) == \
+           (None, None)
+    assert fsp.detection.engine is None
+
+
+def test_response_minmax_detection():
+    recorder = _DetectionRecorder(n_sensors=2)
+    fsp1, fsp2 = recorder.force_sensor_processes
+
+    async def client(rc):
+        await rc.negotiate_protocol()
+        await _set_thresholds(rc, [-5.0, 5.0], [fsp1, fsp2])
+        rc.send(Command.SET_RESPONSE_MINMAX_DETECTION +
+                wire_protocol.encode(20, rc.wire_version))
+        rc.send(Command.SET_RESPONSE_MINMAX_DETECTION2 +
+                wire_protocol.encode(20, rc.wire_version))
+        await _processed(rc)
+        fsp1.feed(10.0, n=25)
+        fsp2.feed(-10.0, n=25)
+        return (await rc.wait_event([Command.RESPONSE_MINMAX], timeout=2.0),
+                await rc.wait_event([Command.RESPONSE_MINMAX2], timeout=2.0))
+
+    event1, event2 = _run(_with_server(RecorderCommandHandler(recorder),
+                                       client))
+    assert event1 == (Command.RESPONSE_MINMAX, (1, 2))
+    assert event2 == (Command.RESPONSE_MINMAX2, (0, 1))
+
+
+def test_get_threshold_level():
+    recorder = _DetectionRecorder(n_sensors=2)
+    recorder.force_sensor_processes[0].feed(10.0)
+    recorder.force_sensor_processes[1].feed(-10.0)
+
+    async def client(rc):
+        await rc.negotiate_protocol()
+        no_thresholds = await rc.get_data(Command.GET_THRESHOLD_LEVEL)
+        await _set_thresholds(rc, [-5.0, 5.0], [])
+        return (no_thresholds,
+                await rc.get_data(Command.GET_THRESHOLD_LEVEL),
+                await rc.get_data(Command.GET_THRESHOLD_LEVEL2))
+
+    assert _run(_with_server(RecorderCommandHandler(recorder), client)) == \
+           (None, 2, 0)
+
+
+def test_set_thresholds_switch_off():
+    recorder = _DetectionRecorder()
+    handler = RecorderCommandHandler(recorder)
+
+    async def client(rc):
+        await rc.negotiate_protocol()
+        await _set_thresholds(rc, [1.0, 2.0], [])
+        thresholds = handler.thresholds.thresholds
+        rc.send(Command.SET_THRESHOLDS + b"invalid")
+        await _processed(rc)
+        return thresholds
+
+    assert _run(_with_server(handler, client)) == [1.0, 2.0]
+    assert handler.thresholds is None
+    assert recorder.force_sensor_processes[0].detection.engine is None
+
+
+def test_filename_and_start():
+    recorder = _DetectionRecorder()
+
+    async def client(rc):
+        await rc.negotiate_protocol()
+        rc.send(Command.FILENAME + b"subject1.csv")
+        rc.send(Command.START)
+        await asyncio.sleep(0.05)
+        # start recording blocks, but doesn't stall the server
+        version = await rc.get_data(Command.GET_VERSION, timeout=0.2)
+        event, _ = await rc.wait_event([Command.FEEDBACK_STARTED], timeout=1)
+        return version, event
+
+    version, event = _run(_with_server(RecorderCommandHandler(recorder),
+                                       client))
+    assert version == forceDAQVersion
+    assert event == Command.FEEDBACK_STARTED
+    assert recorder.is_recording
+    assert recorder.filenames == ["subject1.csv"]
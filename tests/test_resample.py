@@ -0,0 +1,82 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from forceDAQ.data_handling.resample import Resampler, resample_data
+
+
+def _chunked(rs, times, forces, trigger, rng):
+    rtn = []
+    i = 0
+    while i < len(times):
+        n = rng.randint(1, 200)
+        rtn.append(rs.process(times[i:i + n], forces[i:i + n],
+                              trigger[i:i + n]))
+        i += n
+    t, f, tr = rs.flush(n_forces=forces.shape[1])
+    if t is not None:
+        rtn.append((t, f, tr))
+    return [np.concatenate([x[k] for x in rtn]) for k in range(3)]
+
+
+def test_linear_resampling_of_jittered_times():
+    rng = np.random.RandomState(10)
+    times = np.cumsum(rng.choice([0, 1, 1, 1, 2], 3000)) + 100.5
+    times = np.unique(times)
+    forces = np.column_stack((2 * times, -times + 7))
+    trigger = (np.arange(len(times)) % 100 == 0).astype(float)[:, None]
+
+    t, f, tr = _chunked(Resampler(rate=500), times, forces, trigger, rng)
+    np.testing.assert_allclose(np.diff(t), 2.0)
+    assert t[0] == 102 and t[-1] <= times[-1]
+    np.testing.assert_allclose(f, np.column_stack((2 * t, -t + 7)))
+    # trigger: value of the last sample at or before the grid time
+    idx = np.searchsorted(times, t, side="right") - 1
+    np.testing.assert_array_equal(tr[:, 0], trigger[idx, 0])
+
+
+def test_polyphase_keeps_low_frequencies():
+    source_rate = 1000
+    rng = np.random.RandomState(11)
+    times = np.arange(5000) * 1000.0 / source_rate
+    forces = np.column_stack((np.sin(2 * np.pi * 10 * times / 1000.0),
+                              np.sin(2 * np.pi * 300 * times / 1000.0)))
+    trigger = np.zeros((len(times), 1))
+    rs = Resampler(rate=250, method="polyphase", source_rate=source_rate)
+    t, f, tr = _chunked(rs, times, forces, trigger, rng)
+
+    np.testing.assert_allclose(np.diff(t), 4.0)
+    assert len(t) == pytest.approx(len(times) / 4, abs=2)
+    middle = slice(50, -50)
+    # 10 Hz passes (aligned with the timestamps), 300 Hz is removed
+    np.testing.assert_allclose(f[middle, 0],
+            np.sin(2 * np.pi * 10 * t[middle] / 1000.0), atol=1e-3)
+    assert np.max(np.abs(f[middle, 1])) < 1e-2
+
+    # chunking does not change the result
+    rs = Resampler(rate=250, method="polyphase", source_rate=source_rate)
+    t2, f2, _ = rs.process(times, forces, trigger)
+    t3, f3, _ = rs.flush(n_forces=2)
+    np.testing.assert_allclose(np.append(t2, t3), t)
+    np.testing.assert_allclose(np.vstack((f2, f3)), f, atol=1e-12)
+
+
+def test_resample_data_splits_pauses():
+    times = np.append(np.arange(0, 1000), np.arange(5000, 6000)) * 1.0
+    data = OrderedDict()
+    data["time"] = times
+    data["Fz"] = times / 10.0
+    data["trigger1"] = np.zeros(len(times))
+    rtn = resample_data(data, rate=100)
+    assert list(rtn.keys()) == ["time", "Fz", "trigger1"]
+    assert not np.any((rtn["time"] > 999) & (rtn["time"] < 5000))
+    np.testing.assert_allclose(rtn["Fz"], rtn["time"] / 10.0)
+    assert len(rtn["time"]) == 200
+
+
+def test_unknown_method():
+    with pytest.raises(RuntimeError):
+        Resampler(rate=100, method="cubic")
+    with pytest.raises(RuntimeError):
+        Resampler(rate=100, method="polyphase")
@@ -0,0 +1,72 @@
+import gzip
+import os
+
+from forceDAQ._lib.detection import LEVEL_CHANGE, RESPONSE_MINMAX
+from forceDAQ.data_handling.rescore import RescoreSettings, rescore, \
+    rescore_file, save_rescored
+
+
+def _recording(folder, name="a.csv.gz"):
+    """Fz pulse (10 N) from 300 to 599 ms and response (20 N, then -10 N)
+    from 800 ms, detections started at 100 ms (level change) and 700 ms
+    (min/max)"""
+    filename = os.path.join(str(folder), name)
+    with gzip.open(filename, "wt") as fl:
+        fl.write("#Recorded at test\n")
+        fl.write("# Sensor: id=1, name=x, cal-file=None\n")
+        fl.write("time,delay,Fz,trigger1\n")
+        for t in range(1000):
+            if t == 100:
+                fl.write("#T,100,level_change_detection:1\n")
+                fl.write("#UDP,100,trial1\n")
+            elif t == 302:
+                fl.write("#T,302,level_change:1:1\n")
+            elif t == 700:
+                fl.write("#T,700,response_minmax_detection:1:100\n")
+                fl.write("#UDP,700,trial2\n")
+            fz = 10.0 if 300 <= t < 600 else 0.0
+            if t >= 800:
+                fz = 20.0 if t < 850 else -10.0
+            fl.write("{},0,{:.4f},0\n".format(t, fz))
+    return filename
+
+
+def test_rescore_logged_detections(tmp_path):
+    filename = _recording(tmp_path)
+    rows = rescore_file(filename, RescoreSettings([[5], [1, 15]]))
+    assert len(rows) == 4
+    level_change, minmax = rows[:2]
+    assert (level_change["sensor"], level_change["thresholds"]) == \
+           (1, "5.0")
+    assert level_change["detection"] == LEVEL_CHANGE
+    assert (level_change["time"], level_change["value"]) == (302, 1)
+    assert (level_change["online_time"], level_change["online_value"]) == \
+           (302, "1")
+    assert minmax["detection"] == RESPONSE_MINMAX
+    assert minmax["n_samples"] == 100
+    assert minmax["value"] == "0:1"
+    # lower threshold: earlier detection, second threshold in response
+    assert (rows[2]["time"], rows[2]["value"]) == (300, 1)
+    assert rows[3]["value"] == "0:2"
+
+
+def test_rescore_at_markers(tmp_path):
+    filename = _recording(tmp_path)
+    settings = RescoreSettings([-5, 5], marker=b"trial",
+                               detection=RESPONSE_MINMAX, duration=100)
+    rows = rescore_file(filename, settings)
+    assert [r["start_time"] for r in rows] == [100, 700]
+    assert [r["n_samples"] for r in rows] == [100, 100]
+    assert [r["value"] for r in rows] == ["1:2", "0:2"]
+
+
+def test_rescore_folder(tmp_path):
+    _recording(tmp_path, "a.csv.gz")
+    _recording(tmp_path, "b.csv.gz")
+    rows = rescore(str(tmp_path), RescoreSettings([5]), n_processes=2)
+    assert sorted(os.path.basename(r["file"]) for r in rows) == \
+           ["a.csv.gz"] * 2 + ["b.csv.gz"] * 2
+    output = os.path.join(str(tmp_path), "rescored.csv")
+    save_rescored(rows, output)
+    with open(output) as fl:
+        assert len(fl.readlines()) == 5
@@ -0,0 +1,104 @@
+import time
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib.sample_clock import SampleClock, SampleClockMapping
+from forceDAQ.force.sensor import Sensor, SensorSettings
+
+RATE = 1000.0
+DRIFT = 50.0  # ppm
+
+
+def _acquisition(n_blocks, seed=2):
+    """blocks of the polling loop: (latest acquired index, host time (us),
+    indices read in this block)"""
+    rng = np.random.RandomState(seed)
+    period = 1e6 / RATE * (1 + DRIFT * 1e-6)
+    index = 0
+    for _ in range(n_blocks):
+        n = rng.randint(1, 20)
+        latest = index + n - 1
+        # host time is later than the acquisition of the sample
+        host_time = 5000.0 + latest * period + rng.exponential(300)
+        yield latest, host_time, range(index, latest + 1)
+        index = latest + 1
+
+
+def test_timestamps_are_monotonic():
+    clock = SampleClock(rate=RATE, window=200)
+    times = []
+    n_mappings = 0
+    for latest, host_time, indices in _acquisition(3000):
+        clock.update(latest, host_time, next_index=indices[0])
+        n_mappings += clock.pop_mapping() is not None
+        times.extend(clock.time_us(i) for i in indices)
+    assert n_mappings > 50
+    assert np.all(np.diff(times) > 0)
+    assert abs(clock.drift - DRIFT) < 5
+
+
+def test_new_estimate_is_slewed_in():
+    clock = SampleClock(rate=RATE, window=10)
+    clock.update(9, 1000.0 + 9000)
+    assert clock.time_us(10) == 1000.0 + 10000
+    # lower offset: new estimate 500 us earlier
+    clock.update(19, 500.0 + 19000, next_index=10)
+    assert clock.time_us(10) == 1000.0 + 10000  # unchanged
+    assert clock.time_us(10 + clock.window) == 500.0 + 20000
+    steps = np.diff([clock.time_us(i) for i in range(5, 30)])
+    assert np.all(steps >= 500)
+    assert steps.min() < 1000
+
+
+def test_mapping_log_line():
+    clock = SampleClock(rate=RATE, window=10, device_id=3)
+    for latest, host_time, indices in _acquisition(100):
+        clock.update(latest, host_time, next_index=indices[0])
+    mapping = SampleClockMapping.from_log_line(clock.mapping.log_line())
+    assert mapping.device_id == 3
+    assert mapping.ref_index == clock.mapping.ref_index
+    assert abs(mapping.time_us(5000) - clock.mapping.time_us(5000)) < 1
+
+
+class _CountingSensor(Sensor):
+
+    n_queries = 0
+
+    @property
+    def samples_acquired(self):
+        self.n_queries += 1
+        return Sensor.samples_acquired.fget(self)
+
+
+@pytest.fixture
+def dummy_sensor():
+    if Sensor.DAQ_TYPE != "dummy":
+        pytest.skip("requires the dummy DAQ")
+    sensor = _CountingSensor(SensorSettings(device_id=1, sensor_name="test",
+                                            calibration_folder=".",
+                                            rate=2000, convert_to_FT=False))
+    sensor.start_data_acquisition()
+    yield sensor
+    sensor.stop_data_acquisition()
+
+
+def test_dummy_sensor_uses_configured_rate(dummy_sensor):
+    time.sleep(0.1)
+    assert 150 < dummy_sensor.samples_acquired < 400
+
+
+def test_samples_acquired_is_queried_once_per_block(dummy_sensor):
+    times = []
+    for _ in range(5):
+        time.sleep(0.02)
+        n_queries = dummy_sensor.n_queries
+        n_samples = 0
+        while True:
+            times.append(dummy_sensor.poll_data().time)
+            n_samples += 1
+            if dummy_sensor.samples_pending == 0:
+                break
+        assert dummy_sensor.n_queries == n_queries + 1
+        assert n_samples > 10
+    assert np.all(np.diff(times) > 0)
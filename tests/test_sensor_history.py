@@ -0,0 +1,90 @@
+import numpy as np
+
+from forceDAQ._lib.misc import SensorHistory
+
+
+def _blocks(values, rng, max_block=50):
+    i = 0
+    while i < len(values):
+        n = rng.randint(1, max_block)
+        yield values[i:i + n]
+        i += n
+
+
+def test_moving_average_does_not_drift():
+    rng = np.random.RandomState(8)
+    values = rng.normal(1000, 50, (200000, 3))
+    history = SensorHistory(history_size=100, number_of_parameter=3,
+                            correction_interval=10 ** 9)  # no correction
+    max_error = 0
+    n = 0
+    for block in _blocks(values, rng):
+        history.update_block(block)
+        n += len(block)
+        window = values[max(0, n - 100):n]  # prefilled with zeros
+        max_error = max(max_error, np.max(np.abs(
+                        history.moving_average[0] - window.sum(axis=0) / 100)))
+    assert max_error < 1e-10
+
+
+def test_statistics_of_multiple_sensors():
+    rng = np.random.RandomState(9)
+    values = rng.normal(0, 10, (2, 1000, 6))
+    history = SensorHistory(history_size=60, number_of_parameter=6,
+                            n_sensors=2, ema_alpha=0.1)
+    for s in range(2):
+        for block in _blocks(values[s], rng, max_block=80):
+            history.update_block(block, sensor=s)
+    np.testing.assert_allclose(history.history, values[:, -60:])
+    np.testing.assert_allclose(history.moving_average,
+                               values[:, -60:].mean(axis=1))
+    np.testing.assert_allclose(history.calc_history_average(),
+                               values[:, -60:].mean(axis=1))
+    np.testing.assert_allclose(history.moving_median,
+                               np.median(values[:, -60:], axis=1))
+
+    ema = values[:, 0].copy()
+    for x in np.transpose(values, (1, 0, 2))[1:]:
+        ema = 0.9 * ema + 0.1 * x
+    np.testing.assert_allclose(history.exponential_moving_average, ema)
+
+
+def test_history_is_prefilled_with_zeros():
+    history = SensorHistory(history_size=10, number_of_parameter=2)
+    for x in range(1, 5):
+        history.update([x, -x])
+    np.testing.assert_allclose(history.moving_average, [[1.0, -1.0]])
+    np.testing.assert_allclose(history.previous_moving_average,
+                               [[0.6, -0.6]])
+    np.testing.assert_allclose(history.calc_history_average(), [[1.0, -1.0]])
+    np.testing.assert_allclose(history.moving_median, [[0, 0]])
+
+
+class _ListSensorHistory(object):
+    """list implementation of former versions"""
+
+    def __init__(self, history_size, number_of_parameter):
+        self.history = [[0] * number_of_parameter] * history_size
+        self.moving_average = [0] * number_of_parameter
+        self.previous_moving_average = self.moving_average
+
+    def update(self, values):
+        self.previous_moving_average = self.moving_average
+        pop = self.history.pop(0)
+        self.history.append(values)
+        self.moving_average = [a + float(x - p) / len(self.history)
+                               for a, x, p in zip(self.moving_average,
+                                                  values, pop)]
+
+
+def test_same_averages_as_list_implementation():
+    rng = np.random.RandomState(10)
+    history = SensorHistory(history_size=5, number_of_parameter=3)
+    reference = _ListSensorHistory(history_size=5, number_of_parameter=3)
+    for x in rng.randint(0, 100, (50, 3)):
+        history.update(x)
+        reference.update(list(x))
+        np.testing.assert_allclose(history.moving_average[0],
+                                   reference.moving_average)
+        np.testing.assert_allclose(history.previous_moving_average[0],
+                                   reference.previous_moving_average)
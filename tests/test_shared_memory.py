@@ -0,0 +1,93 @@
+from multiprocessing import Process
+
+import numpy as np
+
+from forceDAQ._lib.shared_ring import SharedRingBuffer
+from forceDAQ._lib.shared_sample import SharedSample
+from forceDAQ._lib.sample_markers import SampleMarker, marker_buffer, \
+    write_marker
+
+N_WRITES = 200000
+
+
+def _writer(sample):
+    for cnt in range(1, N_WRITES + 1):
+        x = float(cnt)
+        sample.write(cnt, x, (x,) * 6, (x, x))
+
+
+def test_shared_sample_write_and_read():
+    sample = SharedSample()
+    assert sample.read() is None
+    sample.write(3, 1.5, [1, 2, 3, 4, 5, 6], [0, 1])
+    assert sample.read() == (3, 1.5, (1, 2, 3, 4, 5, 6), (0, 1))
+    assert sample.counter == 3
+
+
+def test_shared_sample_snapshots_are_consistent():
+    sample = SharedSample()
+    writer = Process(target=_writer, args=(sample,))
+    writer.start()
+    n_reads = 0
+    last = 0
+    while writer.is_alive() or n_reads == 0:
+        smpl = sample.read()
+        if smpl is None:
+            continue
+        cnt, t, forces, trigger = smpl
+        # all values of one snapshot stem from the same sample
+        assert forces == (float(cnt),) * 6 and trigger == (t, t)
+        assert t == cnt >= last
+        last = cnt
+        n_reads += 1
+    writer.join()
+    assert sample.read()[0] == N_WRITES
+
+
+def test_ring_buffer_reports_lost_rows():
+    ring = SharedRingBuffer(10, 2)
+    ring.write_block(np.arange(30).reshape((15, 2)))
+    rows, first, nxt, lost = ring.read_since(0)
+    assert (first, nxt, lost) == (5, 15, 5)
+    np.testing.assert_array_equal(rows[:, 0], np.arange(10, 30, 2))
+    ring.write([100, 101])
+    rows, first, nxt, lost = ring.read_since(nxt)
+    assert rows.tolist() == [[100, 101]] and lost == 0
+    assert ring.latest()[0] == 16
+
+
+def test_sample_marker_marks_first_sample_at_or_after_arrival():
+    ring = marker_buffer()
+    write_marker([ring], 1.0)  # before reset, ignored
+    marker = SampleMarker(ring, lookback=100)
+    marker.reset()
+    counts = {}
+    write_marker([ring], 10.0)
+    write_marker([ring], 9.5)
+    write_marker([ring], 11.5)
+    times = [9.0, 10.0, 11.0, 12.0]
+    for idx, cnt in marker.process(times):
+        counts[times[idx]] = cnt
+    assert counts == {10.0: 2, 12.0: 1}
+
+    # marker arrives after the sample has been processed
+    write_marker([ring], 12.6)
+    for idx, cnt in marker.process([13.0]):
+        assert (idx, cnt) == (-1, 1)
+    write_marker([ring], 12.8)  # retrospective: same sample
+    write_marker([ring], 20.0)  # pending, no sample yet
+    assert marker.process([13.5]) == [(-2, 2)]
+    assert marker.process([14.0, 20.0]) == [(-1, 1)]
+
+
+def test_sample_marker_retrospective_marking():
+    ring = marker_buffer()
+    marker = SampleMarker(ring, lookback=100)
+    recent = [0] * 5
+    marker.process(np.arange(5.0))
+    write_marker([ring], 2.0)
+    write_marker([ring], 2.0)
+    write_marker([ring], -3.0)  # older than all samples: oldest sample
+    for idx, cnt in marker.process([]):
+        recent[idx] = cnt
+    assert recent == [1, 0, 2, 0, 0]
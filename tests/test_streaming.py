@@ -0,0 +1,156 @@
+import socket
+import time
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib.shared_ring import SharedRingBuffer
+from forceDAQ._lib import wire_protocol
+from forceDAQ._lib.streaming import STREAM_VALUES, StreamSubscription, \
+    decode_stream_packet, encode_get_values, encode_subscribe, get_values
+from forceDAQ._lib.types import GUIRemoteControlCommands as RcCmd
+from forceDAQ._lib.udp_connection import UDPConnection, UDPConnectionProcess
+
+SERVER_IP = "127.0.0.1"
+CLIENT_IP = "127.0.0.3"
+PORT = 5121
+
+
+def _rows(first, n):
+    """stream buffer rows: time, Fx..Tz = sample index * (1..6), trigger"""
+    idx = np.arange(first, first + n, dtype=float)
+    return np.column_stack([idx * 10] + [idx * k for k in range(1, 7)] +
+                           [idx % 2, np.zeros(n)])
+
+
+def _subscription(selections, **kwargs):
+    payload = encode_subscribe(selections, **kwargs)
+    return StreamSubscription(payload[len(RcCmd.SUBSCRIBE):])
+
+
+def test_subscription_streams_new_samples():
+    ring = SharedRingBuffer(1000, STREAM_VALUES)
+    ring.write_block(_rows(0, 10))
+    sub = _subscription([(0, 2), (0, 6), (1, 0)], packet_rate=50)
+    assert sub.packet_interval == 20
+    assert sub.packets([ring]) == []  # starts with new samples
+    ring.write_block(_rows(10, 5))
+    packets = [decode_stream_packet(p) for p in sub.packets([ring])]
+    assert len(packets) == 1  # no sensor 1
+    p = packets[0]
+    assert (p["seq"], p["sensor"], p["parameters"]) == (0, 0, [2, 6])
+    np.testing.assert_array_equal(p["samples"], np.arange(10, 15))
+    np.testing.assert_array_equal(p["times"], np.arange(10, 15) * 10.0)
+    np.testing.assert_array_equal(p["values"], _rows(10, 5)[:, [3, 7]])
+    assert sub.packets([ring]) == []
+
+
+def test_subscription_decimation_and_packet_size():
+    ring = SharedRingBuffer(1000, STREAM_VALUES)
+    sub = _subscription([(0, p) for p in range(6)], decimation=3)
+    sub.packets([ring])
+    ring.write_block(_rows(0, 900))
+    packets = [decode_stream_packet(p) for p in sub.packets([ring])]
+    assert len(packets) > 1
+    assert [p["seq"] for p in packets] == list(range(len(packets)))
+    samples = np.concatenate([p["samples"] for p in packets])
+    np.testing.assert_array_equal(samples, np.arange(0, 900, 3))
+    values = np.concatenate([p["values"] for p in packets])
+    np.testing.assert_array_equal(values, _rows(0, 900)[::3, 1:7])
+
+
+def test_subscription_counts_lost_samples():
+    ring = SharedRingBuffer(100, STREAM_VALUES)
+    sub = _subscription([(0, 0)])
+    sub.packets([ring])
+    ring.write_block(_rows(0, 250))
+    packets = [decode_stream_packet(p) for p in sub.packets([ring])]
+    assert sub.n_lost == 150
+    assert packets[0]["samples"][0] == 150
+
+
+def test_get_values_of_latest_sample():
+    ring = SharedRingBuffer(100, STREAM_VALUES)
+    payload = encode_get_values([(0, 2), (1, 0), (0, 0), (0, 7)])
+    payload = payload[len(RcCmd.GET_VALUES):]
+    assert get_values([ring], payload) == [(0, None, None, None),
+                                           (1, None, None, None)]
+    ring.write_block(_rows(0, 5))
+    assert get_values([ring], payload) == [(0, 5, 40.0, (12.0, 4.0, 0.0)),
+                                           (1, None, None, None)]
+
+
+def test_decode_stream_packet_ignores_other_data():
+    assert decode_stream_packet(RcCmd.VALUE + b"x") is None
+
+
+@pytest.fixture
+def client():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((CLIENT_IP, PORT))
+    sock.settimeout(2)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def udp_process():
+    ring = SharedRingBuffer(1000, STREAM_VALUES)
+    udp_p = UDPConnectionProcess(ip=SERVER_IP, udp_port=PORT,
+                                 stream_buffers=[ring])
+    udp_p.start()
+    yield udp_p, ring
+    udp_p.quit()
+
+
+def _connect(client):
+    for _ in range(50):
+        client.sendto(UDPConnection.CONNECT, (SERVER_IP, PORT))
+        try:
+            if client.recv(4096) == UDPConnection.COMMAND_REPLY:
+                return
+        except socket.timeout:
+            pass
+    raise RuntimeError("can't connect")
+
+
+def test_udp_process_streams_to_subscriber(udp_process, client):
+    udp_p, ring = udp_process
+    client.settimeout(0.1)
+    _connect(client)
+    client.settimeout(2)
+    client.sendto(encode_subscribe([(0, 2)], packet_rate=100),
+                  (SERVER_IP, PORT))
+    time.sleep(0.1)
+    ring.write_block(_rows(0, 20))
+    packet = decode_stream_packet(client.recv(4096))
+    np.testing.assert_array_equal(packet["samples"], np.arange(20))
+    np.testing.assert_array_equal(packet["values"][:, 0], np.arange(20) * 3)
+
+    client.sendto(RcCmd.UNSUBSCRIBE, (SERVER_IP, PORT))
+    time.sleep(0.1)
+    ring.write_block(_rows(20, 20))
+    client.settimeout(0.2)
+    with pytest.raises(socket.timeout):
+        client.recv(4096)
+
+
+def test_udp_process_answers_get_values(udp_process, client):
+    udp_p, ring = udp_process
+    client.settimeout(0.1)
+    _connect(client)
+    client.settimeout(2)
+    ring.write_block(_rows(0, 3))
+    client.sendto(wire_protocol.encode_request(7, encode_get_values(
+                  [(0, 1)])), (SERVER_IP, PORT))
+    request_id, reply = wire_protocol.decode_reply(client.recv(4096))
+    assert request_id == 7
+    assert reply.startswith(RcCmd.VALUE)
+    assert wire_protocol.decode(reply[len(RcCmd.VALUE):]) == \
+           [(0, 3, 20.0, (4.0,))]
+    # answered by the udp process, not passed to the receive queue
+    client.sendto(b"marker", (SERVER_IP, PORT))
+    batch = udp_p.receive_queue.get(timeout=2)
+    while batch[0].byte_string == UDPConnection.CONNECT:
+        batch = batch[1:] or udp_p.receive_queue.get(timeout=2)
+    assert [d.byte_string for d in batch] == [b"marker"]
@@ -0,0 +1,53 @@
+import os
+import subprocess
+import sys
+
+from forceDAQ._lib import timer as timer_module
+from forceDAQ._lib.timer import ENV_CLOCK, MAX_CLOCK_RESOLUTION, Timer, \
+    calibrate_clocks, get_time_ns
+
+
+def _waited_ms(timer, waiting_time, **kwargs):
+    t0 = get_time_ns()
+    timer.wait(waiting_time, **kwargs)
+    return (get_time_ns() - t0) / 1e6
+
+
+def test_wait_is_not_early():
+    timer = Timer()
+    for waiting_time in (0, 1, 5, 20):
+        waited = _waited_ms(timer, waiting_time)
+        assert waiting_time <= waited < waiting_time + 50
+
+
+def test_function_is_called_while_spinning():
+    calls = []
+    timer = Timer(spin_budget=5)
+    waited = _waited_ms(timer, 10, function=lambda: calls.append(1))
+    assert waited >= 10
+    assert len(calls) > 10
+    # no spinning: function is not called
+    calls = []
+    timer.wait(10, function=lambda: calls.append(1), spin_budget=0)
+    assert len(calls) <= 1
+
+
+def test_clock_selection():
+    sources = calibrate_clocks(n_calls=100, n_repetitions=1)
+    assert len(sources) > 0
+    precise = [c for c in sources if c.resolution <= MAX_CLOCK_RESOLUTION]
+    assert sources[:len(precise)] == sorted(precise,
+                                            key=lambda c: c.overhead_ns)
+    assert os.environ[ENV_CLOCK] == timer_module.clock_source.name
+
+
+def test_clock_is_set_by_environment():
+    env = dict(os.environ)
+    env[ENV_CLOCK] = "monotonic"
+    package_dir = os.path.dirname(os.path.dirname(os.path.dirname(
+                                                timer_module.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join([package_dir] + sys.path)
+    out = subprocess.check_output(
+        [sys.executable, "-c", "from forceDAQ._lib import timer; "
+                               "print(timer.clock_source.name)"], env=env)
+    assert out.decode().split()[-1] == "monotonic"
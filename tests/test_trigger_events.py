@@ -0,0 +1,84 @@
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib.processing import SampleBlock, StageContext
+from forceDAQ._lib.types import ForceData, TriggerEvent
+from forceDAQ.data_handling.trigger_events import extract_trigger_events
+from forceDAQ.force.stages import TriggerEdgeStage
+
+DEVICE_ID = 1
+PERIOD_LENGTH = 500
+
+
+def _periods(n_periods=3, seed=3):
+    """acquisition periods (lists of ForceData) with random trigger pulses,
+    a pulse is still on at the end of each period"""
+    rng = np.random.RandomState(seed)
+    rtn = []
+    t = 1000
+    for _ in range(n_periods):
+        trigger = (rng.uniform(size=(PERIOD_LENGTH, 2)) < 0.1).astype(float)
+        trigger[-5:, 0] = 1
+        rtn.append([ForceData(time=t + i, device_id=DEVICE_ID,
+                              trigger=trigger[i], sample_index=i)
+                    for i in range(PERIOD_LENGTH)])
+        t += PERIOD_LENGTH + 200
+    return rtn
+
+
+def _online(periods, debounce, block_size):
+    buffer = []
+    stage = TriggerEdgeStage(debounce=debounce, block_size=block_size)
+    stage.setup(StageContext(device_id=DEVICE_ID, rate=1000, timer=None,
+                             buffer=buffer))
+    for samples in periods:
+        stage.start()
+        for i in range(0, len(samples), 7):
+            stage.transform(SampleBlock(samples[i:i + 7]))
+        stage.stop()
+    return buffer
+
+
+def _data_frame(periods, with_sample_index):
+    samples = [d for p in periods for d in p]
+    data = OrderedDict()
+    data["time"] = np.array([d.time for d in samples])
+    data["device_tag"] = np.full(len(samples), DEVICE_ID)
+    if with_sample_index:
+        data["sample_index"] = np.array([d.sample_index for d in samples])
+    data["trigger1"] = np.array([d.trigger[0] for d in samples])
+    data["trigger2"] = np.array([d.trigger[1] for d in samples])
+    daq = OrderedDict()
+    daq["time"] = np.array([p[-1].time + 1 for p in periods])
+    daq["value"] = ["pause:{}".format(DEVICE_ID)] * len(periods)
+    return data, daq
+
+
+@pytest.mark.parametrize("with_sample_index", [True, False])
+@pytest.mark.parametrize("debounce", [1, 3])
+def test_online_and_offline_events_are_identical(with_sample_index,
+                                                 debounce):
+    periods = _periods()
+    online = _online(periods, debounce=debounce, block_size=100)
+    assert all(isinstance(x, TriggerEvent) for x in online)
+    open_events = [x for x in online if x.offset_sample is None]
+    assert len(open_events) == len(periods)
+    assert all(x.onset_sample == PERIOD_LENGTH - 5 for x in open_events)
+
+    data, daq = _data_frame(periods, with_sample_index)
+    offline = extract_trigger_events(data, debounce=debounce,
+                                     daq_events=daq)
+
+    key = lambda x: (x.onset_time, x.channel)
+    assert [str(x) for x in sorted(online, key=key)] == \
+           [str(x) for x in sorted(offline, key=key)]
+
+
+def test_open_pulse_is_not_closed_in_next_period():
+    periods = _periods()
+    for evt in _online(periods, debounce=1, block_size=100):
+        if evt.offset_sample is not None:
+            assert evt.offset_sample > evt.onset_sample
+            assert evt.offset_time - evt.onset_time < PERIOD_LENGTH
@@ -0,0 +1,123 @@
+import socket
+import time
+
+import pytest
+
+from forceDAQ._lib.timer import Timer, get_time_ns
+from forceDAQ._lib.types import GUIRemoteControlCommands as RcCmd
+from forceDAQ._lib.udp_connection import Peer, UDPConnection
+
+SERVER_IP = "127.0.0.1"
+CLIENT_IP = "127.0.0.2"
+OTHER_IP = "127.0.0.4"
+PORT = 5119
+
+
+@pytest.fixture
+def connection():
+    udp = UDPConnection(ip=SERVER_IP, udp_port=PORT)
+    yield udp
+    udp.socket.close()
+
+
+def _client_socket(ip):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((ip, PORT))
+    sock.settimeout(1)
+    return sock
+
+
+@pytest.fixture
+def client():
+    sock = _client_socket(CLIENT_IP)
+    yield sock
+    sock.close()
+
+
+@pytest.fixture
+def other_client():
+    sock = _client_socket(OTHER_IP)
+    yield sock
+    sock.close()
+
+
+def _send(client, data):
+    client.sendto(data, (SERVER_IP, PORT))
+    time.sleep(0.01)
+
+
+def test_required_permissions():
+    assert Peer.required_permission(b"marker") == Peer.MARKER
+    assert Peer.required_permission(RcCmd.CLOCK_MAPPING) == Peer.MARKER
+    for cmd in (RcCmd.PING, RcCmd.GET_FX1, RcCmd.SUBSCRIBE,
+                RcCmd.CLOCK_SYNC):
+        assert Peer.required_permission(cmd) == Peer.READ
+    for cmd in (RcCmd.START, RcCmd.QUIT, RcCmd.SET_THRESHOLDS):
+        assert Peer.required_permission(cmd) == Peer.CONTROL
+    assert Peer(CLIENT_IP, Peer.READ).allows(RcCmd.GET_FX1)
+    assert not Peer(CLIENT_IP, Peer.READ).allows(RcCmd.START)
+
+
+def test_peers_and_permissions(client, other_client):
+    connection = UDPConnection(ip=SERVER_IP, udp_port=PORT,
+                               peer_permissions={OTHER_IP: Peer.MARKER})
+    try:
+        _send(client, UDPConnection.CONNECT)
+        _send(other_client, UDPConnection.CONNECT)
+        assert [d for d, _, _ in connection.poll_all()] == \
+               [UDPConnection.CONNECT] * 2
+        assert client.recv(100) == UDPConnection.COMMAND_REPLY
+        assert other_client.recv(100) == UDPConnection.COMMAND_REPLY
+        assert list(connection.peers) == [CLIENT_IP, OTHER_IP]
+        assert connection.peer_ip == OTHER_IP  # connected last
+
+        _send(client, RcCmd.START)
+        _send(other_client, RcCmd.START)  # not permitted
+        _send(other_client, b"marker")
+        assert [(d, ip) for d, _, ip in connection.poll_all()] == \
+               [(RcCmd.START, CLIENT_IP), (b"marker", OTHER_IP)]
+        assert connection.peers[OTHER_IP].n_received == 2
+
+        assert connection.publish(b"feedback")
+        assert client.recv(100) == b"feedback"
+        assert other_client.recv(100) == b"feedback"
+
+        _send(client, UDPConnection.UNCONNECT)
+        connection.poll_all()
+        assert list(connection.peers) == [OTHER_IP]
+    finally:
+        connection.socket.close()
+
+
+def test_unknown_peers_are_rejected(client):
+    connection = UDPConnection(ip=SERVER_IP, udp_port=PORT,
+                               default_permissions=None)
+    try:
+        _send(client, UDPConnection.CONNECT)
+        _send(client, b"marker")
+        assert connection.poll_all() == []
+        assert not connection.is_connected
+    finally:
+        connection.socket.close()
+
+
+def test_timer_from_monotonic_ns():
+    timer = Timer()
+    now = get_time_ns()
+    assert abs(timer.from_monotonic_ns(now) - timer.time_ns) < 50000000
+
+
+def test_kernel_timestamps(connection, client):
+    if not connection.kernel_timestamps:
+        pytest.skip("SO_TIMESTAMPNS not available")
+    _send(client, UDPConnection.CONNECT)
+    assert connection.poll() == UDPConnection.CONNECT
+    client.sendto(b"marker", (SERVER_IP, PORT))
+    sent = connection.timer.time_ns
+    time.sleep(0.05)
+    received = connection.timer.time_ns
+    assert connection.poll_all() == [(b"marker",
+                                      connection.last_receive_time_ns,
+                                      CLIENT_IP)]
+    # arrival time, not the time of reading the socket
+    assert sent - 5000000 < connection.last_receive_time_ns < received
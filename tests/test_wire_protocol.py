@@ -0,0 +1,56 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from forceDAQ._lib import wire_protocol
+from forceDAQ._lib.types import Thresholds
+
+VALUES = [None, True, False, 0, -7, 2 ** 31, -2 ** 40, 1.5, -0.0,
+          "", "text ä", b"\x00\xff", [], [1, 2.5, "x"], (1, (2, None)),
+          [[1, 2], (3.0,), None]]
+
+
+@pytest.mark.parametrize("value", VALUES)
+@pytest.mark.parametrize("version", [wire_protocol.PICKLE,
+                                     wire_protocol.PROTOCOL_VERSION])
+def test_round_trip(value, version):
+    rtn = wire_protocol.decode(wire_protocol.encode(value, version))
+    assert rtn == value and type(rtn) is type(value)
+
+
+def test_numpy_and_thresholds():
+    assert wire_protocol.decode(wire_protocol.encode(np.int64(3))) == 3
+    assert wire_protocol.decode(wire_protocol.encode(np.float32(0.5))) == 0.5
+    thr = Thresholds([3, 1, 2])
+    assert wire_protocol.decode(wire_protocol.encode(thr)) == [1, 2, 3]
+    old = wire_protocol.decode(wire_protocol.encode(thr,
+                                                    wire_protocol.PICKLE))
+    assert isinstance(old, Thresholds) and old.thresholds == [1, 2, 3]
+
+
+def test_binary_payloads_are_compact():
+    assert len(wire_protocol.encode(1.5)) == 10
+    assert len(wire_protocol.encode(7)) == 6
+    assert len(wire_protocol.encode(1.5)) < \
+           len(wire_protocol.encode(1.5, wire_protocol.PICKLE))
+
+
+def test_invalid_payloads():
+    for payload in (b"", b"\x09d", b"\x01d\x00", b"\x01?",
+                    b"\x80\x02garbage"):
+        with pytest.raises(RuntimeError):
+            wire_protocol.decode(payload)
+    # pickled globals other than basic types are not unpickled
+    evil = pickle.dumps(np.arange(3), protocol=2)
+    with pytest.raises(RuntimeError):
+        wire_protocol.decode(evil)
+    with pytest.raises(RuntimeError):
+        wire_protocol.encode(object())
+
+
+def test_negotiate_version():
+    assert wire_protocol.negotiate_version(b"") == wire_protocol.PICKLE
+    assert wire_protocol.negotiate_version(b"\x01") == 1
+    assert wire_protocol.negotiate_version(b"\x05") == \
+           wire_protocol.PROTOCOL_VERSION
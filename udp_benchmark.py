@@ -0,0 +1,326 @@
+# headless benchmark of the udp connection process
+#
+# runs a local stand-in client against UDPConnectionProcess over loopback and
+# reports the cpu usage of the udp process (idle and under load), the round
+# trip times of pings and, under a configurable load of markers and commands,
+# command round trip times, loss and the latency between sending a marker and
+# its timestamp in the data file
+#
+#   python udp_benchmark.py [--pings N] [--duration SEC]
+#                           [--marker-rate HZ] [--command-rate HZ]
+#                           [--command ping|get_values|get_fz]
+#                           [--mode process|handler]
+#
+# --mode process: commands are answered by the udp process (ping, get_values)
+# --mode handler: additionally, a stand-in of the GUI loop processes the
+#   received data (as DataRecorder.process_and_write_udp_events) and answers
+#   remote control commands via RecorderCommandHandler and the send queue
+#   (required for get_fz)
+#
+# --timestamps N: loopback test of the kernel receive timestamps
+# (SO_TIMESTAMPNS, Linux). Reports the difference between user-space
+# stamping after the wake-up and the kernel timestamp (in us).
+
+import argparse
+import json
+import select
+import threading
+from collections import deque
+from queue import Empty
+
+import numpy as np
+try:
+    import psutil
+except ImportError:
+    psutil = None  # no cpu measurements
+
+from forceDAQ._lib.timer import get_time, app_timer
+from forceDAQ._lib.types import GUIRemoteControlCommands as RcCmd
+from forceDAQ._lib.udp_connection import UDPConnection, \
+    UDPConnectionProcess
+from forceDAQ._lib.shared_ring import SharedRingBuffer
+from forceDAQ._lib.streaming import STREAM_VALUES, encode_get_values
+from forceDAQ.remote_control_async import RecorderCommandHandler
+
+SERVER_IP = "127.0.0.1"
+CLIENT_IP = "127.0.0.2"  # loopback as well (Linux, Windows)
+MARKER = b"marker:"
+
+# command: (request, reply prefix)
+COMMANDS = {"ping": (UDPConnection.PING, UDPConnection.COMMAND_REPLY),
+            "get_values": (encode_get_values([(0, 0), (0, 1), (0, 2)]),
+                           RcCmd.VALUE),
+            "get_fz": (RcCmd.GET_FZ1, RcCmd.VALUE)}
+
+
+def _percentiles(values):
+    if len(values) == 0:
+        return None
+    p = np.percentile(values, (50, 90, 99))
+    return {"median": p[0], "p90": p[1], "p99": p[2], "max": np.max(values)}
+
+
+class _StandInSensorProcess(object):
+
+    def __init__(self):
+        self.stream_buffer = SharedRingBuffer(100, STREAM_VALUES)
+        self.stream_buffer.write([0] + [1.0] * (STREAM_VALUES - 1))
+
+    def get_force(self, parameter_id):
+        return 1.0
+
+
+class _StandInRecorder(object):
+    """collects the udp data, which would be written to the file"""
+
+    def __init__(self):
+        self.force_sensor_processes = [_StandInSensorProcess()]
+        self.udp_events = []
+
+    def save_udp_event(self, udp_data):
+        self.udp_events.append(udp_data)
+
+
+class _HandlerLoop(threading.Thread):
+    """stand-in of the GUI process loop"""
+
+    def __init__(self, udp_process, recorder):
+        super(_HandlerLoop, self).__init__()
+        self.daemon = True
+        self.udp_process = udp_process
+        self.handler = RecorderCommandHandler(recorder)
+        self.recorder = recorder
+        self.quit = threading.Event()
+
+    def run(self):
+        while not self.quit.is_set():
+            try:
+                batch = self.udp_process.receive_queue.get(timeout=0.1)
+            except Empty:
+                continue
+            for d in batch:
+                if d.is_remote_control_command:
+                    reply = self.handler.process_command(d)
+                    if reply is not None:
+                        self.udp_process.send_queue.put((reply, d.sender))
+                else:
+                    self.recorder.save_udp_event(d)
+
+
+def cpu_percent(pid, duration):
+    """cpu usage of the process (in percent of one core) or None, if
+    psutil is not installed"""
+    if psutil is None:
+        app_timer.wait(int(duration * 1000))
+        return None
+    proc = psutil.Process(pid)
+    proc.cpu_percent(None)
+    app_timer.wait(int(duration * 1000))
+    return proc.cpu_percent(None)
+
+
+def ping_rtt(client, n_pings, timeout=0.5):
+    """round trip times in ms (float) of pings answered by the udp process"""
+    rtn = []
+    lost = 0
+    for _ in range(n_pings):
+        t = get_time()
+        if client.send(UDPConnection.PING, timeout=timeout) and \
+                client.wait_input(UDPConnection.COMMAND_REPLY,
+                                  duration=timeout):
+            rtn.append((get_time() - t) * 1000)
+        else:
+            lost += 1
+        app_timer.wait(2)
+    return rtn, lost
+
+
+def load_test(client, marker_rate, command_rate, command, duration,
+              reply_timeout=0.5):
+    """sends markers and commands at fixed rates (busy loop)
+
+    Markers contain the send time (us). Replies are assigned to the
+    commands in order.
+
+    returns number of sent markers, round trip times (ms) and number of lost
+    replies
+    """
+    request, reply_prefix = COMMANDS[command]
+    intervals = [1.0 / marker_rate if marker_rate > 0 else None,
+                 1.0 / command_rate if command_rate > 0 else None]
+    start = get_time()
+    next_t = [start, start]
+    n_markers = 0
+    pending = deque()
+    rtt = []
+    lost = 0
+
+    end = start + duration
+    while True:
+        now = get_time()
+        if now < end:
+            if intervals[0] is not None and now >= next_t[0]:
+                client.send(MARKER + "{}:{}".format(
+                            n_markers, app_timer.time_ns).encode())
+                n_markers += 1
+                next_t[0] += intervals[0]
+            if intervals[1] is not None and now >= next_t[1]:
+                pending.append(get_time())
+                client.send(request)
+                next_t[1] += intervals[1]
+        else:
+            # drop replies that timed out
+            while len(pending) > 0 and now - pending[0] > reply_timeout:
+                pending.popleft()
+                lost += 1
+            if len(pending) == 0:
+                break
+
+        rcv = client.poll()
+        while rcv is not None:
+            if rcv[:len(reply_prefix)] == reply_prefix and len(pending) > 0:
+                rtt.append((get_time() - pending.popleft()) * 1000)
+            rcv = client.poll()
+
+    return n_markers, rtt, lost
+
+
+def marker_latencies(udp_data):
+    """latency between sending and timestamp (receive time) of markers
+
+    returns latencies in us (time_us) and in ms (time in data file, time_ns)
+    """
+    lat_us = []
+    lat_file = []
+    for d in udp_data:
+        if not d.startswith(MARKER):
+            continue
+        t_send = int(d.byte_string.split(b":")[2])  # ns
+        lat_us.append(d.time_us - t_send // 1000)
+        lat_file.append((d.time_ns - t_send) / 1000000.0)
+    return lat_us, lat_file
+
+
+def timestamp_difference(n_datagrams=1000, udp_port=5005, delay=0):
+    """differences (us) between user-space receive time and kernel
+    timestamp of datagrams over loopback
+
+    delay: additional delay (ms) before reading, simulates a busy process
+    """
+    server = UDPConnection(udp_port=udp_port, ip=SERVER_IP)
+    client = UDPConnection(udp_port=udp_port, ip=CLIENT_IP)
+    client.peer_ip = SERVER_IP
+    server.peer_ip = CLIENT_IP
+    if not server.kernel_timestamps:
+        raise RuntimeError("Kernel timestamps not supported")
+    rtn = []
+    for cnt in range(n_datagrams):
+        client.send("marker:{}".format(cnt))
+        select.select([server.socket], [], [], 1.0)
+        if delay > 0:
+            app_timer.wait(delay)
+        data = server.poll()
+        t_user = server.timer.time_us
+        if data is not None:
+            rtn.append(t_user - server.last_receive_time_us)
+    return rtn
+
+
+def run(n_pings=500, marker_rate=500, command_rate=100, command="ping",
+        duration=3.0, mode="process", udp_port=5005):
+
+    recorder = _StandInRecorder()
+    udp_p = UDPConnectionProcess(ip=SERVER_IP, udp_port=udp_port,
+                                 stream_buffers=[fsp.stream_buffer for fsp in
+                                            recorder.force_sensor_processes])
+    udp_p.start()
+    client = UDPConnection(udp_port=udp_port, ip=CLIENT_IP)
+    if not client.connect_peer(SERVER_IP):
+        udp_p.quit()
+        raise RuntimeError("Can't connect to udp process")
+    handler_loop = None
+    if mode == "handler":
+        handler_loop = _HandlerLoop(udp_p, recorder)
+        handler_loop.start()
+
+    rtn = {"mode": mode}
+    rtn["cpu_idle"] = cpu_percent(udp_p.pid, duration)
+
+    rtt, lost = ping_rtt(client, n_pings)
+    rtn["ping_rtt_ms"] = _percentiles(rtt)
+    rtn["ping_lost"] = lost
+
+    if psutil is not None:
+        proc = psutil.Process(udp_p.pid)
+        proc.cpu_percent(None)
+    n_markers, rtt, lost = load_test(client, marker_rate=marker_rate,
+                                     command_rate=command_rate,
+                                     command=command, duration=duration)
+    rtn["cpu_load"] = proc.cpu_percent(None) if psutil is not None else None
+    rtn["marker_rate"] = marker_rate
+    rtn["command_rate"] = command_rate
+    rtn["command"] = command
+    rtn["command_rtt_ms"] = _percentiles(rtt)
+    rtn["commands_lost"] = lost
+
+    app_timer.wait(200)
+    if handler_loop is not None:
+        handler_loop.quit.set()
+        handler_loop.join()
+        received = recorder.udp_events
+    else:
+        received = []
+        while True:
+            try:
+                received.extend(udp_p.receive_queue.get(timeout=0.2))
+            except Empty:
+                break
+    lat_us, lat_file = marker_latencies(received)
+    rtn["markers_sent"] = n_markers
+    rtn["markers_received"] = len(lat_file)
+    rtn["marker_latency_us"] = _percentiles(lat_us)
+    rtn["marker_to_file_time_ms"] = _percentiles(lat_file)
+
+    client.unconnect_peer()
+    udp_p.quit()
+    return rtn
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="UDP connection benchmark")
+    parser.add_argument("--pings", type=int, default=500)
+    parser.add_argument("--marker-rate", "--rate", type=float, default=500,
+                        dest="marker_rate",
+                        help="marker rate (Hz) for the load test")
+    parser.add_argument("--command-rate", type=float, default=100,
+                        help="command rate (Hz) for the load test")
+    parser.add_argument("--command", choices=sorted(COMMANDS.keys()),
+                        default="ping")
+    parser.add_argument("--mode", choices=["process", "handler"],
+                        default="process")
+    parser.add_argument("--duration", type=float, default=3.0,
+                        help="duration (sec) of cpu measurements and load test")
+    parser.add_argument("--port", type=int, default=5005)
+    parser.add_argument("--timestamps", type=int, default=0,
+                        help="number of datagrams for the kernel timestamp test")
+    args = parser.parse_args()
+
+    if args.timestamps > 0:
+        rtn = {}
+        for delay in (0, 1):
+            diff = timestamp_difference(args.timestamps, udp_port=args.port,
+                                        delay=delay)
+            rtn["delay_{}ms".format(delay)] = {
+                "user_minus_kernel_us": _percentiles(diff),
+                "min": min(diff), "n": len(diff)}
+        print(json.dumps(rtn, indent=2, default=float))
+        exit()
+
+    if args.command == "get_fz" and args.mode != "handler":
+        parser.error("get_fz requires --mode handler")
+
+    print(json.dumps(run(n_pings=args.pings, marker_rate=args.marker_rate,
+                         command_rate=args.command_rate,
+                         command=args.command, duration=args.duration,
+                         mode=args.mode, udp_port=args.port),
+                     indent=2, default=float))
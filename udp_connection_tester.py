@@ -61,9 +61,9 @@ def server():
 
     connected = None
     while True:
-        data = udp_p.receive_queue.get()
-        if data is not None:
-            # udp_p.send_queue.put(data.string)
+        batch = udp_p.receive_queue.get() # list of UDPData
+        for data in batch:
+            # udp_p.send_queue.put((data.byte_string, data.sender))
             print("received: {}".format(data.byte_string))
 
         if udp_p.event_is_connected.is_set() != connected: